@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
 
 
+import random
+
 from allennlp.models import Model
 
 from nlp_tasks.absa.mining_opinions.sequence_labeling import pytorch_models
+from nlp_tasks.absa.mining_opinions.sequence_labeling import phase_timer
 
 
 class Callback(object):
     """Abstract base class used to build new callbacks.
     """
 
+    trainer = None
+
     def __init__(self):
         pass
 
+    def set_trainer(self, trainer):
+        self.trainer = trainer
+
     def on_epoch_end(self, epoch: int):
         pass
 
@@ -27,20 +35,52 @@ class Callback(object):
 
 
 class EstimateCallback(Callback):
+    """
+    每interval个epoch评估一次data_type_and_data中的数据
+    1. dev的结果和trainer用于early stopping的结果一样时，直接用trainer的结果
+    2. train_sample_size大于0时，只评估固定的一部分训练数据
+    3. test_only_on_best为True时，只在dev的结果是目前最好时评估test
+    """
 
-    def __init__(self, data_type_and_data: dict, estimator: pytorch_models.Estimator, logger):
-        self.data_type_and_data = data_type_and_data
+    def __init__(self, data_type_and_data: dict, estimator: pytorch_models.Estimator, logger,
+                 interval: int = 1, train_sample_size: int = 0, test_only_on_best: bool = False,
+                 seed: int = 776):
+        self.data_type_and_data = dict(data_type_and_data)
         self.estimator = estimator
         self.logger = logger
+        self.interval = interval
+        self.test_only_on_best = test_only_on_best
+        if 'train' in self.data_type_and_data and 0 < train_sample_size < len(self.data_type_and_data['train']):
+            self.data_type_and_data['train'] = random.Random(seed).sample(self.data_type_and_data['train'],
+                                                                          train_sample_size)
+
+    def _is_best_so_far(self):
+        return self.trainer is not None and self.trainer.is_best_so_far()
+
+    def _estimate(self, data_type: str, data, epoch: int = None):
+        if data_type == 'dev' and epoch is not None and self.trainer is not None:
+            result = self.trainer.get_validation_metrics(epoch)
+            if result is not None:
+                return result
+        with phase_timer.phase('estimate_%s' % data_type):
+            return self.estimator.estimate(data)
 
     def on_epoch_end(self, epoch):
+        is_scheduled = (epoch + 1) % self.interval == 0
         for data_type, data in self.data_type_and_data.items():
-            result = self.estimator.estimate(data)
+            if data_type == 'test' and self.test_only_on_best:
+                if not self._is_best_so_far():
+                    continue
+            elif not is_scheduled:
+                continue
+            result = self._estimate(data_type, data, epoch=epoch)
             self.logger.info('epoch: %d data_type: %s result: %s' % (epoch, data_type, str(result)))
 
     def on_batch_end(self, batch: int):
         for data_type, data in self.data_type_and_data.items():
-            result = self.estimator.estimate(data)
+            if data_type == 'test' and self.test_only_on_best and not self._is_best_so_far():
+                continue
+            result = self._estimate(data_type, data)
             self.logger.info('batch: %d data_type: %s result: %s' % (batch, data_type, str(result)))
 
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+aspect term抽取(ATE)的预测结果文件的索引。文件每行一个json，包含text和pred，pred里的aspect term是food-3-4的格式。
+
+每个进程里每个文件只读取和解析一次，aspect term解析成整数的(start, end)；文件的修改时间或大小变化时重新读取。
+评估(每个epoch、每个数据集)和读取数据集(每个数据集)时共用。索引里的对象是共享的，使用时不要修改。
+"""
+
+
+import json
+import os
+import threading
+from typing import *
+
+from nlp_tasks.utils import file_utils
+
+
+def parse_term(term_str: str) -> Tuple[str, int, int]:
+    """
+    :param term_str: 例如food-3-4
+    :return: (term, start, end)，和data_object.aspect_term_str_to_dict一样
+    """
+    parts = term_str.split('-')
+    return '-'.join(parts[:-2]), int(parts[-2]), int(parts[-1])
+
+
+class AtePrediction:
+    """
+    文件里的一行
+    """
+
+    __slots__ = ('line_data', 'text', 'term_strs', 'terms')
+
+    def __init__(self, line_data: dict):
+        self.line_data = line_data
+        self.text: str = line_data['text']
+        self.term_strs: Tuple[str, ...] = tuple(line_data['pred'])
+        self.terms: Tuple[Tuple[str, int, int], ...] = tuple(parse_term(term_str) for term_str in self.term_strs)
+
+
+class AtePredictionIndex:
+    def __init__(self, filepath: str, predictions: List[AtePrediction]):
+        self.filepath = filepath
+        self.predictions = predictions
+        self._offset_and_text_spans = {}
+
+    def text_and_spans(self, offset: int = 0) -> Dict[str, Tuple[Tuple[int, int], ...]]:
+        """
+        :param offset: 加到start和end上，例如TermBiLSTM的输入在aspect term前后加了特殊词
+        :return: text -> 预测的aspect term的(start, end)，同一个text有多行时用最后一行
+        """
+        if offset not in self._offset_and_text_spans:
+            text_and_spans = {}
+            for prediction in self.predictions:
+                text_and_spans[prediction.text] = tuple((start + offset, end + offset)
+                                                        for _, start, end in prediction.terms)
+            self._offset_and_text_spans[offset] = text_and_spans
+        return self._offset_and_text_spans[offset]
+
+
+# 绝对路径 -> ((修改时间, 大小), 索引)
+_filepath_and_index: Dict[str, Tuple[Tuple[int, int], AtePredictionIndex]] = {}
+_lock = threading.Lock()
+
+
+def _file_version(filepath: str) -> Tuple[int, int]:
+    stat = os.stat(filepath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load(filepath: str) -> AtePredictionIndex:
+    """
+    :return: filepath的索引，读取过并且文件没有变化时直接返回
+    """
+    key = os.path.abspath(filepath)
+    version = _file_version(key)
+    with _lock:
+        cached = _filepath_and_index.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    predictions = [AtePrediction(json.loads(line)) for line in file_utils.read_all_lines(filepath)]
+    index = AtePredictionIndex(filepath, predictions)
+    with _lock:
+        _filepath_and_index[key] = (version, index)
+    return index
@@ -18,6 +18,7 @@ from sklearn.model_selection import train_test_split
 from nlp_tasks.common import common_path
 from nlp_tasks.utils import file_utils
 from nlp_tasks.utils import sequence_labeling_utils
+from nlp_tasks.absa.mining_opinions.data_adapter import ate_prediction_index
 
 logger = logging.getLogger(__name__)
 base_data_dir = common_path.get_task_data_dir('absa', is_original=True)
@@ -333,32 +334,30 @@ class ASOTEData(BaseDataset):
 
         error_aspect_term_num = 0
         if ate_result_filepath:
-            ate_result_lines = file_utils.read_all_lines(ate_result_filepath)
-            for line in ate_result_lines:
-                original_line_data = json.loads(line)
-
-                text: str = original_line_data['text']
+            for ate_prediction in ate_prediction_index.load(ate_result_filepath).predictions:
+                text: str = ate_prediction.text
                 words = text.split(' ')
                 polarity = 'positive'
 
-                for aspect_term_str in original_line_data['pred']:
+                for aspect_term_str, (term, start, end) in zip(ate_prediction.term_strs, ate_prediction.terms):
                     key = '%s_%s' % (text, aspect_term_str)
                     if key in keys:
                         continue
 
                     error_aspect_term_num += 1
-                    aspect_term = aspect_term_str_to_dict(aspect_term_str)
+                    aspect_term = {'start': start, 'end': end, 'term': term}
 
                     target_tags = self.to_aspect_tags(aspect_term, words)
 
                     opinion_words_tags = self.to_opinion_tags([], words)
 
                     opinion_words_tags_for_so = self.to_opinion_tags_for_so([], words)
-                    original_line_data['opinion_words_tags_for_so'] = opinion_words_tags_for_so
 
-                    original_line_data_copy = copy.deepcopy(original_line_data)
+                    # 索引里的line_data是共享的，只复制一层
+                    original_line_data_copy = dict(ate_prediction.line_data)
+                    original_line_data_copy['opinion_words_tags_for_so'] = opinion_words_tags_for_so
                     original_line_data_copy['sentence'] = text
-                    original_line_data_copy['words'] = copy.deepcopy(words)
+                    original_line_data_copy['words'] = list(words)
                     original_line_data_copy['polarity'] = polarity
                     original_line_data_copy['aspect_term'] = aspect_term
                     original_line_data_copy['opinions'] = []
@@ -567,29 +566,28 @@ class ASMOTEData(BaseDataset):
             result.append(sentence)
 
         if self.configuration is not None and 'add_predicted_aspect_term' in self.configuration and self.configuration['add_predicted_aspect_term']:
-            ate_result_lines = file_utils.read_all_lines(self.configuration['ate_result_filepath'])
-            for line in ate_result_lines:
-                original_line_data = json.loads(line)
-                text: str = original_line_data['text']
+            for ate_prediction in ate_prediction_index.load(self.configuration['ate_result_filepath']).predictions:
+                text: str = ate_prediction.text
                 words = text.split(' ')
                 polarity = 'positive'
                 if not self.is_include_this_sample(polarity):
                     continue
 
-                for aspect_term_str in original_line_data['pred']:
+                for aspect_term_str, (term, start, end) in zip(ate_prediction.term_strs, ate_prediction.terms):
                     key = '%s_%s' % (text, aspect_term_str)
                     if key in keys:
                         continue
 
-                    aspect_term = aspect_term_str_to_dict(aspect_term_str)
+                    aspect_term = {'start': start, 'end': end, 'term': term}
 
                     target_tags = self.to_aspect_tags(aspect_term, words)
 
                     opinion_words_tags = self.to_opinion_tags([], words)
 
-                    original_line_data_copy = copy.deepcopy(original_line_data)
+                    # 索引里的line_data是共享的，只复制一层
+                    original_line_data_copy = dict(ate_prediction.line_data)
                     original_line_data_copy['sentence'] = text
-                    original_line_data_copy['words'] = copy.deepcopy(words)
+                    original_line_data_copy['words'] = list(words)
                     original_line_data_copy['polarity'] = polarity
                     original_line_data_copy['aspect_term'] = aspect_term
                     original_line_data_copy['opinions'] = []
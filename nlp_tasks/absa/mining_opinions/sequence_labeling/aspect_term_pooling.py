@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+aspect term的表示: aspect term的词的表示的平均，整个batch用一个mask和bmm计算，不需要在forward里逐个读取
+sample['word_indices_of_aspect_terms']
+"""
+
+
+from typing import *
+
+import numpy as np
+import torch
+from allennlp.data.fields import ArrayField
+
+
+def aspect_term_span_fields(word_indices_of_aspect_terms: List[int]):
+    """
+    dataset reader调用，生成模型forward中的aspect_term_span
+    :param word_indices_of_aspect_terms: [start, end)
+    """
+    return {'aspect_term_span': ArrayField(np.array(word_indices_of_aspect_terms, dtype=np.int64), dtype=np.int64)}
+
+
+def aspect_term_span_from_samples(samples: List[dict], device: torch.device):
+    """
+    兼容没有aspect_term_span的旧数据
+    """
+    spans = [sample['word_indices_of_aspect_terms'][: 2] for sample in samples]
+    return torch.tensor(spans, dtype=torch.long, device=device)
+
+
+def average_aspect_terms(word_representations: torch.Tensor, samples: List[dict],
+                         aspect_term_span: torch.Tensor = None):
+    """
+    :param word_representations: (batch_size, word_num, hidden_size)
+    :param samples: aspect_term_span为None时，从sample['word_indices_of_aspect_terms']生成
+    :param aspect_term_span: (batch_size, 2)，每个aspect term的[start, end)
+    :return: (batch_size, hidden_size)
+    """
+    if aspect_term_span is None:
+        aspect_term_span = aspect_term_span_from_samples(samples, word_representations.device)
+    aspect_term_span = aspect_term_span.long()
+    positions = torch.arange(word_representations.size(1), device=word_representations.device).unsqueeze(0)
+    aspect_term_mask = (positions >= aspect_term_span[:, 0: 1]) & (positions < aspect_term_span[:, 1: 2])
+    aspect_term_mask = aspect_term_mask.to(word_representations.dtype)
+    aspect_term_word_num = aspect_term_mask.sum(dim=1, keepdim=True).clamp(min=1)
+    aspect_term_sum = torch.bmm(aspect_term_mask.unsqueeze(1), word_representations).squeeze(1)
+    return aspect_term_sum / aspect_term_word_num
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+在后台线程里生成batch: iterator的index、padding和as_tensor_dict(以及GPU训练时的pin_memory)在后台线程里进行，
+训练线程只从有界的队列里取batch。队列满时后台线程等待，队列空时训练线程等待(starved)，等待的次数和时间用于判断
+batch的生成是不是瓶颈。
+
+用线程而不是进程: instance不需要pickle，torch的计算不持有GIL，模型计算时后台线程可以生成下一个batch。
+"""
+
+
+import logging
+import queue
+import threading
+import time
+from typing import *
+
+import torch
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+_END = object()
+
+
+class _ProducerError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def pin_memory(data):
+    if isinstance(data, torch.Tensor):
+        return data.pin_memory()
+    if isinstance(data, dict):
+        return {key: pin_memory(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [pin_memory(value) for value in data]
+    return data
+
+
+def move_to_device(data, cuda_device: int):
+    """
+    和allennlp.nn.util.move_to_device一样，pin_memory之后的tensor异步复制到GPU
+    """
+    if cuda_device < 0:
+        return data
+    if isinstance(data, torch.Tensor):
+        return data.cuda(cuda_device, non_blocking=data.is_pinned())
+    if isinstance(data, dict):
+        return {key: move_to_device(value, cuda_device) for key, value in data.items()}
+    if isinstance(data, list):
+        return [move_to_device(value, cuda_device) for value in data]
+    if isinstance(data, tuple):
+        return tuple(move_to_device(value, cuda_device) for value in data)
+    return data
+
+
+class BatchPrefetcher:
+    """
+    for batch in BatchPrefetcher(iterator(instances, num_epochs=1), queue_size=2): ...
+    每次迭代启动一个后台线程
+    """
+
+    def __init__(self, batches: Iterable[dict], queue_size: int = 2, pin_memory: bool = False):
+        self.batches = batches
+        self.queue_size = queue_size
+        self.pin_memory = pin_memory
+        # 训练线程取batch的次数、队列为空需要等待的次数、等待的秒数
+        self.batch_num = 0
+        self.starved_num = 0
+        self.wait_seconds = 0.0
+        self._queue = None
+        self._stop = None
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for batch in self.batches:
+                if self.pin_memory:
+                    batch = pin_memory(batch)
+                if not self._put(batch):
+                    return
+        except BaseException as e:  # pylint: disable=broad-except
+            self._put(_ProducerError(e))
+        else:
+            self._put(_END)
+
+    def __iter__(self) -> Iterator[dict]:
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                if self._queue.empty():
+                    self.starved_num += 1
+                start = time.perf_counter()
+                item = self._queue.get()
+                self.wait_seconds += time.perf_counter() - start
+                if item is _END:
+                    return
+                if isinstance(item, _ProducerError):
+                    raise item.exception
+                self.batch_num += 1
+                yield item
+        finally:
+            # 训练线程提前结束时让后台线程退出
+            self._stop.set()
+            producer.join()
+
+    def get_stats(self) -> Dict[str, float]:
+        return {'batch_num': self.batch_num,
+                'starved_num': self.starved_num,
+                'wait_seconds': self.wait_seconds}
+
+    def log_stats(self, description: str = 'prefetch'):
+        logger.info('%s: %d batches, starved %d times, waited %.3f seconds' %
+                    (description, self.batch_num, self.starved_num, self.wait_seconds))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+CRF的batch viterbi解码: 整个batch的(batch_size, max_len, num_tags)在模型所在的设备上一起解码，代替
+ConditionalRandomField.viterbi_tags逐句在CPU上解码。转移矩阵和viterbi_tags一样加上约束(例如BIO里O后面不能是I)，
+结果也和viterbi_tags一样。
+
+只依赖torch，viterbi_decode可以被TorchScript编译(towe_export.py)。
+"""
+
+
+from typing import *
+
+import torch
+
+
+def constrained_transitions(crf) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    :param crf: allennlp的ConditionalRandomField
+    :return: 加上约束后的transitions (num_tags, num_tags)、start_transitions (num_tags,)、end_transitions (num_tags,)，
+    不允许的转移为-10000，和ConditionalRandomField.viterbi_tags一样
+    """
+    num_tags = crf.num_tags
+    start_tag = num_tags
+    end_tag = num_tags + 1
+    constraint_mask = crf._constraint_mask.detach()
+    transitions = (crf.transitions.detach() * constraint_mask[:num_tags, :num_tags] +
+                   -10000.0 * (1 - constraint_mask[:num_tags, :num_tags]))
+    start_transitions = -10000.0 * (1 - constraint_mask[start_tag, :num_tags])
+    end_transitions = -10000.0 * (1 - constraint_mask[:num_tags, end_tag])
+    if crf.include_start_end_transitions:
+        start_transitions = start_transitions + crf.start_transitions.detach() * constraint_mask[start_tag, :num_tags]
+        end_transitions = end_transitions + crf.end_transitions.detach() * constraint_mask[:num_tags, end_tag]
+    return transitions, start_transitions, end_transitions
+
+
+def viterbi_decode(logits: torch.Tensor, mask: torch.Tensor, transitions: torch.Tensor,
+                   start_transitions: torch.Tensor, end_transitions: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    :param logits: (batch_size, max_len, num_tags)
+    :param mask: (batch_size, max_len)，每个句子前面的词为1，padding为0
+    :return: (batch_size, max_len)的标签id，padding的位置为0；每个句子最优路径的分数 (batch_size,)
+    """
+    batch_size, sequence_length, num_tags = logits.size()
+    logits = logits.detach()
+    mask = mask > 0
+    score = start_transitions.unsqueeze(0) + logits[:, 0]
+    identity = torch.arange(num_tags, device=logits.device).unsqueeze(0).expand(batch_size, num_tags)
+    backpointers: List[torch.Tensor] = []
+    for t in range(1, sequence_length):
+        next_score, backpointer = (score.unsqueeze(2) + transitions.unsqueeze(0)).max(dim=1)
+        mask_of_t = mask[:, t].unsqueeze(1)
+        # padding的位置保持分数不变，回溯时原样经过
+        score = torch.where(mask_of_t, next_score + logits[:, t], score)
+        backpointers.append(torch.where(mask_of_t, backpointer, identity))
+    best_score, best_tag = (score + end_transitions.unsqueeze(0)).max(dim=1)
+    best_tags = [best_tag]
+    for i in range(len(backpointers) - 1, -1, -1):
+        best_tag = backpointers[i].gather(1, best_tag.unsqueeze(1)).squeeze(1)
+        best_tags.append(best_tag)
+    best_tags.reverse()
+    tags = torch.stack(best_tags, dim=1) * mask.long()
+    return tags, best_score
+
+
+def viterbi_tags(crf, logits: torch.Tensor, mask: torch.Tensor) -> Tuple[torch.Tensor, List[List[int]]]:
+    """
+    :param crf: allennlp的ConditionalRandomField
+    :return: (batch_size, max_len)的标签id，和viterbi_tags一样每个句子的标签id的列表(不包括padding)
+    """
+    transitions, start_transitions, end_transitions = constrained_transitions(crf)
+    tags, _ = viterbi_decode(logits, mask, transitions, start_transitions, end_transitions)
+    lengths = (mask > 0).long().sum(dim=1)
+    # 只在这里复制到CPU一次
+    predicted_tags = [row[: length] for row, length in zip(tags.tolist(), lengths.tolist())]
+    return tags, predicted_tags
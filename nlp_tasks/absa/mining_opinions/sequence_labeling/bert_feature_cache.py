@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+fixed_bert为True时bert的参数不更新，同一个word piece序列每个epoch、每次评估的bert输出都一样。
+BertFeatureStore把每个word piece序列的最后一层输出按(word piece id, token type id)的哈希保存在磁盘上，
+读取时用np.memmap打开，多个进程共享操作系统的page cache；CachedBertEmbedder代替BertEmbedder，
+只对没有缓存过的序列调用bert。
+
+缓存的是bert在eval模式(没有dropout)下的输出。
+
+目录结构:
+    spec.json: hidden_size、dtype
+    features.bin: 所有序列的输出按行拼接，每行hidden_size个数
+    index.tsv: 每行一个序列: key、起始行、word piece个数，只追加
+
+写的时候中断会在features.bin最后留下不完整的行、在index.tsv最后留下不完整的一行，下次追加之前先截掉。
+"""
+
+
+import contextlib
+import hashlib
+import json
+import os
+from typing import *
+
+import numpy as np
+import torch
+from allennlp.modules.token_embedders import TokenEmbedder
+from allennlp.modules.token_embedders.bert_token_embedder import BertEmbedder
+from allennlp.nn import util
+
+try:
+    import fcntl
+except ImportError:
+    # windows上没有fcntl，不支持多个进程同时写同一个缓存
+    fcntl = None
+
+
+FORMAT_VERSION = 1
+
+SPEC_FILENAME = 'spec.json'
+FEATURES_FILENAME = 'features.bin'
+INDEX_FILENAME = 'index.tsv'
+
+
+def feature_key(input_ids: np.ndarray, token_type_ids: np.ndarray) -> str:
+    """
+    :param input_ids: 一个序列的word piece id，不包含padding
+    :param token_type_ids: 和input_ids一样长
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(input_ids.astype(np.int64).tobytes())
+    sha1.update(b'|')
+    sha1.update(token_type_ids.astype(np.int64).tobytes())
+    return sha1.hexdigest()
+
+
+def bert_file_fingerprint(bert_file_path: str) -> str:
+    """
+    :param bert_file_path: bert的压缩包或目录，也可以是pytorch_pretrained_bert的模型名
+    :return: 路径、大小和修改时间的md5，同一个路径下的bert被替换后不会用到旧的缓存
+    """
+    if os.path.isdir(bert_file_path):
+        filepaths = sorted(os.path.join(bert_file_path, filename) for filename in os.listdir(bert_file_path))
+    elif os.path.exists(bert_file_path):
+        filepaths = [bert_file_path]
+    else:
+        filepaths = []
+    lines = [bert_file_path]
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        lines.append('%s\t%d\t%d' % (os.path.basename(filepath), stat.st_size, stat.st_mtime_ns))
+    return hashlib.md5('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class BertFeatureStore:
+    """
+    word piece序列 -> bert最后一层的输出(word piece个数, hidden_size)
+    """
+
+    def __init__(self, store_dir: str, hidden_size: int, dtype: str = 'float16'):
+        self.store_dir = store_dir
+        self.hidden_size = hidden_size
+        self.dtype = np.dtype(dtype)
+        self._index = None
+        self._index_file_position = 0
+        self._features = None
+
+    def __getstate__(self):
+        # 模型被torch.save整个保存，只保存目录和格式
+        return {'store_dir': self.store_dir, 'hidden_size': self.hidden_size, 'dtype': self.dtype.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'], state['hidden_size'], dtype=state['dtype'])
+
+    def _path(self, filename):
+        return os.path.join(self.store_dir, filename)
+
+    def _check_spec(self):
+        spec = {'format_version': FORMAT_VERSION, 'hidden_size': self.hidden_size, 'dtype': self.dtype.name}
+        spec_filepath = self._path(SPEC_FILENAME)
+        if os.path.exists(spec_filepath):
+            with open(spec_filepath, encoding='utf-8') as spec_file:
+                saved_spec = json.load(spec_file)
+            if saved_spec != spec:
+                raise ValueError('bert feature cache %s was saved with %s, expected %s' %
+                                 (self.store_dir, saved_spec, spec))
+        else:
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(spec_filepath, mode='w', encoding='utf-8') as spec_file:
+                json.dump(spec, spec_file)
+
+    def _read_new_index_entries(self):
+        if self._index is None:
+            self._check_spec()
+            self._index = {}
+            self._index_file_position = 0
+        index_filepath = self._path(INDEX_FILENAME)
+        if not os.path.exists(index_filepath):
+            return
+        with open(index_filepath, mode='rb') as index_file:
+            index_file.seek(self._index_file_position)
+            for line in index_file:
+                # 其它进程可能正在写最后一行
+                if not line.endswith(b'\n'):
+                    break
+                key, row_start, length = line.decode('utf-8').rstrip('\n').split('\t')
+                self._index[key] = (int(row_start), int(length))
+                self._index_file_position += len(line)
+
+    def _rows(self, row_end: int):
+        if self._features is None or self._features.shape[0] < row_end:
+            row_num = os.path.getsize(self._path(FEATURES_FILENAME)) // (self.hidden_size * self.dtype.itemsize)
+            self._features = np.memmap(self._path(FEATURES_FILENAME), dtype=self.dtype, mode='r',
+                                       shape=(row_num, self.hidden_size))
+        return self._features
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        :return: 每个key的输出，没有缓存的为None
+        """
+        if self._index is None or any(key not in self._index for key in keys):
+            self._read_new_index_entries()
+        result = []
+        for key in keys:
+            if key not in self._index:
+                result.append(None)
+                continue
+            row_start, length = self._index[key]
+            result.append(self._rows(row_start + length)[row_start: row_start + length])
+        return result
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(SPEC_FILENAME), mode='rb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _truncate_incomplete_tail(self, row_bytes: int) -> int:
+        """
+        持有锁时调用，截掉上次中断的写留下的不完整的行
+        :return: features.bin里完整的行数，也就是下一行的起始行
+        """
+        features_filepath = self._path(FEATURES_FILENAME)
+        row_num = 0
+        if os.path.exists(features_filepath):
+            features_size = os.path.getsize(features_filepath)
+            row_num = features_size // row_bytes
+            if features_size != row_num * row_bytes:
+                os.truncate(features_filepath, row_num * row_bytes)
+        index_filepath = self._path(INDEX_FILENAME)
+        if os.path.exists(index_filepath):
+            with open(index_filepath, mode='rb+') as index_file:
+                index_size = index_file.seek(0, os.SEEK_END)
+                # 一行只有几十个字节
+                tail_start = max(0, index_size - 4096)
+                index_file.seek(tail_start)
+                tail = index_file.read()
+                if len(tail) > 0 and not tail.endswith(b'\n'):
+                    index_file.truncate(tail_start + tail.rfind(b'\n') + 1)
+        return row_num
+
+    def put_many(self, keys: List[str], features: List[np.ndarray]):
+        """
+        :param features: 每个序列的输出，shape是(word piece个数, hidden_size)
+        """
+        self._read_new_index_entries()
+        with self._locked():
+            row_bytes = self.hidden_size * self.dtype.itemsize
+            row_start = self._truncate_incomplete_tail(row_bytes)
+            self._read_new_index_entries()
+            features_filepath = self._path(FEATURES_FILENAME)
+            index_lines = []
+            new_keys = set()
+            with open(features_filepath, mode='ab') as features_file:
+                for key, feature in zip(keys, features):
+                    if key in self._index or key in new_keys:
+                        continue
+                    new_keys.add(key)
+                    features_file.write(np.ascontiguousarray(feature, dtype=self.dtype).tobytes())
+                    index_lines.append('%s\t%d\t%d\n' % (key, row_start, len(feature)))
+                    row_start += len(feature)
+            # 先写输出再写索引，索引里的每一行对应的输出都已经写完
+            with open(self._path(INDEX_FILENAME), mode='a', encoding='utf-8') as index_file:
+                index_file.write(''.join(index_lines))
+            self._read_new_index_entries()
+
+    def __len__(self):
+        self._read_new_index_entries()
+        return len(self._index)
+
+
+class CachedBertEmbedder(TokenEmbedder):
+    """
+    和BertEmbedder(top_layer_only=True)的输入输出一样。bert的参数需要梯度、输入超过max_pieces或者有多余维度时
+    直接调用bert_embedder
+    """
+
+    def __init__(self, bert_embedder: BertEmbedder, store: BertFeatureStore):
+        super().__init__()
+        self.bert_embedder = bert_embedder
+        self.store = store
+
+    def get_output_dim(self) -> int:
+        return self.bert_embedder.get_output_dim()
+
+    def _use_store(self, input_ids: torch.Tensor):
+        if self.store is None or self.bert_embedder._scalar_mix is not None:
+            return False
+        if input_ids.dim() != 2 or input_ids.size(1) > self.bert_embedder.max_pieces:
+            return False
+        return not any(parameter.requires_grad for parameter in self.bert_embedder.bert_model.parameters())
+
+    def _run_bert(self, input_ids: torch.Tensor, token_type_ids: torch.Tensor):
+        bert_model = self.bert_embedder.bert_model
+        training = bert_model.training
+        bert_model.eval()
+        try:
+            with torch.no_grad():
+                all_encoder_layers, _ = bert_model(input_ids=input_ids, token_type_ids=token_type_ids,
+                                                   attention_mask=(input_ids != 0).long())
+        finally:
+            bert_model.train(training)
+        return all_encoder_layers[-1]
+
+    def encode(self, input_ids: torch.Tensor, token_type_ids: torch.Tensor = None) -> torch.Tensor:
+        """
+        :param input_ids: (batch_size, piece_num)
+        :param token_type_ids: (batch_size, piece_num)
+        :return: (batch_size, piece_num, hidden_size)，padding的位置为0
+        """
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        input_ids_numpy = input_ids.cpu().numpy()
+        token_type_ids_numpy = token_type_ids.cpu().numpy()
+        lengths = (input_ids_numpy != 0).sum(axis=1)
+        keys = [feature_key(input_ids_numpy[i, : length], token_type_ids_numpy[i, : length])
+                for i, length in enumerate(lengths)]
+        features = self.store.get_many(keys)
+
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if len(missing) > 0:
+            missing_index = torch.tensor(missing, device=input_ids.device)
+            missing_length = int(lengths[missing].max())
+            top_layer = self._run_bert(input_ids.index_select(0, missing_index)[:, : missing_length],
+                                       token_type_ids.index_select(0, missing_index)[:, : missing_length])
+            top_layer = top_layer.cpu().numpy()
+            # 第一次计算的结果也用保存的精度，和之后从缓存读到的一样
+            computed = [top_layer[j, : lengths[i]].astype(self.store.dtype) for j, i in enumerate(missing)]
+            self.store.put_many([keys[i] for i in missing], computed)
+            for j, i in enumerate(missing):
+                features[i] = computed[j]
+
+        result = np.zeros((input_ids.size(0), input_ids.size(1), self.get_output_dim()), dtype=np.float32)
+        for i, feature in enumerate(features):
+            result[i, : lengths[i]] = feature
+        return torch.from_numpy(result).to(input_ids.device)
+
+    def forward(self, input_ids: torch.LongTensor, offsets: torch.LongTensor = None,
+                token_type_ids: torch.LongTensor = None) -> torch.Tensor:
+        # pylint: disable=arguments-differ
+        if not self._use_store(input_ids):
+            return self.bert_embedder(input_ids, offsets=offsets, token_type_ids=token_type_ids)
+        features = self.encode(input_ids, token_type_ids=token_type_ids)
+        if offsets is None:
+            return features
+        range_vector = util.get_range_vector(offsets.size(0), device=util.get_device_of(features)).unsqueeze(1)
+        return features[range_vector, offsets]
+
+
+def cached_bert_embedders(model: torch.nn.Module) -> List[CachedBertEmbedder]:
+    return [module for module in model.modules() if isinstance(module, CachedBertEmbedder)]
+
+
+def precompute(model: torch.nn.Module, batches: Iterable[dict], field_name: str = 'bert'):
+    """
+    训练之前对所有数据调用一次bert，之后的epoch和评估只读缓存
+    :param batches: iterator生成的batch，已经在模型所在的设备上
+    :param field_name: word piece的TextField在batch中的名字
+    """
+    embedders = [embedder for embedder in cached_bert_embedders(model) if embedder.store is not None]
+    if len(embedders) == 0:
+        return
+    # 多个CachedBertEmbedder用同一个目录时只需要算一次
+    store_dir_and_embedder = {}
+    for embedder in embedders:
+        store_dir_and_embedder.setdefault(embedder.store.store_dir, embedder)
+    for batch in batches:
+        if field_name not in batch:
+            return
+        bert = batch[field_name]
+        for embedder in store_dir_and_embedder.values():
+            if embedder._use_store(bert[field_name]):
+                embedder.encode(bert[field_name], token_type_ids=bert.get(field_name + '-type-ids'))
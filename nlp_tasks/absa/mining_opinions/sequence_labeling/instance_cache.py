@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+列式存储的instance缓存，替代pickle整个instance列表的data文件
+
+每个split的每个field的每一列存成一个扁平的numpy数组(values)加一个偏移表(offsets)，读取时用
+np.load(mmap_mode='r')打开，多个进程共享操作系统的page cache。字符串(词、标签)统一存在一个字符串表里，
+列里只存字符串的id。如果保存时instance已经用vocab索引过，索引结果也一起保存，读取时vocab没变的话
+instance直接标记为已索引，迭代器不需要再索引一遍。读取时只生成LazyInstance，第一次访问fields时才从列里生成field，
+例如只评估test时不会生成train和dev的field。
+
+MetadataField里的sample是任意的dict，仍然用pickle保存；已经放到sample_table里的sample只保存一次表和每个instance的id。
+"""
+
+
+import hashlib
+import json
+import os
+import pickle
+from typing import *
+
+import numpy as np
+from allennlp.data.fields import ArrayField
+from allennlp.data.fields import Field
+from allennlp.data.fields import LabelField
+from allennlp.data.fields import MetadataField
+from allennlp.data.fields import MultiLabelField
+from allennlp.data.fields import SequenceLabelField
+from allennlp.data.fields import TextField
+from allennlp.data.instance import Instance
+from allennlp.data.tokenizers import Token
+from allennlp.data.vocabulary import Vocabulary
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import sample_table
+
+
+FORMAT_VERSION = 1
+
+SPEC_FILENAME = 'spec.json'
+STRINGS_FILENAME = 'strings.pkl'
+TOKEN_INDEXERS_FILENAME = 'token_indexers.pkl'
+
+
+def vocab_fingerprint(vocab: Vocabulary):
+    """
+    :return: vocab的md5，用于判断缓存的索引结果是否还可以用
+    """
+    md5 = hashlib.md5()
+    for namespace in sorted(vocab._index_to_token.keys()):
+        index_to_token = vocab.get_index_to_token_vocabulary(namespace)
+        md5.update(namespace.encode('utf-8'))
+        for index in sorted(index_to_token.keys()):
+            md5.update(('%d\t%s\n' % (index, index_to_token[index])).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def cache_exists(cache_dir: str):
+    spec_filepath = os.path.join(cache_dir, SPEC_FILENAME)
+    if not os.path.exists(spec_filepath):
+        return False
+    with open(spec_filepath, encoding='utf-8') as spec_file:
+        spec = json.load(spec_file)
+    return spec['format_version'] == FORMAT_VERSION
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings = []
+        self.string_and_id = {}
+
+    def get_id(self, string: str):
+        if string not in self.string_and_id:
+            self.string_and_id[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_and_id[string]
+
+
+class _ColumnWriter:
+    """
+    一列: 所有instance的值拼成一个扁平数组，第i个instance的值是values[offsets[i]: offsets[i + 1]]
+    """
+
+    def __init__(self):
+        self.values = []
+        self.offsets = [0]
+
+    def add(self, values: Iterable):
+        self.values.extend(values)
+        self.offsets.append(len(self.values))
+
+    def save(self, filepath_prefix: str, dtype):
+        np.save(filepath_prefix + '.values.npy', np.asarray(self.values, dtype=dtype))
+        np.save(filepath_prefix + '.offsets.npy', np.asarray(self.offsets, dtype=np.int64))
+
+
+class _ColumnReader:
+    def __init__(self, filepath_prefix: str):
+        self.values = np.load(filepath_prefix + '.values.npy', mmap_mode='r')
+        self.offsets = np.load(filepath_prefix + '.offsets.npy', mmap_mode='r')
+
+    def get(self, i: int):
+        return self.values[self.offsets[i]: self.offsets[i + 1]]
+
+
+def _field_type(field: Field):
+    if isinstance(field, TextField):
+        return 'text'
+    elif isinstance(field, SequenceLabelField):
+        return 'sequence_label'
+    elif isinstance(field, MultiLabelField):
+        return 'multi_label'
+    elif isinstance(field, LabelField):
+        return 'label'
+    elif isinstance(field, ArrayField):
+        return 'array'
+    elif isinstance(field, MetadataField):
+        return 'metadata'
+    else:
+        raise NotImplementedError('unsupported field: %s' % field.__class__.__name__)
+
+
+def _field_spec(field_name: str, field: Field, instance: Instance):
+    field_type = _field_type(field)
+    result = {'type': field_type}
+    if field_type == 'text':
+        result['indexer_name_to_indexed_token'] = field._indexer_name_to_indexed_token
+    elif field_type == 'sequence_label':
+        result['namespace'] = field._label_namespace
+        sequence_field_names = [name for name, e in instance.fields.items() if e is field.sequence_field]
+        if len(sequence_field_names) == 0:
+            raise NotImplementedError('the sequence field of %s is not in the instance' % field_name)
+        result['sequence_field'] = sequence_field_names[0]
+    elif field_type == 'label':
+        result['namespace'] = field._label_namespace
+        result['skip_indexing'] = field._skip_indexing
+    elif field_type == 'multi_label':
+        result['namespace'] = field._label_namespace
+        result['skip_indexing'] = len(field.labels) > 0 and isinstance(field.labels[0], int)
+        # 索引后_num_labels是vocab的大小，只有skip_indexing时才是构造时传入的
+        result['num_labels'] = field._num_labels if result['skip_indexing'] else None
+    elif field_type == 'array':
+        result['dtype'] = np.dtype(field.dtype).str
+    return result
+
+
+def _save_split(instances: List[Instance], split_dir: str, string_table: _StringTable,
+                field_name_and_token_indexers: dict, indexed: bool):
+    os.makedirs(split_dir, exist_ok=True)
+    field_specs = {}
+    for instance in instances:
+        for field_name, field in instance.fields.items():
+            if field_name not in field_specs:
+                field_specs[field_name] = _field_spec(field_name, field, instance)
+            if isinstance(field, TextField) and field_name not in field_name_and_token_indexers:
+                field_name_and_token_indexers[field_name] = field._token_indexers
+
+    field_name_and_columns = {field_name: {} for field_name in field_specs}
+    present = {field_name: [] for field_name in field_specs}
+    metadata = {field_name: [] for field_name, spec in field_specs.items() if spec['type'] == 'metadata'}
+
+    def column(field_name, column_name, instance_index):
+        columns = field_name_and_columns[field_name]
+        if column_name not in columns:
+            columns[column_name] = _ColumnWriter()
+            # 前面的instance没有这一列
+            columns[column_name].offsets.extend([0] * instance_index)
+        return columns[column_name]
+
+    for i, instance in enumerate(instances):
+        for field_name, spec in field_specs.items():
+            field = instance.fields.get(field_name)
+            present[field_name].append(field is not None)
+            field_type = spec['type']
+            if field_type == 'metadata':
+                metadata[field_name].append(field.metadata if field is not None else None)
+                continue
+            if field is None:
+                for e in field_name_and_columns[field_name].values():
+                    e.add([])
+                continue
+            if field_type == 'text':
+                column(field_name, 'tokens', i).add([string_table.get_id(token.text) for token in field.tokens])
+                if indexed:
+                    for indexed_key, token_ids in field._indexed_tokens.items():
+                        column(field_name, 'indexed.' + indexed_key, i).add(token_ids)
+            elif field_type == 'sequence_label':
+                column(field_name, 'labels', i).add([string_table.get_id(label) for label in field.labels])
+                if indexed:
+                    column(field_name, 'label_ids', i).add(field._indexed_labels)
+            elif field_type == 'label':
+                if spec['skip_indexing']:
+                    column(field_name, 'label_ids', i).add([field.label])
+                else:
+                    column(field_name, 'labels', i).add([string_table.get_id(field.label)])
+                    if indexed:
+                        column(field_name, 'label_ids', i).add([field._label_id])
+            elif field_type == 'multi_label':
+                if spec['skip_indexing']:
+                    column(field_name, 'label_ids', i).add(field.labels)
+                else:
+                    column(field_name, 'labels', i).add([string_table.get_id(label) for label in field.labels])
+                    if indexed:
+                        column(field_name, 'label_ids', i).add(field._label_ids)
+            elif field_type == 'array':
+                column(field_name, 'values', i).add(field.array.reshape(-1).tolist())
+                column(field_name, 'shape', i).add(field.array.shape)
+                column(field_name, 'padding_value', i).add([field.padding_value])
+
+    column_dtypes = {'tokens': np.int64, 'labels': np.int64, 'label_ids': np.int64, 'shape': np.int64,
+                     'padding_value': np.float64}
+    for field_name, columns in field_name_and_columns.items():
+        spec = field_specs[field_name]
+        spec['columns'] = sorted(columns.keys())
+        for column_name, column_writer in columns.items():
+            if column_name == 'values':
+                dtype = np.dtype(spec['dtype'])
+            else:
+                dtype = column_dtypes.get(column_name, np.int64)
+            column_writer.save(os.path.join(split_dir, '%s.%s' % (field_name, column_name)), dtype)
+        np.save(os.path.join(split_dir, '%s.present.npy' % field_name), np.asarray(present[field_name],
+                                                                                   dtype=np.bool_))
+    metadata = {field_name: sample_table.pack(values) for field_name, values in metadata.items()}
+    with open(os.path.join(split_dir, 'metadata.pkl'), mode='wb') as metadata_file:
+        pickle.dump(metadata, metadata_file)
+    return {'instance_num': len(instances), 'fields': field_specs}
+
+
+def save_instances(split_and_instances: Dict[str, List[Instance]], cache_dir: str, vocab: Vocabulary = None):
+    """
+    :param split_and_instances: 例如{'train': train_data, 'dev': dev_data, 'test': test_data}
+    :param cache_dir:
+    :param vocab: 不为None时，先用vocab索引instance，把索引结果也保存下来
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    indexed = vocab is not None
+    if indexed:
+        for instances in split_and_instances.values():
+            for instance in instances:
+                instance.index_fields(vocab)
+    string_table = _StringTable()
+    field_name_and_token_indexers = {}
+    spec = {
+        'format_version': FORMAT_VERSION,
+        'vocab_fingerprint': vocab_fingerprint(vocab) if indexed else None,
+        'splits': {}
+    }
+    for split, instances in split_and_instances.items():
+        spec['splits'][split] = _save_split(instances, os.path.join(cache_dir, split), string_table,
+                                            field_name_and_token_indexers, indexed)
+    with open(os.path.join(cache_dir, STRINGS_FILENAME), mode='wb') as strings_file:
+        pickle.dump(string_table.strings, strings_file)
+    with open(os.path.join(cache_dir, TOKEN_INDEXERS_FILENAME), mode='wb') as token_indexers_file:
+        pickle.dump(field_name_and_token_indexers, token_indexers_file)
+    # spec最后写，spec存在说明缓存是完整的
+    with open(os.path.join(cache_dir, SPEC_FILENAME), mode='w', encoding='utf-8') as spec_file:
+        json.dump(spec, spec_file)
+
+
+class _SplitReader:
+    """
+    一个split的列，LazyInstance用它生成field
+    """
+
+    def __init__(self, split_dir: str, split_spec: dict, strings: List[str], field_name_and_token_indexers: dict,
+                 indexed: bool, compact_sample_metadata: bool):
+        self.field_specs = split_spec['fields']
+        self.strings = strings
+        self.field_name_and_token_indexers = field_name_and_token_indexers
+        self.indexed = indexed
+        self.field_name_and_columns = {}
+        self.present = {}
+        for field_name, spec in self.field_specs.items():
+            self.field_name_and_columns[field_name] = {
+                column_name: _ColumnReader(os.path.join(split_dir, '%s.%s' % (field_name, column_name)))
+                for column_name in spec.get('columns', [])
+            }
+            self.present[field_name] = np.load(os.path.join(split_dir, '%s.present.npy' % field_name),
+                                               mmap_mode='r')
+        with open(os.path.join(split_dir, 'metadata.pkl'), mode='rb') as metadata_file:
+            self.metadata = {field_name: sample_table.unpack(values)
+                             for field_name, values in pickle.load(metadata_file).items()}
+        if compact_sample_metadata:
+            self.metadata = {field_name: sample_table.compact_samples(values)
+                             for field_name, values in self.metadata.items()}
+        # 先生成TextField，SequenceLabelField需要引用它
+        self.field_names = sorted(self.field_specs.keys(), key=lambda e: self.field_specs[e]['type'] != 'text')
+
+    def fields(self, i: int) -> Dict[str, Field]:
+        fields = {}
+        for field_name in self.field_names:
+            if not self.present[field_name][i]:
+                continue
+            spec = self.field_specs[field_name]
+            columns = self.field_name_and_columns[field_name]
+            field_type = spec['type']
+            if field_type == 'metadata':
+                field = MetadataField(self.metadata[field_name][i])
+            elif field_type == 'text':
+                tokens = [Token(self.strings[token_id]) for token_id in columns['tokens'].get(i).tolist()]
+                field = TextField(tokens, self.field_name_and_token_indexers[field_name])
+                if self.indexed:
+                    field._indexed_tokens = {
+                        column_name[len('indexed.'):]: column_reader.get(i).tolist()
+                        for column_name, column_reader in columns.items() if column_name.startswith('indexed.')
+                    }
+                    field._indexer_name_to_indexed_token = spec['indexer_name_to_indexed_token']
+                    if hasattr(field, '_token_index_to_indexer_name'):
+                        field._token_index_to_indexer_name = {
+                            indexed_token: indexer_name for indexer_name, indexed_tokens in
+                            spec['indexer_name_to_indexed_token'].items() for indexed_token in indexed_tokens
+                        }
+            elif field_type == 'sequence_label':
+                labels = [self.strings[label_id] for label_id in columns['labels'].get(i).tolist()]
+                field = SequenceLabelField(labels, fields[spec['sequence_field']],
+                                           label_namespace=spec['namespace'])
+                if self.indexed:
+                    field._indexed_labels = columns['label_ids'].get(i).tolist()
+            elif field_type == 'label':
+                if spec['skip_indexing']:
+                    field = LabelField(int(columns['label_ids'].get(i)[0]), label_namespace=spec['namespace'],
+                                       skip_indexing=True)
+                else:
+                    field = LabelField(self.strings[int(columns['labels'].get(i)[0])],
+                                       label_namespace=spec['namespace'])
+                    if self.indexed:
+                        field._label_id = int(columns['label_ids'].get(i)[0])
+            elif field_type == 'multi_label':
+                if spec['skip_indexing']:
+                    field = MultiLabelField(columns['label_ids'].get(i).tolist(),
+                                            label_namespace=spec['namespace'], skip_indexing=True,
+                                            num_labels=spec['num_labels'])
+                else:
+                    labels = [self.strings[label_id] for label_id in columns['labels'].get(i).tolist()]
+                    field = MultiLabelField(labels, label_namespace=spec['namespace'],
+                                            num_labels=spec['num_labels'])
+                    if self.indexed:
+                        field._label_ids = columns['label_ids'].get(i).tolist()
+            elif field_type == 'array':
+                shape = columns['shape'].get(i).tolist()
+                # 拷贝一份，instance不引用mmap
+                array = np.array(columns['values'].get(i)).reshape(shape)
+                field = ArrayField(array, padding_value=columns['padding_value'].get(i)[0].item(),
+                                   dtype=np.dtype(spec['dtype']))
+            else:
+                raise NotImplementedError('unsupported field type: %s' % field_type)
+            fields[field_name] = field
+        return fields
+
+
+def _to_instance(fields: Dict[str, Field], indexed: bool):
+    instance = Instance(fields)
+    instance.indexed = indexed
+    return instance
+
+
+class LazyInstance(Instance):
+    """
+    第一次访问fields时才从缓存的列生成field，生成后和普通的Instance一样
+    """
+
+    def __init__(self, split_reader: _SplitReader, index: int, indexed: bool) -> None:
+        # 不调用Instance.__init__，fields由下面的property生成
+        self._split_reader = split_reader
+        self._index = index
+        self._fields = None
+        self.indexed = indexed
+
+    @property
+    def fields(self) -> Dict[str, Field]:
+        if self._fields is None:
+            self._fields = self._split_reader.fields(self._index)
+            self._split_reader = None
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields: Dict[str, Field]):
+        self._fields = fields
+        self._split_reader = None
+
+    def __reduce__(self):
+        # pickle成普通的Instance，不引用mmap
+        return _to_instance, (self.fields, self.indexed)
+
+
+def _load_split(split_dir: str, split_spec: dict, strings: List[str], field_name_and_token_indexers: dict,
+                indexed: bool, compact_sample_metadata: bool = False) -> List[Instance]:
+    split_reader = _SplitReader(split_dir, split_spec, strings, field_name_and_token_indexers, indexed,
+                                compact_sample_metadata)
+    return [LazyInstance(split_reader, i, indexed) for i in range(split_spec['instance_num'])]
+
+
+def load_instances(cache_dir: str, vocab: Vocabulary = None, compact_sample_metadata: bool = False):
+    """
+    :param cache_dir:
+    :param vocab: 和保存时的vocab一样的话，instance标记为已经索引过
+    :param compact_sample_metadata: 为True时MetadataField里的sample放到sample_table里，不需要先生成instance
+    :return: split -> instances
+    """
+    with open(os.path.join(cache_dir, SPEC_FILENAME), encoding='utf-8') as spec_file:
+        spec = json.load(spec_file)
+    with open(os.path.join(cache_dir, STRINGS_FILENAME), mode='rb') as strings_file:
+        strings = pickle.load(strings_file)
+    with open(os.path.join(cache_dir, TOKEN_INDEXERS_FILENAME), mode='rb') as token_indexers_file:
+        field_name_and_token_indexers = pickle.load(token_indexers_file)
+    indexed = vocab is not None and spec['vocab_fingerprint'] is not None \
+              and spec['vocab_fingerprint'] == vocab_fingerprint(vocab)
+    result = {}
+    for split, split_spec in spec['splits'].items():
+        result[split] = _load_split(os.path.join(cache_dir, split), split_spec, strings,
+                                    field_name_and_token_indexers, indexed,
+                                    compact_sample_metadata=compact_sample_metadata)
+    return result
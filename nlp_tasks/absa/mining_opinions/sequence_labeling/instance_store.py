@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的instance仓库: 同一个进程里训练(_load_data)、评估(evaluate_v2)和预测(predict_test_v2)读取同一个数据集的
+同一个split时共用一份instance，reader.read(分词、BERT的word piece等)只执行一次。towe_sweep.py在fork之前准备好的
+instance也会被子进程共用。
+
+key包括base_data_dir(决定vocab，instance索引之后只能和这个vocab一起用)、数据集、split、reader的类和影响数据的参数
+(例如entire_space、test_entire_space等过滤条件)，任何一个不同都会重新读取。仓库里的instance是共享的，使用时不要修改。
+"""
+
+
+import hashlib
+import json
+import threading
+from typing import *
+
+from allennlp.data.dataset_readers import DatasetReader
+from allennlp.data.instance import Instance
+
+
+# 影响数据集里的样本的参数(data_object)
+DATASET_CONFIGURATION_KEYS = ('data_type', 'add_predicted_aspect_term', 'ate_result_filepath', 'include_conflict',
+                              'opinion_tag_with_sentiment', 'version', 'data_augmentation')
+# 影响reader生成的instance或者过滤样本的参数(sequence_labeling_data_reader)，以及instance里sample的存储方式
+READER_CONFIGURATION_KEYS = ('max_len', 'polarities', 'entire_space', 'test_entire_space',
+                             'only_test_non_entire_space', 'same_special_token', 'aspect_word', 'aspect_to_question',
+                             'aspect_to_question_wo_aspect', 'position_and_second_sentence', 'relative_position',
+                             'special_token_and_second_sentence', 'without_second_sentence', 'bert_vocab_file_path',
+                             'compact_sample_metadata', 'train_mil_with_conflict')
+
+
+_key_and_instances: Dict[tuple, List[Instance]] = {}
+_lock = threading.Lock()
+
+
+def _reader_and_parameters(reader: DatasetReader, configuration: dict) -> Tuple[str, str]:
+    keys = DATASET_CONFIGURATION_KEYS + READER_CONFIGURATION_KEYS
+    parameters = json.dumps([configuration.get(key) for key in keys], default=str)
+    reader_class = '%s.%s' % (type(reader).__module__, type(reader).__name__)
+    return reader_class, parameters
+
+
+def make_key(base_data_dir: str, dataset_name: str, split: str, reader: DatasetReader, configuration: dict) -> tuple:
+    """
+    :param base_data_dir: 模型的base_data_dir，同一个base_data_dir的模型用同一个vocab
+    :param dataset_name: 例如ASOTEDataRest14
+    :param split: train、dev或test
+    :return: 仓库的key
+    """
+    return (base_data_dir, dataset_name, split) + _reader_and_parameters(reader, configuration)
+
+
+def configuration_fingerprint(dataset_name: str, reader: DatasetReader, configuration: dict) -> str:
+    """
+    :return: 数据集、reader的类和影响数据的参数的md5，和make_key用的参数一样，例如instance_cache的目录名用它区分
+    """
+    return hashlib.md5(json.dumps((dataset_name,) + _reader_and_parameters(reader, configuration))
+                       .encode('utf-8')).hexdigest()
+
+
+def get(key: tuple) -> Optional[List[Instance]]:
+    with _lock:
+        return _key_and_instances.get(key)
+
+
+def put(key: tuple, instances: List[Instance]):
+    with _lock:
+        _key_and_instances[key] = instances
+
+
+def get_or_read(key: tuple, read: Callable[[], List[Instance]]) -> List[Instance]:
+    """
+    :param read: 仓库里没有时调用，返回的instance放到仓库里
+    """
+    instances = get(key)
+    if instances is None:
+        instances = read()
+        put(key, instances)
+    return instances
+
+
+def clear():
+    with _lock:
+        _key_and_instances.clear()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+按句子长度pack之后再调用RNN，padding的位置不参与计算，反向的RNN也从每个句子真正的最后一个词开始。
+
+batch里的句子已经按长度从长到短排好序时(my_allennlp_iterator里的iterator都是这样)，
+pack_padded_sequence不需要重新排序，也就不需要复制输入和输出。
+
+动态量化后的LSTM(quantization.py)在torch 1.3上不支持PackedSequence，这时长度一样的句子去掉padding后一起调用。
+"""
+
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+
+def _supports_packed_sequence(rnn: nn.Module) -> bool:
+    # torch.nn.quantized.dynamic.LSTM(torch 1.3)，torch.ao.nn.quantized.dynamic.LSTM(新版本)
+    return 'quantized' not in type(rnn).__module__
+
+
+def _run_rnn_by_length(rnn: nn.Module, inputs: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    """
+    长度一样的句子去掉padding后一起调用rnn，结果和pack之后调用一样
+    """
+    outputs = None
+    for length in sorted(set(lengths.tolist())):
+        indices = torch.nonzero(lengths == length).squeeze(1).to(inputs.device)
+        group_outputs = rnn(inputs.index_select(0, indices)[:, : length].contiguous())[0]
+        if outputs is None:
+            outputs = inputs.new_zeros(inputs.size(0), inputs.size(1), group_outputs.size(2))
+        outputs[indices, : length] = group_outputs
+    return outputs
+
+
+def run_rnn(rnn: nn.RNNBase, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+    """
+    :param rnn: batch_first的nn.LSTM、nn.GRU等
+    :param inputs: (batch_size, sequence_length, input_size)
+    :param mask: (batch_size, sequence_length)
+    :return: 和rnn(inputs)[0]的shape一样，padding的位置为0
+    """
+    lengths = mask.long().sum(dim=1).cpu()
+    sequence_length = inputs.size(1)
+    # 没有padding时pack没有好处
+    if int(lengths.min()) == sequence_length:
+        return rnn(inputs)[0]
+    # pack_padded_sequence不支持长度为0的句子
+    lengths = lengths.clamp(min=1)
+    if not _supports_packed_sequence(rnn):
+        return _run_rnn_by_length(rnn, inputs, lengths)
+    is_sorted = bool((lengths[: -1] >= lengths[1:]).all())
+    packed_inputs = pack_padded_sequence(inputs, lengths, batch_first=True, enforce_sorted=is_sorted)
+    packed_outputs, _ = rnn(packed_inputs)
+    outputs, _ = pad_packed_sequence(packed_outputs, batch_first=True, total_length=sequence_length)
+    return outputs
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+对比直接在padding后的batch上调用LSTM和masked_rnn.run_rnn(pack之后再调用)的速度，以及真实位置上结果的差别。
+句子长度大多较短、少数很长(和评论数据集差不多)，这时padding占的比例大，pack的好处最明显。
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/masked_rnn_benchmark.py --batch_sizes 8,32,128 --backward
+"""
+
+
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import masked_rnn
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch_sizes', default='1,8,32,64,128', type=str)
+parser.add_argument('--min_len', default=3, type=int)
+parser.add_argument('--max_len', default=150, type=int)
+parser.add_argument('--input_size', default=600, type=int)
+parser.add_argument('--hidden_size', default=300, type=int)
+parser.add_argument('--backward', help='also time the backward pass', default=False, action='store_true')
+parser.add_argument('--repeat', default=5, type=int)
+parser.add_argument('--seed', default=776, type=int)
+
+
+def random_lengths(batch_size, min_len, max_len):
+    """
+    指数分布的句子长度，最长的句子是max_len，保证batch里有padding
+    """
+    mean = max((max_len - min_len) / 8, 1)
+    lengths = (torch.empty(batch_size).exponential_(1 / mean) + min_len).long().clamp(max=max_len)
+    lengths[0] = max_len
+    # 和my_allennlp_iterator里的iterator一样，batch里的句子按长度从长到短排序
+    return lengths.sort(descending=True)[0]
+
+
+def random_batch(batch_size, min_len, max_len, input_size, device):
+    lengths = random_lengths(batch_size, min_len, max_len)
+    mask = (torch.arange(max_len).unsqueeze(0) < lengths.unsqueeze(1)).long()
+    inputs = torch.randn(batch_size, max_len, input_size) * mask.unsqueeze(-1).float()
+    return inputs.to(device), mask.to(device), lengths
+
+
+def timeit(function, repeat, device):
+    result = function()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def forward_and_backward(run, backward):
+    output = run()
+    if backward:
+        output.sum().backward()
+    return output.detach()
+
+
+def main():
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    lstm = nn.LSTM(args.input_size, args.hidden_size, batch_first=True, bidirectional=True).to(device)
+
+    print('batch_size\treal_tokens\tpadded_tokens\tpadded(tokens/s)\tpacked(tokens/s)\tspeedup\t'
+          'forward_diff\tbackward_diff')
+    with torch.set_grad_enabled(args.backward):
+        for batch_size in [int(e) for e in args.batch_sizes.split(',')]:
+            inputs, mask, lengths = random_batch(batch_size, args.min_len, args.max_len, args.input_size, device)
+            real_tokens = int(lengths.sum())
+            padded_time, padded_output = timeit(
+                lambda: forward_and_backward(lambda: lstm(inputs)[0], args.backward), args.repeat, device)
+            packed_time, packed_output = timeit(
+                lambda: forward_and_backward(lambda: masked_rnn.run_rnn(lstm, inputs, mask), args.backward),
+                args.repeat, device)
+
+            # 前向的结果在真实位置上一样，反向的结果不一样: 不pack时反向的LSTM从padding开始
+            real = mask.unsqueeze(-1).bool()
+            diff = (padded_output - packed_output).abs().masked_select(real)
+            forward_diff = float(diff.view(-1, 2, args.hidden_size)[:, 0].max()) if diff.numel() > 0 else 0
+            backward_diff = float(diff.view(-1, 2, args.hidden_size)[:, 1].max()) if diff.numel() > 0 else 0
+            print('%d\t%d\t%d\t%.0f\t%.0f\t%.2fx\t%.6f\t%.6f' % (batch_size, real_tokens, inputs.size(0) * inputs.size(1),
+                                                               real_tokens / padded_time, real_tokens / packed_time,
+                                                               padded_time / packed_time, forward_diff,
+                                                               backward_diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+评估和预测用的iterator，以及训练用的BucketIterator。每个batch里的instance都按长度从长到短排列，
+masked_rnn.run_rnn pack的时候不需要重新排序。
+"""
+
+
+import math
+from typing import *
+
+from allennlp.data.dataset import Batch
+from allennlp.data.instance import Instance
+from allennlp.data.iterators.data_iterator import DataIterator
+from allennlp.data.iterators.bucket_iterator import BucketIterator
+from allennlp.data.vocabulary import Vocabulary
+
+
+def _instance_length(instance: Instance, sorting_keys: List[Tuple[str, str]], vocab: Vocabulary = None):
+    # get_padding_lengths之前instance需要被索引
+    if vocab is not None:
+        instance.index_fields(vocab)
+    padding_lengths = instance.get_padding_lengths()
+    return [padding_lengths[field_name][padding_key] for field_name, padding_key in sorting_keys]
+
+
+class LengthSortedIterator(DataIterator):
+    """
+    按长度排序后再分batch，每个batch只pad到这个batch里最长的句子，batch里的instance从长到短排列。
+    排序是确定的，不加噪声，也不shuffle，instance_order返回迭代时instance的顺序，
+    restore_order把按迭代顺序得到的结果恢复成原来的顺序。
+
+    max_tokens大于0时，batch按token数量分: batch里的instance数 * 最大长度不超过max_tokens，
+    batch_size是instance数的上限。
+    """
+
+    def __init__(self,
+                 sorting_keys: List[Tuple[str, str]],
+                 batch_size: int = 32,
+                 max_tokens: int = 0) -> None:
+        super().__init__(batch_size=batch_size)
+        self._sorting_keys = sorting_keys
+        self._max_tokens = max_tokens
+
+    def _instance_length(self, instance: Instance):
+        return _instance_length(instance, self._sorting_keys, self.vocab)
+
+    def _order(self, lengths: List[List[int]]) -> List[int]:
+        return sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    def instance_order(self, instances: Iterable[Instance]) -> List[int]:
+        return [i for batch_indices in self._batch_indices(list(instances)) for i in batch_indices]
+
+    def _batch_indices(self, instances: List[Instance]) -> List[List[int]]:
+        lengths = [self._instance_length(instance) for instance in instances]
+        result = []
+        batch = []
+        batch_max_length = 0
+        for i in self._order(lengths):
+            length = max(lengths[i] + [1])
+            max_length = max(batch_max_length, length)
+            is_full = len(batch) >= self._batch_size
+            if self._max_tokens > 0 and (len(batch) + 1) * max_length > self._max_tokens:
+                is_full = True
+            if len(batch) > 0 and is_full:
+                result.append(batch[::-1])
+                batch = []
+                max_length = length
+            batch.append(i)
+            batch_max_length = max_length
+        if len(batch) > 0:
+            result.append(batch[::-1])
+        return result
+
+    def _create_batches(self, instances: Iterable[Instance], shuffle: bool) -> Iterable[Batch]:
+        instances = list(instances)
+        for batch_indices in self._batch_indices(instances):
+            yield Batch([instances[i] for i in batch_indices])
+
+    def get_num_batches(self, instances: Iterable[Instance]) -> int:
+        instances = list(instances)
+        if self._max_tokens > 0:
+            return len(self._batch_indices(instances))
+        return math.ceil(len(instances) / self._batch_size)
+
+    def restore_order(self, instances: Iterable[Instance], outputs: list) -> list:
+        """
+        :param outputs: 按迭代顺序得到的每个instance的结果
+        :return: 按instances原来的顺序排列的结果
+        """
+        result = [None] * len(outputs)
+        for position, i in enumerate(self.instance_order(instances)):
+            result[i] = outputs[position]
+        return result
+
+
+class DescendingBucketIterator(BucketIterator):
+    """
+    和BucketIterator一样，只是每个batch里的instance按长度从长到短排列
+    """
+
+    def _create_batches(self, instances: Iterable[Instance], shuffle: bool) -> Iterable[Batch]:
+        for batch in super()._create_batches(instances, shuffle):
+            lengths = [_instance_length(instance, self._sorting_keys, self.vocab) for instance in batch.instances]
+            order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+            yield Batch([batch.instances[i] for i in order])
+
+
+def restore_order(iterator: DataIterator, instances: Iterable[Instance], outputs: list) -> list:
+    """
+    iterator不改变顺序时直接返回outputs
+    """
+    if isinstance(iterator, LengthSortedIterator):
+        return iterator.restore_order(instances, outputs)
+    return outputs
@@ -33,6 +33,9 @@ from allennlp.training import util as training_util
 from allennlp.training.moving_average import MovingAverage
 
 from nlp_tasks.absa.aspect_category_detection_and_sentiment_classification import allennlp_callback
+from nlp_tasks.absa.mining_opinions.sequence_labeling import batch_prefetch
+from nlp_tasks.absa.mining_opinions.sequence_labeling import my_crf_tagger
+from nlp_tasks.absa.mining_opinions.sequence_labeling import phase_timer
 from nlp_tasks.absa.mining_opinions.sequence_labeling.pytorch_models import Estimator
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -74,6 +77,10 @@ class Trainer(TrainerBase):
                  callbacks: List[allennlp_callback.Callback]=None,
                  early_stopping_by_batch: bool=True,
                  estimator: Estimator=None,
+                 prefetch_batches: int=0,
+                 profile_epoch: int=-1,
+                 profile_batches: Tuple[int, int]=(0, 10),
+                 training_metrics_interval: int=1,
                  ) -> None:
         """
         A trainer for doing supervised learning. It just takes a labeled dataset
@@ -185,6 +192,16 @@ class Trainer(TrainerBase):
             parameters. Be careful that when saving the checkpoint, we will save the moving averages of
             parameters. This is necessary because we want the saved model to perform as well as the validated
             model if we load it later. But this may cause problems if you restart the training from checkpoint.
+        prefetch_batches: ``int``, optional, (default = 0)
+            训练时在后台线程里最多提前生成多少个batch，0表示在训练线程里生成
+        profile_epoch: ``int``, optional, (default = -1)
+            大于等于0时，用torch.autograd.profiler记录这个epoch中profile_batches范围内的batch，
+            结果保存在serialization_dir中
+        profile_batches: ``Tuple[int, int]``, optional, (default = (0, 10))
+            记录的第一个batch和最后一个batch之后的batch的索引，从0开始
+        training_metrics_interval: ``int``, optional, (default = 1)
+            训练时每training_metrics_interval个batch计算一次指标(CrfTagger的viterbi解码、accuracy和span f1)
+            并更新进度条，0表示训练时不计算。每个epoch的训练指标只包括计算了指标的batch，loss包括所有batch
         """
         super().__init__(serialization_dir, cuda_device)
 
@@ -217,7 +234,7 @@ class Trainer(TrainerBase):
         if checkpointer is not None:
             # We can't easily check if these parameters were passed in, so check against their default values.
             # We don't check against serialization_dir since it is also used by the parent class.
-            if num_serialized_models_to_keep != 20 or \
+            if num_serialized_models_to_keep != 0 or \
                     keep_serialized_model_every_num_seconds is not None:
                 raise ConfigurationError(
                         "When passing a custom Checkpointer, you may not also pass in separate checkpointer "
@@ -258,11 +275,34 @@ class Trainer(TrainerBase):
         if histogram_interval is not None:
             self._tensorboard.enable_activation_logging(self.model)
         self.callbacks = callbacks
+        if self.callbacks is not None:
+            for callback in self.callbacks:
+                callback.set_trainer(self)
+        # 最近一次estimator在验证集上的结果，EstimateCallback可以直接使用，不需要再评估一遍
+        self._validation_epoch_and_metrics: Tuple[int, Dict[str, float]] = None
 
         self._early_stopping_by_batch = early_stopping_by_batch
 
         self._estimator = estimator
 
+        self._prefetch_batches = prefetch_batches
+
+        self._profile_epoch = profile_epoch
+        self._profile_batches = profile_batches
+
+        self._training_metrics_interval = training_metrics_interval
+
+    def is_best_so_far(self) -> bool:
+        return self._metric_tracker.is_best_so_far()
+
+    def get_validation_metrics(self, epoch: int) -> Optional[Dict[str, float]]:
+        """
+        :return: 第epoch个epoch结束时estimator在验证集上的结果，没有的话返回None
+        """
+        if self._validation_epoch_and_metrics is None or self._validation_epoch_and_metrics[0] != epoch:
+            return None
+        return self._validation_epoch_and_metrics[1]
+
     def rescale_gradients(self) -> Optional[float]:
         return training_util.rescale_gradients(self.model, self._grad_norm)
 
@@ -276,7 +316,7 @@ class Trainer(TrainerBase):
         else:
             assert len(batch_group) == 1
             batch = batch_group[0]
-            batch = nn_util.move_to_device(batch, self._cuda_devices[0])
+            batch = batch_prefetch.move_to_device(batch, self._cuda_devices[0])
             output_dict = self.model(**batch)
 
         try:
@@ -291,6 +331,23 @@ class Trainer(TrainerBase):
 
         return loss
 
+    def _is_profiled(self, epoch: int, batch_index: int) -> bool:
+        return epoch == self._profile_epoch and self._profile_batches[0] <= batch_index < self._profile_batches[1]
+
+    def _save_profile(self, profiler: torch.autograd.profiler.profile, epoch: int):
+        if not self._serialization_dir:
+            return
+        profile_filepath_prefix = os.path.join(self._serialization_dir, 'profile_epoch_%d' % epoch)
+        profiler.export_chrome_trace(profile_filepath_prefix + '.json')
+        with open(profile_filepath_prefix + '.txt', mode='w', encoding='utf-8') as profile_file:
+            profile_file.write(profiler.key_averages().table(sort_by='self_cpu_time_total'))
+        logger.info('profile of epoch %d batches %s: %s.json' % (epoch, str(self._profile_batches),
+                                                                 profile_filepath_prefix))
+
+    def _is_metrics_batch(self, batches_this_epoch: int) -> bool:
+        interval = self._training_metrics_interval
+        return interval > 0 and batches_this_epoch % interval == 0
+
     def _train_epoch(self, epoch: int) -> Dict[str, float]:
         """
         Trains one epoch and returns metrics.
@@ -313,6 +370,13 @@ class Trainer(TrainerBase):
         raw_train_generator = self.iterator(self.train_data,
                                             num_epochs=1,
                                             shuffle=self.shuffle)
+        prefetcher = None
+        if self._prefetch_batches > 0:
+            # GPU上训练时pin_memory，复制到GPU时不需要同步
+            prefetcher = batch_prefetch.BatchPrefetcher(raw_train_generator, queue_size=self._prefetch_batches,
+                                                        pin_memory=self._cuda_devices[0] >= 0)
+            raw_train_generator = iter(prefetcher)
+        raw_train_generator = phase_timer.timed(raw_train_generator, 'data')
         train_generator = lazy_groups_of(raw_train_generator, num_gpus)
         num_training_batches = math.ceil(self.iterator.get_num_batches(self.train_data)/num_gpus)
         self._last_log = time.time()
@@ -329,20 +393,32 @@ class Trainer(TrainerBase):
         train_generator_tqdm = Tqdm.tqdm(train_generator,
                                          total=num_training_batches)
         cumulative_batch_size = 0
+        profiler = None
         for batch_group in train_generator_tqdm:
             self.model.train()
+            if profiler is None and self._is_profiled(epoch, batches_this_epoch):
+                if self._cuda_devices[0] >= 0:
+                    profiler = torch.autograd.profiler.profile(use_cuda=True)
+                else:
+                    profiler = torch.autograd.profiler.profile()
+                profiler.__enter__()
             batches_this_epoch += 1
             self._batch_num_total += 1
             batch_num_total = self._batch_num_total
 
             self.optimizer.zero_grad()
 
-            loss = self.batch_loss(batch_group, for_training=True)
+            is_metrics_batch = self._is_metrics_batch(batches_this_epoch)
+            if self._training_metrics_interval != 1:
+                my_crf_tagger.set_compute_training_metrics(self.model, is_metrics_batch)
+            with phase_timer.phase('forward'):
+                loss = self.batch_loss(batch_group, for_training=True)
 
             if torch.isnan(loss):
                 raise ValueError("nan loss encountered")
 
-            loss.backward()
+            with phase_timer.phase('backward'):
+                loss.backward()
 
             train_loss += loss.item()
 
@@ -369,17 +445,21 @@ class Trainer(TrainerBase):
                     self._tensorboard.add_train_scalar("gradient_update/" + name,
                                                        update_norm / (param_norm + 1e-7))
             else:
-                self.optimizer.step()
+                with phase_timer.phase('optimizer'):
+                    self.optimizer.step()
 
             # Update moving averages
             if self._moving_average is not None:
                 self._moving_average.apply(batch_num_total)
 
             # Update the description with the latest metrics
-            metrics = training_util.get_metrics(self.model, train_loss, batches_this_epoch)
-            description = training_util.description_from_metrics(metrics)
+            if is_metrics_batch:
+                metrics = training_util.get_metrics(self.model, train_loss, batches_this_epoch)
+                description = training_util.description_from_metrics(metrics)
 
-            train_generator_tqdm.set_description(description, refresh=False)
+                train_generator_tqdm.set_description(description, refresh=False)
+            else:
+                metrics = {'loss': float(train_loss / batches_this_epoch)}
 
             # Log parameter values to Tensorboard
             if self._tensorboard.should_log_this_batch():
@@ -429,9 +509,24 @@ class Trainer(TrainerBase):
                         self._save_checkpoint(self._batch_num_total)
 
                         if self.callbacks is not None:
-                            for callback in self.callbacks:
-                                callback.on_batch_end(self._batch_num_total)
-
+                            with phase_timer.phase('callbacks'):
+                                for callback in self.callbacks:
+                                    callback.on_batch_end(self._batch_num_total)
+
+            if profiler is not None and not self._is_profiled(epoch, batches_this_epoch):
+                profiler.__exit__(None, None, None)
+                self._save_profile(profiler, epoch)
+                profiler = None
+
+        if profiler is not None:
+            profiler.__exit__(None, None, None)
+            self._save_profile(profiler, epoch)
+
+        if prefetcher is not None:
+            prefetcher.log_stats('prefetch in epoch %d' % epoch)
+        if self._training_metrics_interval != 1:
+            # 评估和预测时需要解码
+            my_crf_tagger.set_compute_training_metrics(self.model, True)
         metrics = training_util.get_metrics(self.model, train_loss, batches_this_epoch, reset=True)
         metrics['cpu_memory_MB'] = peak_cpu_usage
         for (gpu_num, memory) in gpu_usage:
@@ -525,11 +620,12 @@ class Trainer(TrainerBase):
             epoch_start_time = time.time()
 
             if self.callbacks is not None:
-                with torch.no_grad():
+                with torch.no_grad(), phase_timer.phase('callbacks'):
                     for callback in self.callbacks:
                         callback.on_epoch_begin(epoch)
 
-            train_metrics = self._train_epoch(epoch)
+            with phase_timer.phase('train'):
+                train_metrics = self._train_epoch(epoch)
             if not self._early_stopping_by_batch:
                 # get peak of memory usage
                 if 'cpu_memory_MB' in train_metrics:
@@ -540,8 +636,9 @@ class Trainer(TrainerBase):
                         metrics["peak_"+key] = max(metrics.get("peak_"+key, 0), value)
 
                 if self._validation_data is not None:
-                    with torch.no_grad():
+                    with torch.no_grad(), phase_timer.phase('validation'):
                         val_metrics_temp = self._estimator.estimate(self._validation_data)
+                        self._validation_epoch_and_metrics = (epoch, val_metrics_temp)
                         # We have a validation set, so compute all the metrics on it.
                         # val_loss, num_batches = self._validation_loss()
                         # val_metrics = training_util.get_metrics(self.model, val_loss, num_batches, reset=True)
@@ -606,13 +703,19 @@ class Trainer(TrainerBase):
                 logger.info("Estimated training time remaining: %s", formatted_time)
 
             if self.callbacks is not None:
-                with torch.no_grad():
+                with torch.no_grad(), phase_timer.phase('callbacks'):
                     for callback in self.callbacks:
                         callback.on_epoch_end(epoch)
             epochs_trained += 1
 
+            phases = phase_timer.flush('epoch', epoch=epoch)
+            if phases:
+                logger.info('phases of epoch %d: %s' % (epoch, phase_timer.format_summary(phases)))
+
         # make sure pending events are flushed to disk and files are closed properly
         self._tensorboard.close()
+        # early stopping时最后一个epoch的评估和checkpoint
+        phase_timer.flush('train_end')
 
         # Load the best model state before returning
         best_model_state = self._checkpointer.best_model_state()
@@ -650,11 +753,12 @@ class Trainer(TrainerBase):
         if self._momentum_scheduler is not None:
             training_states["momentum_scheduler"] = self._momentum_scheduler.state_dict()
 
-        self._checkpointer.save_checkpoint(
-                model_state=self.model.state_dict(),
-                epoch=epoch,
-                training_states=training_states,
-                is_best_so_far=self._metric_tracker.is_best_so_far())
+        with phase_timer.phase('checkpoint'):
+            self._checkpointer.save_checkpoint(
+                    model_state=self.model.state_dict(),
+                    epoch=epoch,
+                    training_states=training_states,
+                    is_best_so_far=self._metric_tracker.is_best_so_far())
 
         # Restore the original values for parameters so that training will not be affected.
         if self._moving_average is not None:
@@ -18,6 +18,9 @@ from allennlp.nn import InitializerApplicator, RegularizerApplicator
 import allennlp.nn.util as util
 from allennlp.training.metrics import CategoricalAccuracy, SpanBasedF1Measure
 
+from nlp_tasks.absa.mining_opinions.sequence_labeling import batch_viterbi
+from nlp_tasks.absa.mining_opinions.sequence_labeling import phase_timer
+
 
 @Model.register("my_crf_tagger")
 class CrfTagger(Model):
@@ -126,6 +129,9 @@ class CrfTagger(Model):
             self._f1_metric = SpanBasedF1Measure(vocab,
                                                  tag_namespace=label_namespace,
                                                  label_encoding=label_encoding)
+        # 训练时为False则只计算loss，不做viterbi解码，也不更新metrics，
+        # 由Trainer按training_metrics_interval设置
+        self.compute_training_metrics = True
 
         initializer(self)
 
@@ -161,17 +167,25 @@ class CrfTagger(Model):
             The text field mask for the input tokens
         tags : ``List[List[int]]``
             The predicted tags using the Viterbi algorithm.
+        tag_ids : ``torch.LongTensor``
+            The predicted tags padded with 0, of shape ``(batch_size, num_tokens)``.
         loss : ``torch.FloatTensor``, optional
             A scalar loss to be optimised. Only computed if gold label ``tags`` are provided.
         """
 
         logits = self.tag_projection_layer(encoded_text)
-        best_paths = self.crf.viterbi_tags(logits, mask)
+        if self.training and tags is not None and not getattr(self, 'compute_training_metrics', True):
+            # loss只需要crf的forward算法
+            output = {"logits": logits, "mask": mask}
+            output["loss"] = -self.crf(logits, tags, mask)  # pylint: disable=invalid-unary-operand-type
+            if metadata is not None:
+                output["words"] = [x["words"] for x in metadata]
+            return output
 
-        # Just get the tags and ignore the score.
-        predicted_tags = [x for x, y in best_paths]
+        with phase_timer.phase('crf_decode'):
+            tag_ids, predicted_tags = batch_viterbi.viterbi_tags(self.crf, logits, mask)
 
-        output = {"logits": logits, "mask": mask, "tags": predicted_tags}
+        output = {"logits": logits, "mask": mask, "tags": predicted_tags, "tag_ids": tag_ids}
 
         if tags is not None:
             # Add negative log-likelihood as loss
@@ -181,21 +195,27 @@ class CrfTagger(Model):
             # (in fact, it's a torch.Tensor), so we need a disable.
             output["loss"] = -log_likelihood  # pylint: disable=invalid-unary-operand-type
 
-            # Represent viterbi tags as "class probabilities" that we can
-            # feed into the metrics
-            class_probabilities = logits * 0.
-            for i, instance_tags in enumerate(predicted_tags):
-                for j, tag_id in enumerate(instance_tags):
-                    class_probabilities[i, j, tag_id] = 1
-
-            for metric in self.metrics.values():
-                metric(class_probabilities, tags, mask.float())
-            if self.calculate_span_f1:
-                self._f1_metric(class_probabilities, tags, mask.float())
+            with phase_timer.phase('metrics'):
+                # Represent viterbi tags as "class probabilities" that we can
+                # feed into the metrics
+                class_probabilities = self._to_class_probabilities(logits, tag_ids, mask)
+
+                for metric in self.metrics.values():
+                    metric(class_probabilities, tags, mask.float())
+                if self.calculate_span_f1:
+                    self._f1_metric(class_probabilities, tags, mask.float())
         if metadata is not None:
             output["words"] = [x["words"] for x in metadata]
         return output
 
+    @staticmethod
+    def _to_class_probabilities(logits: torch.Tensor, tag_ids: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        """
+        :param tag_ids: batch_viterbi.viterbi_tags返回的(batch_size, max_len)的标签id
+        :return: 和logits形状一样，每个词在预测的tag上为1，其它为0，padding的位置都为0
+        """
+        return torch.zeros_like(logits).scatter_(-1, tag_ids.unsqueeze(-1), (mask > 0).unsqueeze(-1).to(logits.dtype))
+
     @overrides
     def decode(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         """
@@ -225,3 +245,12 @@ class CrfTagger(Model):
                         x: y for x, y in f1_dict.items() if
                         "overall" in x})
         return metrics_to_return
+
+
+def set_compute_training_metrics(model: torch.nn.Module, compute_training_metrics: bool):
+    """
+    设置model里所有CrfTagger训练时是否做viterbi解码和更新metrics
+    """
+    for module in model.modules():
+        if isinstance(module, CrfTagger):
+            module.compute_training_metrics = compute_training_metrics
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+训练、评估和预测中每个阶段(读取batch、forward、crf解码、backward、optimizer、评估、callback、checkpoint)用的时间。
+
+默认不计时，phase()几乎没有开销；start()之后每个阶段的时间按嵌套的路径累计(例如train/forward/crf_decode)，
+flush()把累计的结果作为一行json追加到trace文件(jsonl)并清零。Trainer每个epoch结束时flush一次。
+
+GPU上的计算是异步的，synchronize为True时每个阶段开始和结束时调用torch.cuda.synchronize，时间才准确，但会变慢。
+"""
+
+
+import collections
+import contextlib
+import json
+import threading
+import time
+from typing import *
+
+import torch
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.enabled = False
+        self.synchronize = False
+        self.trace_filepath = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._seconds = collections.OrderedDict()
+        self._counts = collections.OrderedDict()
+
+    def start(self, trace_filepath: str = None, synchronize: bool = False):
+        """
+        :param trace_filepath: 为None时只累计，不写文件
+        """
+        self.enabled = True
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.trace_filepath = trace_filepath
+        self.reset()
+
+    def stop(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._seconds = collections.OrderedDict()
+            self._counts = collections.OrderedDict()
+
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add(self, path: str, seconds: float):
+        with self._lock:
+            self._seconds[path] = self._seconds.get(path, 0.0) + seconds
+            self._counts[path] = self._counts.get(path, 0) + 1
+
+    def _now(self) -> float:
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        stack.append(name)
+        path = '/'.join(stack)
+        start = self._now()
+        try:
+            yield
+        finally:
+            self._add(path, self._now() - start)
+            stack.pop()
+
+    def timed(self, iterable: Iterable, name: str) -> Iterator:
+        """
+        和iterable一样，每次取下一个元素的时间计入name阶段(例如读取batch)
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return collections.OrderedDict((path, {'seconds': seconds, 'count': self._counts[path]})
+                                           for path, seconds in self._seconds.items())
+
+    def flush(self, event: str, **fields) -> Dict[str, Dict[str, float]]:
+        """
+        :param event: 例如epoch、evaluate_v2
+        :return: 这次flush之前累计的结果
+        """
+        if not self.enabled:
+            return {}
+        phases = self.summary()
+        self.reset()
+        if phases and self.trace_filepath:
+            record = collections.OrderedDict([('time', time.time()), ('event', event)])
+            record.update(fields)
+            record['phases'] = phases
+            with open(self.trace_filepath, mode='a', encoding='utf-8') as trace_file:
+                trace_file.write(json.dumps(record) + '\n')
+        return phases
+
+
+_timer = PhaseTimer()
+
+
+def get_timer() -> PhaseTimer:
+    return _timer
+
+
+def start(trace_filepath: str = None, synchronize: bool = False):
+    _timer.start(trace_filepath=trace_filepath, synchronize=synchronize)
+
+
+def phase(name: str):
+    return _timer.phase(name)
+
+
+def timed(iterable: Iterable, name: str) -> Iterator:
+    return _timer.timed(iterable, name)
+
+
+def flush(event: str, **fields) -> Dict[str, Dict[str, float]]:
+    return _timer.flush(event, **fields)
+
+
+def format_summary(phases: Dict[str, Dict[str, float]]) -> str:
+    return ', '.join('%s: %.3fs/%d' % (path, value['seconds'], value['count']) for path, value in phases.items())
@@ -44,6 +44,14 @@ from sklearn.metrics import accuracy_score
 
 from nlp_tasks.utils import file_utils
 from nlp_tasks.utils import sequence_labeling_utils
+from nlp_tasks.absa.mining_opinions.data_adapter import ate_prediction_index
+from nlp_tasks.absa.mining_opinions.sequence_labeling import word_piece_pooling
+from nlp_tasks.absa.mining_opinions.sequence_labeling import aspect_term_pooling
+from nlp_tasks.absa.mining_opinions.sequence_labeling import my_allennlp_iterator
+from nlp_tasks.absa.mining_opinions.sequence_labeling import streaming_metrics
+from nlp_tasks.absa.mining_opinions.sequence_labeling import masked_rnn
+from nlp_tasks.absa.mining_opinions.sequence_labeling import sentence_groups
+from nlp_tasks.absa.mining_opinions.sequence_labeling import phase_timer
 
 
 class AttentionInHtt(nn.Module):
@@ -229,37 +237,100 @@ class SimpleSequenceLabelingModel(SequenceLabelingModel):
         viterbi_score = torch.max(trellis[-1], 0)[0].cpu().tolist()
         return viterbi_score, viterbi
 
-    def forward(self, tokens: Dict[str, torch.Tensor], labels: torch.Tensor, position: torch.Tensor,
-                sample: list) -> torch.Tensor:
-        mask = get_text_field_mask(tokens)
+    def batch_total_score(self, logits, mask):
+        """
+        batch版本的total_score
+
+        :params logits -> [batch_size * len_sent * tag_size]
+        :params mask   -> [batch_size * len_sent]
+        :return [batch_size]
+        """
+        mask = mask.float()
+        # 和total_score一样，第一个词之前的分数是从所有标签转移过来的分数的log_sum_exp
+        previous = torch.logsumexp(self.transitions, dim=0).unsqueeze(0) + logits[:, 0]
+        for index in range(1, logits.size(1)):
+            scores = previous.unsqueeze(2) + self.transitions.unsqueeze(0) + logits[:, index].unsqueeze(1)
+            current = torch.logsumexp(scores, dim=1)
+            mask_of_index = mask[:, index].unsqueeze(1)
+            previous = current * mask_of_index + previous * (1 - mask_of_index)
+        previous = previous + self.transitions[:, self.tag_map[STOP_TAG]].unsqueeze(0)
+        total_scores = torch.logsumexp(previous, dim=1)
+        return total_scores
+
+    def batch_real_path_score(self, logits, labels, mask):
+        """
+        batch版本的real_path_score
+
+        :params logits -> [batch_size * len_sent * tag_size]
+        :params labels -> [batch_size * len_sent]
+        :params mask   -> [batch_size * len_sent]
+        :return [batch_size]
+        """
+        labels = labels.long()
+        mask = mask.float()
+        batch_size = labels.size(0)
+        start = torch.full((batch_size, 1), self.tag_map[START_TAG], dtype=torch.long, device=labels.device)
+        previous_labels = torch.cat([start, labels[:, :-1]], dim=1)
+        emission_score = logits.gather(2, labels.unsqueeze(2)).squeeze(2)
+        transition_score = self.transitions[previous_labels, labels]
+        score = ((emission_score + transition_score) * mask).sum(dim=1)
+        last_index = mask.long().sum(dim=1) - 1
+        last_labels = labels.gather(1, last_index.unsqueeze(1)).squeeze(1)
+        score = score + self.transitions[last_labels, self.tag_map[STOP_TAG]]
+        return score
+
+    def batch_viterbi_decode(self, logits, mask):
+        """
+        batch版本的__viterbi_decode，padding的位置回溯时保持标签不变
+
+        :params logits -> [batch_size * len_sent * tag_size]
+        :params mask   -> [batch_size * len_sent]
+        :return viterbi_scores [batch_size], viterbi paths [batch_size * len_sent]
+        """
+        batch_size, length, tag_size = logits.size()
+        mask = mask.long()
+        identity = torch.arange(tag_size, device=logits.device).unsqueeze(0).expand(batch_size, tag_size)
+
+        trellis = logits[:, 0]
+        backpointers = []
+        for t in range(1, length):
+            v = trellis.unsqueeze(2) + self.transitions.unsqueeze(0)
+            max_v, backpointer = torch.max(v, 1)
+            mask_of_t = mask[:, t].unsqueeze(1)
+            trellis = (logits[:, t] + max_v) * mask_of_t.float() + trellis * (1 - mask_of_t).float()
+            backpointers.append(backpointer * mask_of_t + identity * (1 - mask_of_t))
+
+        viterbi_scores, best_tag = torch.max(trellis, -1)
+        viterbi = [best_tag]
+        for backpointer in reversed(backpointers):
+            best_tag = backpointer.gather(1, best_tag.unsqueeze(1)).squeeze(1)
+            viterbi.append(best_tag)
+        viterbi.reverse()
+        return viterbi_scores, torch.stack(viterbi, dim=1)
+
+    def compute_logits(self, tokens: Dict[str, torch.Tensor]):
         sentences = self.word_embedder(tokens)
 
         batch_size = sentences.size(0)
         length = sentences.shape[1]
         embeddings = sentences.view(batch_size, length, self.embedding_dim)
 
-        lstm_out, _ = self.lstm(embeddings)
+        mask = util.get_text_field_mask(tokens)
+        lstm_out = masked_rnn.run_rnn(self.lstm, embeddings, mask)
         lstm_out = lstm_out.view(batch_size, -1, self.hidden_dim)
         logits = self.hidden2tag(lstm_out)
+        return logits
 
-        lengths = [e['length'] for e in sample]
-        scores = []
-        paths = []
-        for logit, leng in zip(logits, lengths):
-            logit = logit[:leng]
-            score, path = self.__viterbi_decode(logit)
-            scores.append(score)
-            paths.append(path)
-        output = {'scores': scores, 'paths': paths}
+    def batch_crf(self, logits, labels, mask):
+        lengths = mask.long().sum(dim=1).tolist()
+        viterbi_scores, viterbi_paths = self.batch_viterbi_decode(logits, mask)
+        viterbi_paths = viterbi_paths.cpu().tolist()
+        paths = [path[:leng] for path, leng in zip(viterbi_paths, lengths)]
+        output = {'scores': viterbi_scores.cpu().tolist(), 'paths': paths}
 
         if labels is not None:
-            real_path_score = torch.zeros(1)
-            total_score = torch.zeros(1)
-            for logit, tag, leng in zip(logits, labels, lengths):
-                logit = logit[:leng]
-                tag = tag[:leng]
-                real_path_score += self.real_path_score(logit, tag)
-                total_score += self.total_score(logit, tag)
+            total_score = self.batch_total_score(logits, mask).sum()
+            real_path_score = self.batch_real_path_score(logits, labels, mask).sum()
             # print("total score ", total_score)
             # print("real score ", real_path_score)
             loss = total_score - real_path_score
@@ -267,6 +338,13 @@ class SimpleSequenceLabelingModel(SequenceLabelingModel):
 
         return output
 
+    def forward(self, tokens: Dict[str, torch.Tensor], labels: torch.Tensor, position: torch.Tensor,
+                sample: list) -> torch.Tensor:
+        mask = get_text_field_mask(tokens)
+        logits = self.compute_logits(tokens)
+        output = self.batch_crf(logits, labels, mask)
+        return output
+
     def get_metrics(self, reset: bool = False) -> Dict[str, float]:
         metrics = {
         }
@@ -301,7 +379,7 @@ class TCBiLSTMWithCrfTagger(SequenceLabelingModel):
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
                 labels: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         max_len = embedded_text_input.shape[1]
@@ -321,7 +399,7 @@ class TCBiLSTMWithCrfTagger(SequenceLabelingModel):
 
         lstm_input = torch.cat([embedded_text_input, aspect_term_representation], dim=-1)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
 
         encoded_text = lstm_result
 
@@ -393,7 +471,7 @@ class TermBiLSTM(SequenceLabelingModel):
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
                 labels: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -404,7 +482,7 @@ class TermBiLSTM(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -490,8 +568,9 @@ class AsteTermBiLSTM(SequenceLabelingModel):
         self._accuracy = metrics.CategoricalAccuracy()
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -502,7 +581,7 @@ class AsteTermBiLSTM(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -517,24 +596,12 @@ class AsteTermBiLSTM(SequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
-        sentiment_outputs = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_output = self.sentiment_fc(aspect_term_representation)
-            sentiment_outputs.append(sentiment_output)
-        sentiment_outputs_cat = torch.cat(sentiment_outputs, dim=0)
+        aspect_term_representations = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                           aspect_term_span=aspect_term_span)
+        sentiment_outputs_cat = self.sentiment_fc(aspect_term_representations)
         atsa_result = {}
         if polarity_label is not None:
             loss = self.sentiment_loss(sentiment_outputs_cat, polarity_label.long())
@@ -619,7 +686,7 @@ class AsoTermBiLSTM(SequenceLabelingModel):
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
                 labels: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -630,7 +697,7 @@ class AsoTermBiLSTM(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -702,57 +769,28 @@ class AsoTermBiLSTMBert(SequenceLabelingModel):
 
         self.dropout = nn.Dropout(0.5)
 
-    def get_bert_embedding(self, bert, sample, word_embeddings_size):
+    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_piece_word_index: torch.Tensor=None,
+                           bert_piece_weight: torch.Tensor=None):
         bert_mask = bert['mask']
         token_type_ids = bert['bert-type-ids']
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
         return aspect_word_embeddings_from_bert_cat
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         mask = util.get_text_field_mask(tokens)
 
         word_embeddings_size = embedded_text_input.size()
-        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size)
+        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size,
+                                                      bert_piece_word_index=bert_piece_word_index,
+                                                      bert_piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -762,7 +800,7 @@ class AsoTermBiLSTMBert(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -834,58 +872,29 @@ class AsoTermBiLSTMBertWithPosition(SequenceLabelingModel):
 
         self.dropout = nn.Dropout(0.5)
 
-    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_position: torch.Tensor):
+    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_position: torch.Tensor,
+                           bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None):
         bert_mask = bert['mask']
         token_type_ids = bert['bert-type-ids']
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets,
                                                        position_ids=bert_position.long())
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
         return aspect_word_embeddings_from_bert_cat
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, bert_position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         mask = util.get_text_field_mask(tokens)
 
         word_embeddings_size = embedded_text_input.size()
-        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size, bert_position)
+        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size, bert_position,
+                                                      bert_piece_word_index=bert_piece_word_index,
+                                                      bert_piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -895,7 +904,7 @@ class AsoTermBiLSTMBertWithPosition(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -1040,8 +1049,9 @@ class AsteTermBiLSTMWithSLA(WarmupSequenceLabelingModel):
         return result
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -1052,7 +1062,7 @@ class AsteTermBiLSTMWithSLA(WarmupSequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -1067,11 +1077,11 @@ class AsteTermBiLSTMWithSLA(WarmupSequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
         if self.configuration['use_different_encoder']:
-            lstm_result, _ = self.sentiment_lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
 
         # sequence label attention
@@ -1103,20 +1113,8 @@ class AsteTermBiLSTMWithSLA(WarmupSequenceLabelingModel):
                 print(' '.join(words))
                 print(['%d-%s-%.3f-O:%s-T:%s' % (j, words[j], temp[j], opinion_words_tags[j], target_tags[j]) for j in range(len(words))])
 
-        sentiment_representations = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_representations.append(aspect_term_representation)
-        sentiment_representations_cat = torch.cat(sentiment_representations, dim=0)
+        sentiment_representations_cat = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                             aspect_term_span=aspect_term_span)
 
         if self.configuration['merge_mode'] == 'sum':
             sentiment_representations_merge = sentiment_representations_from_towe + sentiment_representations_cat
@@ -1244,8 +1242,9 @@ class MILForASO(WarmupSequenceLabelingModel):
         return result
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -1256,7 +1255,7 @@ class MILForASO(WarmupSequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -1271,11 +1270,11 @@ class MILForASO(WarmupSequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
         if self.configuration['use_different_encoder']:
-            lstm_result, _ = self.sentiment_lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         sentiment_outputs_of_words = self.sentiment_fc(lstm_result)
 
@@ -1309,20 +1308,8 @@ class MILForASO(WarmupSequenceLabelingModel):
                 print(' '.join(words))
                 print(['%d-%s-%.3f-O:%s-T:%s' % (j, words[j], temp[j], opinion_words_tags[j], target_tags[j]) for j in range(len(words))])
 
-        sentiment_representations = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_representations.append(aspect_term_representation)
-        sentiment_representations_cat = torch.cat(sentiment_representations, dim=0)
+        sentiment_representations_cat = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                             aspect_term_span=aspect_term_span)
 
         sentiment_outputs_cat = self.sentiment_fc(sentiment_representations_cat)
 
@@ -1451,57 +1438,29 @@ class MILForASOBert(WarmupSequenceLabelingModel):
         result.append(self._tagger_ner)
         return result
 
-    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_word_embedder):
+    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_word_embedder,
+                           bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None):
         bert_mask = bert['mask']
         token_type_ids = bert['bert-type-ids']
         offsets = bert['bert-offsets']
         bert_word_embeddings = bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
         return aspect_word_embeddings_from_bert_cat
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, polarity_label: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         mask = util.get_text_field_mask(tokens)
 
         word_embeddings_size = embedded_text_input.size()
-        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size, self.bert_word_embedder)
+        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size, self.bert_word_embedder,
+                                                      bert_piece_word_index=bert_piece_word_index,
+                                                      bert_piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -1511,7 +1470,7 @@ class MILForASOBert(WarmupSequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -1526,12 +1485,14 @@ class MILForASOBert(WarmupSequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
         if self.configuration['use_different_encoder']:
             embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size,
-                                                          self.another_bert_word_embedder)
+                                                          self.another_bert_word_embedder,
+                                                          bert_piece_word_index=bert_piece_word_index,
+                                                          bert_piece_weight=bert_piece_weight)
 
             if self.configuration['position']:
                 position_input = self.position_embedder(position)
@@ -1540,7 +1501,7 @@ class MILForASOBert(WarmupSequenceLabelingModel):
                 lstm_input = embedded_text_input
 
             lstm_input = self.dropout(lstm_input)
-            lstm_result, _ = self.sentiment_lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         sentiment_outputs_of_words = self.sentiment_fc(lstm_result)
 
@@ -1574,20 +1535,8 @@ class MILForASOBert(WarmupSequenceLabelingModel):
                 print(' '.join(words))
                 print(['%d-%s-%.3f-O:%s-T:%s' % (j, words[j], temp[j], opinion_words_tags[j], target_tags[j]) for j in range(len(words))])
 
-        sentiment_representations = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_representations.append(aspect_term_representation)
-        sentiment_representations_cat = torch.cat(sentiment_representations, dim=0)
+        sentiment_representations_cat = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                             aspect_term_span=aspect_term_span)
 
         sentiment_outputs_cat = self.sentiment_fc(sentiment_representations_cat)
 
@@ -1687,7 +1636,8 @@ class TermBert(SequenceLabelingModel):
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
@@ -1701,42 +1651,9 @@ class TermBert(SequenceLabelingModel):
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -1747,7 +1664,7 @@ class TermBert(SequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -1828,7 +1745,8 @@ class TermBertWithPosition(SequenceLabelingModel):
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, bert_position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
@@ -1843,42 +1761,9 @@ class TermBertWithPosition(SequenceLabelingModel):
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets,
                                                        position_ids=bert_position.long())
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -1889,7 +1774,7 @@ class TermBertWithPosition(SequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -1971,8 +1856,9 @@ class TermBiLSTMWithSecondSentence(SequenceLabelingModel):
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, bert_position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+                labels: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
 
@@ -1988,42 +1874,9 @@ class TermBiLSTMWithSecondSentence(SequenceLabelingModel):
 
         bert_word_embeddings = self.word_embedder(bert)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -2034,7 +1887,7 @@ class TermBiLSTMWithSecondSentence(SequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -2120,7 +1973,9 @@ class AsteTermBert(SequenceLabelingModel):
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None, polarity_label: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
@@ -2134,42 +1989,9 @@ class AsteTermBert(SequenceLabelingModel):
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -2180,7 +2002,7 @@ class AsteTermBert(SequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -2199,24 +2021,12 @@ class AsteTermBert(SequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
-        sentiment_outputs = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_output = self.sentiment_fc(aspect_term_representation)
-            sentiment_outputs.append(sentiment_output)
-        sentiment_outputs_cat = torch.cat(sentiment_outputs, dim=0)
+        aspect_term_representations = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                           aspect_term_span=aspect_term_span)
+        sentiment_outputs_cat = self.sentiment_fc(aspect_term_representations)
         atsa_result = {}
         if polarity_label is not None:
             loss = self.sentiment_loss(sentiment_outputs_cat, polarity_label.long())
@@ -2342,7 +2152,8 @@ class AsteTermBertWithSLA(WarmupSequenceLabelingModel):
         return result
 
     def generate_bert_embedding(self, bert_word_embedder, bert: torch.Tensor,
-                                sample: list, word_embeddings_size):
+                                sample: list, word_embeddings_size, bert_piece_word_index: torch.Tensor=None,
+                                bert_piece_weight: torch.Tensor=None):
         bert_mask = bert['mask']
         # bert_word_embeddings = self.bert_word_embedder(bert)
         token_type_ids = bert['bert-type-ids']
@@ -2352,52 +2163,23 @@ class AsteTermBertWithSLA(WarmupSequenceLabelingModel):
         offsets = bert['bert-offsets']
         bert_word_embeddings = bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
         return aspect_word_embeddings_from_bert_cat
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None, polarity_label: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None, polarity_label: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None,
+                aspect_term_span: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
 
         aspect_word_embeddings_from_bert_cat = self.generate_bert_embedding(self.bert_word_embedder, bert, sample,
-                                                                            word_embeddings_size)
+                                                                            word_embeddings_size,
+                                                                            bert_piece_word_index=bert_piece_word_index,
+                                                                            bert_piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -2408,7 +2190,7 @@ class AsteTermBertWithSLA(WarmupSequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -2427,16 +2209,18 @@ class AsteTermBertWithSLA(WarmupSequenceLabelingModel):
         towe_result = self._tagger_ner.forward(**input_for_crf_tagger)
 
         if self.configuration['lstm_layer_num_of_sentiment_specific'] != 0:
-            lstm_result, _ = self.sentiment_specific_lstm(lstm_result)
+            lstm_result = masked_rnn.run_rnn(self.sentiment_specific_lstm, lstm_result, mask)
             lstm_result = self.dropout(lstm_result)
 
         if self.configuration['use_different_encoder']:
             lstm_input = self.generate_bert_embedding(self.another_bert_word_embedder, bert, sample,
-                                                      word_embeddings_size)
+                                                      word_embeddings_size,
+                                                      bert_piece_word_index=bert_piece_word_index,
+                                                      bert_piece_weight=bert_piece_weight)
             lstm_input = self.dropout(lstm_input)
 
             if self.configuration['lstm_layer_num_in_bert'] != 0:
-                lstm_result, _ = self.sentiment_lstm(lstm_input)
+                lstm_result = masked_rnn.run_rnn(self.sentiment_lstm, lstm_input, mask)
                 lstm_result = self.dropout(lstm_result)
             else:
                 lstm_result = lstm_input
@@ -2471,20 +2255,8 @@ class AsteTermBertWithSLA(WarmupSequenceLabelingModel):
                 print(['%d-%s-%.3f-O:%s-T:%s' % (j, words[j], temp[j], opinion_words_tags[j], target_tags[j]) for j in
                        range(len(words))])
 
-        sentiment_representations = []
-        for i, element in enumerate(sample):
-            word_indices_of_aspect_term = element['word_indices_of_aspect_terms']
-            start_index = word_indices_of_aspect_term[0]
-            end_index = word_indices_of_aspect_term[1]
-            word_representations = lstm_result[i][start_index: end_index]
-            aspect_term_word_num = end_index - start_index
-            if aspect_term_word_num > 1:
-                aspect_term_representation = torch.sum(word_representations, dim=0) / len(word_representations)
-                aspect_term_representation = aspect_term_representation.unsqueeze(0)
-            else:
-                aspect_term_representation = word_representations
-            sentiment_representations.append(aspect_term_representation)
-        sentiment_representations_cat = torch.cat(sentiment_representations, dim=0)
+        sentiment_representations_cat = aspect_term_pooling.average_aspect_terms(lstm_result, sample,
+                                                                             aspect_term_span=aspect_term_span)
 
         if self.configuration['merge_mode'] == 'sum':
             sentiment_representations_merge = sentiment_representations_from_towe + sentiment_representations_cat
@@ -2586,7 +2358,7 @@ class NerLstm(SequenceLabelingModel):
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
                 labels: torch.Tensor=None) -> torch.Tensor:
-        embedded_text_input = self.word_embedder(tokens)
+        embedded_text_input = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens)
         mask = util.get_text_field_mask(tokens)
 
         if self.configuration['position']:
@@ -2597,7 +2369,7 @@ class NerLstm(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -2671,57 +2443,28 @@ class NerBertForOTE(SequenceLabelingModel):
 
         self.dropout = nn.Dropout(0.5)
 
-    def get_bert_embedding(self, bert, sample, word_embeddings_size):
+    def get_bert_embedding(self, bert, sample, word_embeddings_size, bert_piece_word_index: torch.Tensor=None,
+                           bert_piece_weight: torch.Tensor=None):
         bert_mask = bert['mask']
         token_type_ids = bert['bert-type-ids']
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
         return aspect_word_embeddings_from_bert_cat
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         mask = util.get_text_field_mask(tokens)
 
         word_embeddings_size = embedded_text_input.size()
-        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size)
+        embedded_text_input = self.get_bert_embedding(bert, sample, word_embeddings_size,
+                                                      bert_piece_word_index=bert_piece_word_index,
+                                                      bert_piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -2731,7 +2474,7 @@ class NerBertForOTE(SequenceLabelingModel):
 
         lstm_input = self.dropout(lstm_input)
 
-        lstm_result, _ = self.lstm(lstm_input)
+        lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
         lstm_result = self.dropout(lstm_result)
 
         encoded_text = self.feedforward(lstm_result)
@@ -2808,7 +2551,8 @@ class NerBert(SequenceLabelingModel):
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, tokens: Dict[str, torch.Tensor], position: torch.Tensor, sample: list,
-                labels: torch.Tensor=None, bert: torch.Tensor=None) -> torch.Tensor:
+                labels: torch.Tensor=None, bert: torch.Tensor=None,
+                bert_piece_word_index: torch.Tensor=None, bert_piece_weight: torch.Tensor=None) -> torch.Tensor:
         embedded_text_input = self.word_embedder(tokens)
         word_embeddings_size = embedded_text_input.size()
         mask = util.get_text_field_mask(tokens)
@@ -2822,42 +2566,9 @@ class NerBert(SequenceLabelingModel):
         offsets = bert['bert-offsets']
         bert_word_embeddings = self.bert_word_embedder(bert, token_type_ids=token_type_ids, offsets=offsets)
 
-        aspect_word_embeddings_from_bert = []
-        for j in range(len(sample)):
-            aspect_word_embeddings_from_bert_of_one_sample = []
-            all_word_indices_in_bert = sample[j]['word_index_and_bert_indices']
-            for k in range(word_embeddings_size[1]):
-                is_index_greater_than_max_len = False
-                if k in all_word_indices_in_bert:
-                    for index in all_word_indices_in_bert[k]:
-                        if index >= self.configuration['max_len']:
-                            is_index_greater_than_max_len = True
-                            break
-                if not is_index_greater_than_max_len and k in all_word_indices_in_bert:
-                    word_indices_in_bert = all_word_indices_in_bert[k]
-                    word_bert_embeddings = []
-                    for word_index_in_bert in word_indices_in_bert:
-                        word_bert_embedding = bert_word_embeddings[j][word_index_in_bert]
-                        word_bert_embeddings.append(word_bert_embedding)
-                    if len(word_bert_embeddings) == 0:
-                        print()
-                    if len(word_bert_embeddings) > 1:
-                        word_bert_embeddings_unsqueeze = [torch.unsqueeze(e, dim=0) for e in word_bert_embeddings]
-                        word_bert_embeddings_cat = torch.cat(word_bert_embeddings_unsqueeze, dim=0)
-                        word_bert_embeddings_sum = torch.sum(word_bert_embeddings_cat, dim=0)
-                        word_bert_embeddings_ave = word_bert_embeddings_sum / len(word_bert_embeddings)
-                    else:
-                        word_bert_embeddings_ave = word_bert_embeddings[0]
-                    aspect_word_embeddings_from_bert_of_one_sample.append(
-                        torch.unsqueeze(word_bert_embeddings_ave, 0))
-                else:
-                    zero = torch.zeros_like(torch.unsqueeze(bert_word_embeddings[0][0], 0))
-                    aspect_word_embeddings_from_bert_of_one_sample.append(zero)
-            aspect_word_embeddings_from_bert_of_one_sample_cat = torch.cat(
-                aspect_word_embeddings_from_bert_of_one_sample, dim=0)
-            aspect_word_embeddings_from_bert.append(
-                torch.unsqueeze(aspect_word_embeddings_from_bert_of_one_sample_cat, dim=0))
-        aspect_word_embeddings_from_bert_cat = torch.cat(aspect_word_embeddings_from_bert, dim=0)
+        aspect_word_embeddings_from_bert_cat = word_piece_pooling.average_word_pieces(
+            bert_word_embeddings, word_embeddings_size[1], sample, self.configuration['max_len'],
+            piece_word_index=bert_piece_word_index, piece_weight=bert_piece_weight)
 
         if self.configuration['position']:
             position_input = self.position_embedder(position)
@@ -2868,7 +2579,7 @@ class NerBert(SequenceLabelingModel):
         lstm_input = self.dropout(lstm_input)
 
         if self.configuration['lstm_layer_num_in_bert'] != 0:
-            lstm_result, _ = self.lstm(lstm_input)
+            lstm_result = masked_rnn.run_rnn(self.lstm, lstm_input, mask)
             lstm_result = self.dropout(lstm_result)
         else:
             lstm_result = lstm_input
@@ -2937,104 +2648,33 @@ class IOG(SequenceLabelingModel):
 
         self.dropout = nn.Dropout(0.5)
 
-    def forward_backup(self, tokens: Dict[str, torch.Tensor], left_tokens: Dict[str, torch.Tensor],
-                right_tokens: Dict[str, torch.Tensor], target_tokens: Dict[str, torch.Tensor],
-                position: torch.Tensor, sample: list, labels: torch.Tensor=None) -> torch.Tensor:
-        sentence = self.word_embedder(tokens)
-        mask = util.get_text_field_mask(tokens)
-        global_encoded, _ = self.rnn_global(sentence)
-
-        left_sentence = self.word_embedder(left_tokens)
-        left_encoded, temp1 = self.rnn_L(left_sentence)
-        left_shape = list(left_encoded.shape)
-        left_encoded_separated = left_encoded.view([left_shape[0], left_shape[1], 2, left_shape[2] // 2])
-        left_forward = left_encoded_separated[:, :, 0, :]
-        left_backward = left_encoded_separated[:, :, 1, :]
-
-        right_sentence = self.word_embedder(right_tokens)
-        right_encoded, _ = self.rnn_R(right_sentence)
-        right_shape = list(right_encoded.shape)
-        right_encoded_separated = right_encoded.view([right_shape[0], right_shape[1], 2, right_shape[2] // 2])
-        right_forward = right_encoded_separated[:, :, 0, :]
-        right_backward = right_encoded_separated[:, :, 1, :]
-
-        inward = left_forward + right_backward
-
-        outward = left_backward + right_forward
-        ioward = torch.cat([inward, outward], dim=-1)
-
-        target_mask = util.get_text_field_mask(target_tokens)
-        scale = 1 - 0.5 * target_mask
-        scale_unsqueezed = scale.unsqueeze(dim=-1)
-        scale_expanded = scale_unsqueezed.expand_as(ioward)
-
-        final_ioward = ioward * scale_expanded
-
-        encoded_text = torch.cat([global_encoded, final_ioward], dim=-1)
-        input_for_crf_tagger = {
-            'encoded_text': encoded_text,
-            'mask': mask,
-            'tags': labels,
-            'metadata': sample
-        }
-        result = self._tagger_ner.forward(**input_for_crf_tagger)
-
-        return result
-
-    def forward(self, tokens: Dict[str, torch.Tensor], left_tokens: Dict[str, torch.Tensor],
-                right_tokens: Dict[str, torch.Tensor], target_tokens: Dict[str, torch.Tensor],
-                position: torch.Tensor, sample: list, labels: torch.Tensor=None) -> torch.Tensor:
-        # sentence = self.word_embedder(tokens)
-        # mask = util.get_text_field_mask(tokens)
-        # global_encoded, _ = self.rnn_global(sentence)
-        #
-        # left_sentence = self.word_embedder(left_tokens)
-        # left_encoded, temp1 = self.rnn_L(left_sentence)
-        # left_shape = list(left_encoded.shape)
-        # left_encoded_separated = left_encoded.view([left_shape[0], left_shape[1], 2, left_shape[2] // 2])
-        # left_forward = left_encoded_separated[:, :, 0, :]
-        # left_backward = left_encoded_separated[:, :, 1, :]
-        #
-        # right_sentence = self.word_embedder(right_tokens)
-        # right_encoded, _ = self.rnn_R(right_sentence)
-        # right_shape = list(right_encoded.shape)
-        # right_encoded_separated = right_encoded.view([right_shape[0], right_shape[1], 2, right_shape[2] // 2])
-        # right_forward = right_encoded_separated[:, :, 0, :]
-        # right_backward = right_encoded_separated[:, :, 1, :]
-        #
-        # inward = left_forward + right_backward
-        #
-        # outward = left_backward + right_forward
-        # ioward = torch.cat([inward, outward], dim=-1)
-        #
-        # target_mask = util.get_text_field_mask(target_tokens)
-        # scale = 1 - 0.5 * target_mask
-        # scale_unsqueezed = scale.unsqueeze(dim=-1)
-        # scale_expanded = scale_unsqueezed.expand_as(ioward)
-        #
-        # final_ioward = ioward * scale_expanded
-        #
-        # encoded_text = torch.cat([global_encoded, final_ioward], dim=-1)
-
-
-        # target = batch.target
-        # sentence = self.word_rep(batch)
-        sentence = self.word_embedder(tokens)
+    def forward(self, tokens: Dict[str, torch.Tensor], target_span: torch.Tensor, sample: list,
+                labels: torch.Tensor=None) -> torch.Tensor:
+        groups = sentence_groups.sentence_groups(tokens['tokens'])
+        sentence = sentence_groups.embed_once_per_sentence(self.word_embedder, tokens, groups=groups)
         mask = util.get_text_field_mask(tokens)
 
-        # left_mask = batch.left_mask
-        left_mask = util.get_text_field_mask(left_tokens)
-        # right_mask = batch.right_mask
-        right_mask = util.get_text_field_mask(right_tokens)
-        # target_mask = target != 0
-        target_mask = util.get_text_field_mask(target_tokens)
+        # target_span: (batch_size, 2)，aspect term的[start, end)
+        positions = torch.arange(mask.size(1), device=mask.device).unsqueeze(0)
+        target_start = target_span[:, 0: 1]
+        target_end = target_span[:, 1: 2]
+        left_mask = (positions < target_end).long() * mask
+        right_mask = (positions >= target_start).long() * mask
+        target_mask = (positions >= target_start).long() * (positions < target_end).long()
 
         left_context = sentence * left_mask.unsqueeze(-1).float().expand_as(sentence)
         right_context = sentence * right_mask.unsqueeze(-1).float().expand_as(sentence)
 
-        left_encoded, _ = self.rnn_L(left_context)
-        right_encoded, _ = self.rnn_R(right_context)
-        global_encoded, _ = self.rnn_global(sentence)
+        left_encoded = masked_rnn.run_rnn(self.rnn_L, left_context, mask)
+        right_encoded = masked_rnn.run_rnn(self.rnn_R, right_context, mask)
+        if groups[0].size(0) < mask.size(0):
+            # batch里有同一个句子的多个aspect term时，rnn_global每个句子只算一次
+            global_encoded = sentence_groups.run_once_per_sentence(
+                lambda sentence_input, sentence_mask: masked_rnn.run_rnn(self.rnn_global, sentence_input,
+                                                                         sentence_mask),
+                tokens['tokens'], sentence, mask, groups=groups)
+        else:
+            global_encoded = masked_rnn.run_rnn(self.rnn_global, sentence, mask)
 
         left_encoded = left_encoded * left_mask.unsqueeze(-1).float().expand_as(left_encoded)
         right_encoded = right_encoded * right_mask.unsqueeze(-1).float().expand_as(right_encoded)
@@ -3086,107 +2726,37 @@ class SequenceLabelingModelEstimator(Estimator):
         self.configuration = configuration
 
     def score_BIO(self, predicted, golden, ignore_index=-1):
-        # tag2id = {'B': 1, 'I': 2, 'O': 0}
-        assert len(predicted) == len(golden)
-        sum_all = 0
-        sum_correct = 0
-        golden_01_count = 0
-        predict_01_count = 0
-        correct_01_count = 0
-        # print(predicted)
-        # print(golden)
-        for i in range(len(golden)):
-            length = len(golden[i])
-            # print(length)
-            # print(predicted[i])
-            # print(golden[i])
-            golden_01 = 0
-            correct_01 = 0
-            predict_01 = 0
-            predict_items = []
-            golden_items = []
-            golden_seq = []
-            predict_seq = []
-            golden_i = golden[i]
-            predicted_i = predicted[i]
-            for j in range(length):
-                if golden[i][j] == ignore_index:
-                    break
-                if golden[i][j] == 'B':
-                    if len(golden_seq) > 0:  # 00
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                    golden_seq.append(j)
-                elif golden[i][j] == 'I':
-                    if len(golden_seq) > 0:
-                        golden_seq.append(j)
-                elif golden[i][j] == 'O':
-                    if len(golden_seq) > 0:
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                if predicted[i][j] == 'B':
-                    if len(predict_seq) > 0:  # 00
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-                    predict_seq.append(j)
-                elif predicted[i][j] == 'I':
-                    if len(predict_seq) > 0:
-                        predict_seq.append(j)
-                elif predicted[i][j] == 'O':
-                    if len(predict_seq) > 0:
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-            if len(golden_seq) > 0:
-                golden_items.append(golden_seq)
-            if len(predict_seq) > 0:
-                predict_items.append(predict_seq)
-            golden_01 = len(golden_items)
-            predict_01 = len(predict_items)
-            correct_01 = sum([item in golden_items for item in predict_items])
-            # print(correct_01)
-            # print([item in golden_items for item in predict_items])
-            # print(golden_items)
-            # print(predict_items)
-
-            golden_01_count += golden_01
-            predict_01_count += predict_01
-            correct_01_count += correct_01
-        precision = correct_01_count / predict_01_count if predict_01_count > 0 else 0
-        recall = correct_01_count / golden_01_count if golden_01_count > 0 else 0
-        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-        score_dict = {'precision': precision, 'recall': recall, 'f1': f1}
-        return score_dict
+        accumulator = streaming_metrics.SpanF1Accumulator()
+        accumulator.update(predicted, golden)
+        return accumulator.get_metric()
 
     def estimate(self, ds: Iterable[Instance]) -> dict:
+        span_f1 = streaming_metrics.SpanF1Accumulator()
         with torch.no_grad():
             self.model.eval()
             pred_generator = self.iterator(ds, num_epochs=1, shuffle=False)
             pred_generator_tqdm = tqdm(pred_generator,
                                        total=self.iterator.get_num_batches(ds))
-            golden_tags = []
-            predicted_tags = []
             eval_loss = 0
             nb_batches = 0
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'estimate_data'):
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
                 nb_batches += 1
 
-                eval_output_dict = self.model.forward(**batch)
-                eval_output_dict_decoded = self.model.decode(eval_output_dict)
+                with phase_timer.phase('estimate_forward'):
+                    eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('estimate_decode'):
+                    eval_output_dict_decoded = self.model.decode(eval_output_dict)
 
-                golden_tags.extend([instance['opinion_words_tags'] for instance in batch['sample']])
-                predicted_tags.extend(eval_output_dict_decoded['tags'])
+                span_f1.update(eval_output_dict_decoded['tags'],
+                               [instance['opinion_words_tags'] for instance in batch['sample']])
 
                 loss = eval_output_dict["loss"]
                 eval_loss += loss.item()
-                metrics = self.model.get_metrics()
-                metrics["loss"] = float(eval_loss / nb_batches)
-
-        bio_metrics = self.score_BIO(predicted_tags, golden_tags)
 
         metrics = self.model.get_metrics(reset=True)
         metrics["loss"] = float(eval_loss / nb_batches)
-        metrics.update(bio_metrics)
+        metrics.update(span_f1.get_metric())
         return metrics
 
 
@@ -3201,76 +2771,9 @@ class ToweEstimator(Estimator):
         self.configuration = configuration
 
     def score_BIO(self, predicted, golden, ignore_index=-1):
-        # tag2id = {'B': 1, 'I': 2, 'O': 0}
-        assert len(predicted) == len(golden)
-        sum_all = 0
-        sum_correct = 0
-        golden_01_count = 0
-        predict_01_count = 0
-        correct_01_count = 0
-        # print(predicted)
-        # print(golden)
-        for i in range(len(golden)):
-            length = len(golden[i])
-            # print(length)
-            # print(predicted[i])
-            # print(golden[i])
-            golden_01 = 0
-            correct_01 = 0
-            predict_01 = 0
-            predict_items = []
-            golden_items = []
-            golden_seq = []
-            predict_seq = []
-            golden_i = golden[i]
-            predicted_i = predicted[i]
-            for j in range(length):
-                if golden[i][j] == ignore_index:
-                    break
-                if golden[i][j] == 'B':
-                    if len(golden_seq) > 0:  # 00
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                    golden_seq.append(j)
-                elif golden[i][j] == 'I':
-                    if len(golden_seq) > 0:
-                        golden_seq.append(j)
-                elif golden[i][j] == 'O':
-                    if len(golden_seq) > 0:
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                if predicted[i][j] == 'B':
-                    if len(predict_seq) > 0:  # 00
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-                    predict_seq.append(j)
-                elif predicted[i][j] == 'I':
-                    if len(predict_seq) > 0:
-                        predict_seq.append(j)
-                elif predicted[i][j] == 'O':
-                    if len(predict_seq) > 0:
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-            if len(golden_seq) > 0:
-                golden_items.append(golden_seq)
-            if len(predict_seq) > 0:
-                predict_items.append(predict_seq)
-            golden_01 = len(golden_items)
-            predict_01 = len(predict_items)
-            correct_01 = sum([item in golden_items for item in predict_items])
-            # print(correct_01)
-            # print([item in golden_items for item in predict_items])
-            # print(golden_items)
-            # print(predict_items)
-
-            golden_01_count += golden_01
-            predict_01_count += predict_01
-            correct_01_count += correct_01
-        precision = correct_01_count / predict_01_count if predict_01_count > 0 else 0
-        recall = correct_01_count / golden_01_count if golden_01_count > 0 else 0
-        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-        score_dict = {'precision': precision, 'recall': recall, 'f1': f1}
-        return score_dict
+        accumulator = streaming_metrics.SpanF1Accumulator()
+        accumulator.update(predicted, golden)
+        return accumulator.get_metric()
 
     def first_term_from_tags(self, tags: List[str], start_index: int):
         """
@@ -3312,134 +2815,45 @@ class ToweEstimator(Estimator):
             term_with_texts.append('%s-%d-%d' % (term_text, term[0], term[1]))
         return term_with_texts
 
-    def precision_recall_f1(self, pred: set, true: set):
-        """
+    def estimate(self, ds: Iterable[Instance]) -> dict:
+        ate_result_filepath = self.configuration['ate_result_filepath']
+        span_f1 = streaming_metrics.SpanF1Accumulator()
+        aspect_opinion = streaming_metrics.AspectOpinionAccumulator()
+        with torch.no_grad():
+            self.model.eval()
+            pred_generator = self.iterator(ds, num_epochs=1, shuffle=False)
+            pred_generator_tqdm = tqdm(pred_generator,
+                                       total=self.iterator.get_num_batches(ds))
 
-        :param pred:
-        :param true:
-        :return:
-        """
-        intersection = pred.intersection(true)
-        precision = len(intersection) / len(pred)
-        recall = len(intersection) / len(true)
-        if precision == 0 or recall == 0:
-            f1 = 0
-        else:
-            f1 = 2 * precision * recall / (precision + recall)
-        return {'precision': precision, 'recall': recall, 'f1': f1}
+            eval_loss = 0
+            nb_batches = 0
+            for batch in phase_timer.timed(pred_generator_tqdm, 'estimate_data'):
+                batch = allennlp_util.move_to_device(batch, self.cuda_device)
+                nb_batches += 1
 
-    def gold_text_aspect_opinion_for_estimation_from_samples(self, samples: List[dict]):
-        result = []
-        for sample in samples:
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            opinion_words_tags = sample['opinion_words_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            opinion_terms = self.terms_from_tags(opinion_words_tags, words)
-            if len(opinion_terms) == 0:
-                opinion_terms = ['-']
-            for aspect_term in aspect_terms:
-                for opinion_term in opinion_terms:
-                    item = '%s-%s-%s' % (text, aspect_term, opinion_term)
-                    result.append(item)
-        return result
+                with phase_timer.phase('estimate_forward'):
+                    eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('estimate_decode'):
+                    eval_output_dict_decoded = self.model.decode(eval_output_dict)
 
-    def text_aspect_opinion_for_estimation(self, samples: List[dict], tags: List[List[str]]):
-        result = {}
-        for i in range(len(samples)):
-            sample = samples[i]
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            opinion_words_tags = tags[i]
-            opinion_terms = self.terms_from_tags(opinion_words_tags, words)
-            if len(opinion_terms) == 0:
-                opinion_terms = ['-']
-            result['%s-%s' % (text, aspect_terms[0])] = opinion_terms
-        return result
-
-    def estimate_aspect_term_opinin_term_pair(self, samples: List[dict], text_and_ate_pred: dict,
-                                              predicted_tags: List[List[str]]):
-        gold_text_aspect_opinions = self.gold_text_aspect_opinion_for_estimation_from_samples(samples)
-        pred_text_aspect_opinions = self.text_aspect_opinion_for_estimation(samples, predicted_tags)
-        all_pred_text_aspect_opinions = []
-        for text, aspect_terms in text_and_ate_pred.items():
-            for aspect_term in aspect_terms:
-                text_aspect_term = '%s-%s' % (text, aspect_term)
-                opinion_terms = ['-']
-                if text_aspect_term in pred_text_aspect_opinions:
-                    opinion_terms = pred_text_aspect_opinions[text_aspect_term]
-                for opinion_term in opinion_terms:
-                    all_pred_text_aspect_opinions.append('%s-%s' % (text_aspect_term, opinion_term))
-        return self.precision_recall_f1(set(all_pred_text_aspect_opinions),
-                                                         set(gold_text_aspect_opinions))
-
-    def estimate(self, ds: Iterable[Instance]) -> dict:
-        with torch.no_grad():
-            self.model.eval()
-            pred_generator = self.iterator(ds, num_epochs=1, shuffle=False)
-            pred_generator_tqdm = tqdm(pred_generator,
-                                       total=self.iterator.get_num_batches(ds))
-
-            samples = []
-            golden_tags = []
-            predicted_tags = []
-            eval_loss = 0
-            nb_batches = 0
-            for batch in pred_generator_tqdm:
-                samples.extend(batch['sample'])
-
-                batch = allennlp_util.move_to_device(batch, self.cuda_device)
-                nb_batches += 1
-
-                eval_output_dict = self.model.forward(**batch)
-                eval_output_dict_decoded = self.model.decode(eval_output_dict)
-
-                golden_tags.extend([instance['opinion_words_tags'] for instance in batch['sample']])
-                predicted_tags.extend(eval_output_dict_decoded['tags'])
+                predicted_tags = eval_output_dict_decoded['tags']
+                span_f1.update(predicted_tags, [instance['opinion_words_tags'] for instance in batch['sample']])
+                if ate_result_filepath:
+                    aspect_opinion.update(batch['sample'], predicted_tags)
 
                 loss = eval_output_dict["loss"]
                 eval_loss += loss.item()
-                metrics = self.model.get_metrics()
-                metrics["loss"] = float(eval_loss / nb_batches)
-
-        bio_metrics = self.score_BIO(predicted_tags, golden_tags)
 
         metrics = self.model.get_metrics(reset=True)
         metrics["loss"] = float(eval_loss / nb_batches)
-        metrics.update(bio_metrics)
+        metrics.update(span_f1.get_metric())
 
-        ate_result_filepath = self.configuration['ate_result_filepath']
         if ate_result_filepath:
-            ate_result = file_utils.read_all_lines(ate_result_filepath)
-            text_and_ate_pred = {}
-            for line in ate_result:
-                line_dict = json.loads(line, encoding='utf-8')
-                ate_pred = line_dict['pred']
-                if self.configuration['model_name'] in ['TermBiLSTM', 'TermBert']:
-                    adjusted_ate_pred = []
-                    for aspect_term in ate_pred:
-                        parts = aspect_term.split('-')
-                        start_index = str(int(parts[-2]) + 1)
-                        end_index = str(int(parts[-1]) + 1)
-                        parts[-2] = start_index
-                        parts[-1] = end_index
-                        adjusted_ate_pred.append('-'.join(parts))
-                else:
-                    adjusted_ate_pred = ate_pred
-                text_and_ate_pred[line_dict['text']] = adjusted_ate_pred
+            offset = 1 if self.configuration['model_name'] in ['TermBiLSTM', 'TermBert'] else 0
+            text_and_ate_pred = ate_prediction_index.load(ate_result_filepath).text_and_spans(offset=offset)
 
             # aspect term, opinion term pair evaluation
-            aspect_term_opinion_term_metrics = self.estimate_aspect_term_opinin_term_pair(samples, text_and_ate_pred,
-                                                                                          predicted_tags)
+            aspect_term_opinion_term_metrics = aspect_opinion.aspect_opinion_pair_metrics(text_and_ate_pred)
             metrics['aspect_term_opinion_term_metrics'] = aspect_term_opinion_term_metrics
 
         return metrics
@@ -3457,76 +2871,9 @@ class AsteEstimator(Estimator):
         self._accuracy = metrics.CategoricalAccuracy()
 
     def score_BIO(self, predicted, golden, ignore_index=-1):
-        # tag2id = {'B': 1, 'I': 2, 'O': 0}
-        assert len(predicted) == len(golden)
-        sum_all = 0
-        sum_correct = 0
-        golden_01_count = 0
-        predict_01_count = 0
-        correct_01_count = 0
-        # print(predicted)
-        # print(golden)
-        for i in range(len(golden)):
-            length = len(golden[i])
-            # print(length)
-            # print(predicted[i])
-            # print(golden[i])
-            golden_01 = 0
-            correct_01 = 0
-            predict_01 = 0
-            predict_items = []
-            golden_items = []
-            golden_seq = []
-            predict_seq = []
-            golden_i = golden[i]
-            predicted_i = predicted[i]
-            for j in range(length):
-                if golden[i][j] == ignore_index:
-                    break
-                if golden[i][j] == 'B':
-                    if len(golden_seq) > 0:  # 00
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                    golden_seq.append(j)
-                elif golden[i][j] == 'I':
-                    if len(golden_seq) > 0:
-                        golden_seq.append(j)
-                elif golden[i][j] == 'O':
-                    if len(golden_seq) > 0:
-                        golden_items.append(golden_seq)
-                        golden_seq = []
-                if predicted[i][j] == 'B':
-                    if len(predict_seq) > 0:  # 00
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-                    predict_seq.append(j)
-                elif predicted[i][j] == 'I':
-                    if len(predict_seq) > 0:
-                        predict_seq.append(j)
-                elif predicted[i][j] == 'O':
-                    if len(predict_seq) > 0:
-                        predict_items.append(predict_seq)
-                        predict_seq = []
-            if len(golden_seq) > 0:
-                golden_items.append(golden_seq)
-            if len(predict_seq) > 0:
-                predict_items.append(predict_seq)
-            golden_01 = len(golden_items)
-            predict_01 = len(predict_items)
-            correct_01 = sum([item in golden_items for item in predict_items])
-            # print(correct_01)
-            # print([item in golden_items for item in predict_items])
-            # print(golden_items)
-            # print(predict_items)
-
-            golden_01_count += golden_01
-            predict_01_count += predict_01
-            correct_01_count += correct_01
-        precision = correct_01_count / predict_01_count if predict_01_count > 0 else 0
-        recall = correct_01_count / golden_01_count if golden_01_count > 0 else 0
-        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-        score_dict = {'precision': precision, 'recall': recall, 'f1': f1}
-        return score_dict
+        accumulator = streaming_metrics.SpanF1Accumulator()
+        accumulator.update(predicted, golden)
+        return accumulator.get_metric()
 
     def first_term_from_tags(self, tags: List[str], start_index: int):
         """
@@ -3568,301 +2915,79 @@ class AsteEstimator(Estimator):
             term_with_texts.append('%s-%d-%d' % (term_text, term[0], term[1]))
         return term_with_texts
 
-    def precision_recall_f1(self, pred: set, true: set):
-        """
-
-        :param pred:
-        :param true:
-        :return:
-        """
-        intersection = pred.intersection(true)
-        precision = len(intersection) / len(pred)
-        recall = len(intersection) / len(true)
-        if precision == 0 or recall == 0:
-            f1 = 0
-        else:
-            f1 = 2 * precision * recall / (precision + recall)
-        return {'precision': precision, 'recall': recall, 'f1': f1}
-
-    def gold_text_aspect_opinion_for_estimation_from_samples(self, samples: List[dict]):
-        result = []
-        for sample in samples:
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            opinion_words_tags = sample['opinion_words_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            opinion_terms = self.terms_from_tags(opinion_words_tags, words)
-            if len(opinion_terms) == 0:
-                opinion_terms = ['-']
-            for aspect_term in aspect_terms:
-                for opinion_term in opinion_terms:
-                    item = '%s-%s-%s' % (text, aspect_term, opinion_term)
-                    result.append(item)
-        return result
-
-    def text_aspect_opinion_for_estimation(self, samples: List[dict], tags: List[List[str]]):
-        result = {}
-        for i in range(len(samples)):
-            sample = samples[i]
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            opinion_words_tags = tags[i]
-            opinion_terms = self.terms_from_tags(opinion_words_tags, words)
-            if len(opinion_terms) == 0:
-                opinion_terms = ['-']
-            result['%s-%s' % (text, aspect_terms[0])] = opinion_terms
-        return result
-
-    def estimate_aspect_term_opinin_term_pair(self, samples: List[dict], text_and_ate_pred: dict,
-                                              predicted_tags: List[List[str]]):
-        gold_text_aspect_opinions = self.gold_text_aspect_opinion_for_estimation_from_samples(samples)
-        pred_text_aspect_opinions = self.text_aspect_opinion_for_estimation(samples, predicted_tags)
-        all_pred_text_aspect_opinions = []
-        for text, aspect_terms in text_and_ate_pred.items():
-            for aspect_term in aspect_terms:
-                text_aspect_term = '%s-%s' % (text, aspect_term)
-                opinion_terms = ['-']
-                if text_aspect_term in pred_text_aspect_opinions:
-                    opinion_terms = pred_text_aspect_opinions[text_aspect_term]
-                for opinion_term in opinion_terms:
-                    all_pred_text_aspect_opinions.append('%s-%s' % (text_aspect_term, opinion_term))
-        return self.precision_recall_f1(set(all_pred_text_aspect_opinions),
-                                                         set(gold_text_aspect_opinions))
-
-    def gold_text_aspect_sentiment_for_estimation_from_samples(self, samples: List[dict]):
-        result = []
-        for sample in samples:
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            sentiment = sample['polarity']
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            item = '%s-%s-%s' % (text, aspect_terms[0], sentiment)
-            result.append(item)
-        return result
-
-    def text_aspect_sentiment_for_estimation(self, samples: List[dict], sentiment_logit_total):
-        result = {}
-        sentiment_logit_total_list = sentiment_logit_total.detach().cpu().numpy().tolist()
-        polarities = self.configuration['polarities'].split(',')
-        for i in range(len(samples)):
-            sample = samples[i]
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            sentiment_logit: List = sentiment_logit_total_list[i]
-            sentiment_index = sentiment_logit.index(max(sentiment_logit))
-            sentiment = polarities[sentiment_index]
-            result['%s-%s' % (text, aspect_terms[0])] = sentiment
-        return result
-
-    def estimate_aspect_term_sentiment_pair(self, samples: List[dict], text_and_ate_pred: dict,
-                                            sentiment_logit_total):
-        gold_text_aspect_sentiments = self.gold_text_aspect_sentiment_for_estimation_from_samples(samples)
-        pred_text_aspect_sentiments = self.text_aspect_sentiment_for_estimation(samples, sentiment_logit_total)
-        all_pred_text_aspect_sentiments = []
-        for text, aspect_terms in text_and_ate_pred.items():
-            for aspect_term in aspect_terms:
-                text_aspect_term = '%s-%s' % (text, aspect_term)
-                sentiment = '-'
-                if text_aspect_term in pred_text_aspect_sentiments:
-                    sentiment = pred_text_aspect_sentiments[text_aspect_term]
-                all_pred_text_aspect_sentiments.append('%s-%s' % (text_aspect_term, sentiment))
-        return self.precision_recall_f1(set(all_pred_text_aspect_sentiments),
-                                                         set(gold_text_aspect_sentiments))
-
-    def gold_text_aspect_opinion_sentiment_for_estimation_from_samples(self, samples: List[dict]):
-        result = []
-        for sample in samples:
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            opinion_words_tags = sample['opinion_words_tags']
-            sentiment = sample['polarity']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if len(aspect_terms) > 1:
-                raise Exception('size of aspect_terms > 1')
-            opinion_terms = self.terms_from_tags(opinion_words_tags, words)
-            if len(opinion_terms) == 0:
-                opinion_terms = ['-']
-            for aspect_term in aspect_terms:
-                for opinion_term in opinion_terms:
-                    item = '%s-%s-%s-%s' % (text, aspect_term, opinion_term, sentiment)
-                    result.append(item)
-        return result
-
-    def gold_text_aspect_for_estimation_from_samples(self, samples: List[dict]):
-        result = {}
-        for sample in samples:
-            words = sample['words']
-            # text = sample['metadata']['original_line'].split('####')[0]
-            text = sample['metadata']['original_line_data']['sentence']
-            target_tags = sample['target_tags']
-            aspect_terms = self.terms_from_tags(target_tags, words)
-            if text not in result:
-                result[text] = []
-            result[text].append(aspect_terms[0])
-        return result
-
-    def estimate_aspect_opinion_sentiment_triplet(self, samples: List[dict], text_and_ate_pred: dict,
-                                                  predicted_tags: List[List[str]],
-                                                  sentiment_logit_total):
-        gold_text_aspect_opinion_sentiments = self.gold_text_aspect_opinion_sentiment_for_estimation_from_samples(samples)
-        pred_text_aspect_opinions = self.text_aspect_opinion_for_estimation(samples, predicted_tags)
-        pred_text_aspect_sentiments = self.text_aspect_sentiment_for_estimation(samples, sentiment_logit_total)
-        all_pred_text_aspect_opinion_sentiments = []
-        for text, aspect_terms in text_and_ate_pred.items():
-            for aspect_term in aspect_terms:
-                text_aspect_term = '%s-%s' % (text, aspect_term)
-                opinion_terms = ['-']
-                if text_aspect_term in pred_text_aspect_opinions:
-                    opinion_terms = pred_text_aspect_opinions[text_aspect_term]
-                sentiment = '-'
-                if text_aspect_term in pred_text_aspect_sentiments:
-                    sentiment = pred_text_aspect_sentiments[text_aspect_term]
-                for opinion_term in opinion_terms:
-                    all_pred_text_aspect_opinion_sentiments.append('%s-%s-%s' % (text_aspect_term, opinion_term,
-                                                                                 sentiment))
-        return self.precision_recall_f1(set(gold_text_aspect_opinion_sentiments),
-                                                         set(all_pred_text_aspect_opinion_sentiments))
-
-    def estimate_opinion_sentiment_pair(self, samples: List[dict], text_and_ate_pred: dict,
-                                                  predicted_tags: List[List[str]],
-                                                  sentiment_logit_total):
-        gold_text_aspect_opinion_sentiments = self.gold_text_aspect_opinion_sentiment_for_estimation_from_samples(samples)
-        pred_text_aspect_opinions = self.text_aspect_opinion_for_estimation(samples, predicted_tags)
-        pred_text_aspect_sentiments = self.text_aspect_sentiment_for_estimation(samples, sentiment_logit_total)
-        all_pred_text_aspect_opinion_sentiments = []
-        text_and_ate_pred = self.gold_text_aspect_for_estimation_from_samples(samples)
-        for text, aspect_terms in text_and_ate_pred.items():
-            for aspect_term in aspect_terms:
-                text_aspect_term = '%s-%s' % (text, aspect_term)
-                opinion_terms = ['-']
-                if text_aspect_term in pred_text_aspect_opinions:
-                    opinion_terms = pred_text_aspect_opinions[text_aspect_term]
-                sentiment = '-'
-                if text_aspect_term in pred_text_aspect_sentiments:
-                    sentiment = pred_text_aspect_sentiments[text_aspect_term]
-                for opinion_term in opinion_terms:
-                    all_pred_text_aspect_opinion_sentiments.append('%s-%s-%s' % (text_aspect_term, opinion_term,
-                                                                                 sentiment))
-        return self.precision_recall_f1(set(gold_text_aspect_opinion_sentiments),
-                                                         set(all_pred_text_aspect_opinion_sentiments))
-
     def estimate(self, ds: Iterable[Instance], data_type=None) -> dict:
+        polarities = self.configuration['polarities'].split(',')
+        span_f1 = streaming_metrics.SpanF1Accumulator()
+        aspect_opinion = streaming_metrics.AspectOpinionAccumulator()
         with torch.no_grad():
             self.model.eval()
             pred_generator = self.iterator(ds, num_epochs=1, shuffle=False)
             pred_generator_tqdm = tqdm(pred_generator,
                                        total=self.iterator.get_num_batches(ds))
-            samples = []
 
-            golden_tags = []
-            predicted_tags = []
             eval_loss = 0
             nb_batches = 0
-
-            sentiment_logits = []
-            sentiment_labels = []
-            for batch in pred_generator_tqdm:
-                samples.extend(batch['sample'])
-
+            for batch in phase_timer.timed(pred_generator_tqdm, 'estimate_data'):
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
                 nb_batches += 1
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('estimate_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
                 # towe
                 towe_result = eval_output_dict['towe_result']
 
-                towe_result_dict_decoded = self.model.decode(towe_result)
+                with phase_timer.phase('estimate_decode'):
+                    towe_result_dict_decoded = self.model.decode(towe_result)
 
-                golden_tags.extend([instance['opinion_words_tags'] for instance in batch['sample']])
-                predicted_tags.extend(towe_result_dict_decoded['tags'])
+                predicted_tags = towe_result_dict_decoded['tags']
+                span_f1.update(predicted_tags, [instance['opinion_words_tags'] for instance in batch['sample']])
 
                 loss = towe_result["loss"]
                 eval_loss += loss.item()
-                metrics = self.model.get_metrics()
-                metrics["loss"] = float(eval_loss / nb_batches)
 
                 # atsa
                 atsa_result = eval_output_dict['atsa_result']
                 sentiment_logit = atsa_result['logit']
                 sentiment_label = atsa_result['label']
-                sentiment_logits.append(sentiment_logit)
-                sentiment_labels.append(sentiment_label)
-
-        bio_metrics = self.score_BIO(predicted_tags, golden_tags)
+                self._accuracy(sentiment_logit, sentiment_label)
+                predicted_sentiments = []
+                for logit in sentiment_logit.detach().cpu().numpy().tolist():
+                    predicted_sentiments.append(polarities[logit.index(max(logit))])
+                aspect_opinion.update(batch['sample'], predicted_tags, predicted_sentiments=predicted_sentiments)
 
         metrics = self.model.get_metrics(reset=True)
         metrics["loss"] = float(eval_loss / nb_batches)
-        metrics.update(bio_metrics)
+        metrics.update(span_f1.get_metric())
 
-        sentiment_logit_total = torch.cat(sentiment_logits, dim=0)
-        sentiment_label_total = torch.cat(sentiment_labels, dim=0)
-        self._accuracy(sentiment_logit_total, sentiment_label_total)
         sentiment_acc = self._accuracy.get_metric(reset=True)
         metrics['sentiment_acc'] = sentiment_acc
 
         # evaluate opinion term sentiment pair
-        opinion_sentiment_metrics = self.estimate_opinion_sentiment_pair(samples, None,
-                                                                      predicted_tags,
-                                                                      sentiment_logit_total)
+        opinion_sentiment_metrics = aspect_opinion.triplet_metrics(None)
         metrics['opinion_sentiment_metrics'] = opinion_sentiment_metrics
         metrics['opinion_sentiment_f1'] = opinion_sentiment_metrics['f1']
 
         ate_result_filepath = self.configuration['ate_result_filepath']
         if ate_result_filepath:
-            ate_result = file_utils.read_all_lines(ate_result_filepath)
-            text_and_ate_pred = {}
-            for line in ate_result:
-                line_dict = json.loads(line, encoding='utf-8')
-                ate_pred = line_dict['pred']
-                if self.configuration['model_name'] in ['AsteTermBiLSTM', 'AsteTermBert'] \
-                        and self.configuration['aspect_term_aware']:
-                    adjusted_ate_pred = []
-                    for aspect_term in ate_pred:
-                        parts = aspect_term.split('-')
-                        start_index = str(int(parts[-2]) + 1)
-                        end_index = str(int(parts[-1]) + 1)
-                        parts[-2] = start_index
-                        parts[-1] = end_index
-                        adjusted_ate_pred.append('-'.join(parts))
-                text_and_ate_pred[line_dict['text']] = adjusted_ate_pred
+            offset = 0
+            if self.configuration['model_name'] in ['AsteTermBiLSTM', 'AsteTermBert'] \
+                    and self.configuration['aspect_term_aware']:
+                offset = 1
+            text_and_ate_pred = ate_prediction_index.load(ate_result_filepath).text_and_spans(offset=offset)
 
             # aspect term, opinion term pair evaluation
-            aspect_term_opinion_term_metrics = self.estimate_aspect_term_opinin_term_pair(samples, text_and_ate_pred,
-                                                                                          predicted_tags)
+            aspect_term_opinion_term_metrics = aspect_opinion.aspect_opinion_pair_metrics(text_and_ate_pred)
             metrics['aspect_term_opinion_term_metrics'] = aspect_term_opinion_term_metrics
             metrics['aspect_term_opinion_term_f1'] = aspect_term_opinion_term_metrics['f1']
 
             # aspect term, sentiment pair evaluation
-            aspect_term_sentiment_pair_metrics = self.estimate_aspect_term_sentiment_pair(samples, text_and_ate_pred,
-                                                                                          sentiment_logit_total)
+            aspect_term_sentiment_pair_metrics = aspect_opinion.aspect_sentiment_pair_metrics(text_and_ate_pred)
             metrics['aspect_term_sentiment_pair_metrics'] = aspect_term_sentiment_pair_metrics
             metrics['aspect_term_sentiment_pair_f1'] = aspect_term_sentiment_pair_metrics['f1']
 
             # aste evaluation
-            aste_metrics = self.estimate_aspect_opinion_sentiment_triplet(samples, text_and_ate_pred,
-                                                                          predicted_tags,
-                                                                          sentiment_logit_total)
+            aste_metrics = aspect_opinion.triplet_metrics(text_and_ate_pred)
             metrics['aste_metrics'] = aste_metrics
             metrics['aste_f1'] = aste_metrics['f1']
 
@@ -4314,13 +3439,14 @@ class MilAsoEstimator(Estimator):
 
             golden_tags_with_polarity = []
             predicted_tags_with_polarity = []
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'estimate_data'):
                 samples.extend(batch['sample'])
 
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
                 nb_batches += 1
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('estimate_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
                 loss = eval_output_dict["loss"]
                 eval_loss += loss.item()
@@ -4328,7 +3454,8 @@ class MilAsoEstimator(Estimator):
                 # towe
                 towe_result = eval_output_dict['towe_result']
 
-                towe_result_dict_decoded = self.model.decode(towe_result)
+                with phase_timer.phase('estimate_decode'):
+                    towe_result_dict_decoded = self.model.decode(towe_result)
 
                 golden_tags.extend([instance['opinion_words_tags'] for instance in batch['sample']])
                 predicted_tags.extend(towe_result_dict_decoded['tags'])
@@ -4683,15 +3810,17 @@ class AsoEstimator(Estimator):
             eval_loss = 0
             nb_batches = 0
 
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'estimate_data'):
                 samples.extend(batch['sample'])
 
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
                 nb_batches += 1
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('estimate_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
-                so_result_dict_decoded = self.model.decode(eval_output_dict)
+                with phase_timer.phase('estimate_decode'):
+                    so_result_dict_decoded = self.model.decode(eval_output_dict)
 
                 golden_tags.extend([instance['opinion_words_tags'] for instance in batch['sample']])
                 predicted_tags.extend(so_result_dict_decoded['tags'])
@@ -5232,14 +4361,15 @@ class MilAsoPredictor(Predictor):
             predicted_tags_with_polarity = []
 
             test_set_aspect_term_polarities = []
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'predict_data'):
                 samples.extend(batch['sample'])
 
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
 
                 [test_set_aspect_term_polarities.append(e['polarity']) for e in batch['sample']]
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('predict_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
                 # self.print_word_sentiment_and_attention(eval_output_dict['atsa_result']['sentiment_outputs_of_words'],
                 #                                         eval_output_dict['atsa_result']['towe_attention'],
@@ -5248,7 +4378,8 @@ class MilAsoPredictor(Predictor):
                 # towe
                 towe_result = eval_output_dict['towe_result']
 
-                towe_result_dict_decoded = self.model.decode(towe_result)
+                with phase_timer.phase('predict_decode'):
+                    towe_result_dict_decoded = self.model.decode(towe_result)
                 temp = []
                 for i in range(len(towe_result_dict_decoded['tags'])):
                     tags_e = towe_result_dict_decoded['tags'][i]
@@ -5309,6 +4440,7 @@ class MilAsoPredictor(Predictor):
                                         'aspect_term_spolarity': aspect_term_spolarity
                                         })
 
+            opinions_result = my_allennlp_iterator.restore_order(self.iterator, ds, opinions_result)
             return opinions_result
 
 
@@ -5329,12 +4461,15 @@ class SequenceLabelingModelPredictor(Predictor):
             pred_generator_tqdm = tqdm(pred_generator,
                                        total=self.iterator.get_num_batches(ds))
             result = []
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'predict_data'):
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
 
-                eval_output_dict = self.model.forward(**batch)
-                eval_output_dict = self.model.decode(eval_output_dict)
+                with phase_timer.phase('predict_forward'):
+                    eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('predict_decode'):
+                    eval_output_dict = self.model.decode(eval_output_dict)
                 result.extend(eval_output_dict['tags'])
+        result = my_allennlp_iterator.restore_order(self.iterator, ds, result)
         return result
 
 
@@ -5397,14 +4532,16 @@ class AstePredictor(Predictor):
                                        total=self.iterator.get_num_batches(ds))
             predicted_tags = []
             sentiment_logits = []
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'predict_data'):
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('predict_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
                 # towe
                 towe_result = eval_output_dict['towe_result']
-                towe_result_dict_decoded = self.model.decode(towe_result)
+                with phase_timer.phase('predict_decode'):
+                    towe_result_dict_decoded = self.model.decode(towe_result)
                 predicted_tags.extend(towe_result_dict_decoded['tags'])
 
                 # atsa
@@ -5425,6 +4562,8 @@ class AstePredictor(Predictor):
                 elif polarity == 'NEU':
                     polarity = 'neutral'
                 sentiment_polarities.append(polarity)
+        predicted_tags = my_allennlp_iterator.restore_order(self.iterator, ds, predicted_tags)
+        sentiment_polarities = my_allennlp_iterator.restore_order(self.iterator, ds, sentiment_polarities)
         return {'predicted_tags': predicted_tags, 'sentiment_polarities': sentiment_polarities}
 
 
@@ -5499,12 +4638,14 @@ class AsoPredictor(Predictor):
             pred_generator_tqdm = tqdm(pred_generator,
                                        total=self.iterator.get_num_batches(ds))
             result = []
-            for batch in pred_generator_tqdm:
+            for batch in phase_timer.timed(pred_generator_tqdm, 'predict_data'):
                 batch = allennlp_util.move_to_device(batch, self.cuda_device)
 
-                eval_output_dict = self.model.forward(**batch)
+                with phase_timer.phase('predict_forward'):
+                    eval_output_dict = self.model.forward(**batch)
 
-                so_result_dict_decoded = self.model.decode(eval_output_dict)
+                with phase_timer.phase('predict_decode'):
+                    so_result_dict_decoded = self.model.decode(eval_output_dict)
                 sample = batch['sample']
                 for i in range(len(sample)):
                     original_line_data = sample[i]['metadata']['original_line_data']
@@ -5527,4 +4668,5 @@ class AsoPredictor(Predictor):
                         opinions_true = []
                     result.append({'words': original_line_data['words'], 'opinions': opinions, 'opinions_true': opinions_true, 'word_indices_of_aspect_terms': original_line_data['aspect_term']})
 
+        result = my_allennlp_iterator.restore_order(self.iterator, ds, result)
         return result
\ No newline at end of file
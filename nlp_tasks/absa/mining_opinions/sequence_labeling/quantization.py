@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+预测和评估时的动态int8量化: nn.LSTM和nn.Linear(包括bert encoder里的)的权重保存为int8，激活在运行时量化。
+量化后的模型只能在CPU上运行。
+
+量化会改变结果，ToweModel.quantize先在dev上比较量化前后的span f1，下降不超过阈值才使用和保存量化后的模型。
+
+需要torch>=1.3(torch.quantization)。量化后的模型只保存state_dict，加载时先量化原来的模型再加载state_dict；保存时记录原来的
+模型文件(路径、修改时间、大小)，原来的模型变化后保存的量化后的模型不再使用。
+"""
+
+
+import copy
+import os
+
+import torch
+import torch.nn as nn
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import bert_feature_cache
+
+
+QUANTIZED_MODULE_TYPES = {nn.LSTM, nn.Linear}
+
+
+def is_supported() -> bool:
+    return hasattr(torch, 'quantization') and hasattr(torch.quantization, 'quantize_dynamic')
+
+
+def _remove_bert_feature_cache(model: nn.Module):
+    """
+    缓存里是没有量化的bert的输出，量化后的模型直接调用bert，也不能把量化后的输出写进缓存
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if not isinstance(child, bert_feature_cache.CachedBertEmbedder):
+                continue
+            setattr(module, name, child.bert_embedder)
+            # BasicTextFieldEmbedder还在_token_embedders里保存了一份
+            token_embedders = getattr(module, '_token_embedders', None)
+            if isinstance(token_embedders, dict):
+                for key, embedder in token_embedders.items():
+                    if embedder is child:
+                        token_embedders[key] = child.bert_embedder
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    """
+    :param model: 不会被修改
+    :return: 在CPU上、eval模式的量化后的模型
+    """
+    if not is_supported():
+        raise NotImplementedError('dynamic quantization needs torch>=1.3, current version: %s' % torch.__version__)
+    model = copy.deepcopy(model).cpu()
+    model.eval()
+    _remove_bert_feature_cache(model)
+    return torch.quantization.quantize_dynamic(model, QUANTIZED_MODULE_TYPES, dtype=torch.qint8, inplace=True)
+
+
+def float_model_fingerprint(filepath: str) -> dict:
+    """
+    :param filepath: 原来的模型的文件
+    :return: 和量化后的模型一起保存，用于判断量化后的模型是不是由这个文件里的模型生成的
+    """
+    stat = os.stat(filepath)
+    return {'filepath': os.path.abspath(filepath), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def save_quantized(quantized_model: nn.Module, filepath: str):
+    """
+    先写临时文件再替换，中断时不会留下不完整的文件
+    """
+    temp_filepath = '%s.%d.tmp' % (filepath, os.getpid())
+    torch.save(quantized_model.state_dict(), temp_filepath)
+    os.replace(temp_filepath, filepath)
+
+
+def load_quantized(model: nn.Module, filepath: str) -> nn.Module:
+    """
+    :param model: 原来的模型，不会被修改
+    :param filepath: save_quantized保存的文件
+    :return: 在CPU上、eval模式的量化后的模型
+    """
+    quantized_model = quantize_dynamic(model)
+    quantized_model.load_state_dict(torch.load(filepath, map_location=torch.device('cpu')))
+    return quantized_model
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+instance的MetadataField里的sample(words、target_tags、bert_words、word_index_and_bert_indices等)列式存储在一个表里，
+instance只保存表和sample的整数id(SampleRef)。
+
+每个key一列: 字符串的列表(例如words)存成字符串id的扁平数组加偏移表，整数的列表(例如word_indices_of_aspect_terms)
+存成扁平的整数数组加偏移表，word_index_and_bert_indices这样的int -> List[int]存成两层偏移表，dict(例如metadata和
+original_line_data)和dict的列表(例如opinions)递归地存成子表，其它值原样保存。所有子表共用一个字符串表。
+SampleRef实现了Mapping，读取sample['words']等和原来的dict一样。每个key第一次读取时从表里解码，之后返回同一个对象，
+和dict一样修改返回的list和dict对之后的读取可见，但不会影响表。
+batch、instance缓存和进程间传递的只有表和id，pickle单个SampleRef时转换成dict。
+"""
+
+
+import collections.abc
+from typing import *
+
+import numpy as np
+from allennlp.data.fields import MetadataField
+from allennlp.data.instance import Instance
+
+
+_STRING = 'string'
+_INT = 'int'
+_STRING_LIST = 'string_list'
+_INT_LIST = 'int_list'
+_INT_TO_INT_LIST = 'int_to_int_list'
+_TABLE = 'table'
+_TABLE_LIST = 'table_list'
+_OBJECT = 'object'
+
+
+def _is_int(value):
+    # bool也是int，按原样保存
+    return type(value) is int
+
+
+def _is_list_of(value, predicate):
+    return type(value) is list and all(predicate(e) for e in value)
+
+
+def _is_int_to_int_list(value):
+    return type(value) is dict and all(_is_int(k) and _is_list_of(v, _is_int) for k, v in value.items())
+
+
+def _is_str_key_dict(value):
+    return type(value) is dict and all(type(k) is str for k in value.keys())
+
+
+def _column_kind(values: list):
+    """
+    :param values: 一个key在所有有这个key的sample里的值
+    """
+    if all(type(value) is str for value in values):
+        return _STRING
+    if all(_is_int(value) for value in values):
+        return _INT
+    if all(_is_list_of(value, lambda e: type(e) is str) for value in values):
+        return _STRING_LIST
+    if all(_is_list_of(value, _is_int) for value in values):
+        return _INT_LIST
+    if all(_is_int_to_int_list(value) for value in values):
+        return _INT_TO_INT_LIST
+    if all(_is_str_key_dict(value) for value in values):
+        return _TABLE
+    if all(_is_list_of(value, _is_str_key_dict) for value in values):
+        return _TABLE_LIST
+    return _OBJECT
+
+
+def _offsets(lengths: List[int]):
+    result = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=result[1:])
+    return result
+
+
+class _Column:
+    def __init__(self, kind: str, present: np.ndarray, data: dict):
+        self.kind = kind
+        # sample是否有这个key
+        self.present = present
+        self.data = data
+
+
+class SampleTable:
+    def __init__(self, samples: List[dict], strings: List[str] = None, string_and_id: Dict[str, int] = None):
+        """
+        :param strings: 子表和父表共用的字符串表
+        :param string_and_id: 字符串 -> 在strings中的索引，只在生成表时用
+        """
+        self.sample_num = len(samples)
+        self.strings: List[str] = strings if strings is not None else []
+        if string_and_id is None:
+            string_and_id = {}
+
+        def string_id(string: str):
+            if string not in string_and_id:
+                string_and_id[string] = len(self.strings)
+                self.strings.append(string)
+            return string_and_id[string]
+
+        keys = []
+        for sample in samples:
+            for key in sample:
+                if key not in keys:
+                    keys.append(key)
+        self.keys: Tuple[str, ...] = tuple(keys)
+
+        self.columns: Dict[str, _Column] = {}
+        for key in self.keys:
+            present = np.asarray([key in sample for sample in samples], dtype=np.bool_)
+            # 没有这个key的sample用一个占位的值，不会被读取
+            values = [sample[key] for sample in samples if key in sample]
+            kind = _column_kind(values)
+            placeholder = {_STRING: '', _INT: 0, _STRING_LIST: [], _INT_LIST: [], _INT_TO_INT_LIST: {},
+                           _TABLE: {}, _TABLE_LIST: [], _OBJECT: None}[kind]
+            values = [sample.get(key, placeholder) for sample in samples]
+            if kind == _STRING:
+                data = {'ids': np.asarray([string_id(value) for value in values], dtype=np.int32)}
+            elif kind == _INT:
+                data = {'values': np.asarray(values, dtype=np.int64)}
+            elif kind == _STRING_LIST:
+                data = {'ids': np.asarray([string_id(e) for value in values for e in value], dtype=np.int32),
+                        'offsets': _offsets([len(value) for value in values])}
+            elif kind == _INT_LIST:
+                data = {'values': np.asarray([e for value in values for e in value], dtype=np.int64),
+                        'offsets': _offsets([len(value) for value in values])}
+            elif kind == _INT_TO_INT_LIST:
+                # 第一层偏移表: 每个sample的key，第二层偏移表: 每个key的列表
+                data = {'keys': np.asarray([k for value in values for k in value.keys()], dtype=np.int64),
+                        'key_offsets': _offsets([len(value) for value in values]),
+                        'values': np.asarray([e for value in values for v in value.values() for e in v],
+                                             dtype=np.int64),
+                        'value_offsets': _offsets([len(v) for value in values for v in value.values()])}
+            elif kind == _TABLE:
+                data = {'table': SampleTable(values, strings=self.strings, string_and_id=string_and_id)}
+            elif kind == _TABLE_LIST:
+                data = {'table': SampleTable([e for value in values for e in value], strings=self.strings,
+                                             string_and_id=string_and_id),
+                        'offsets': _offsets([len(value) for value in values])}
+            else:
+                data = {'values': values}
+            self.columns[key] = _Column(kind, present, data)
+
+    def has(self, sample_id: int, key: str) -> bool:
+        column = self.columns.get(key)
+        return column is not None and bool(column.present[sample_id])
+
+    def sample_keys(self, sample_id: int) -> List[str]:
+        return [key for key in self.keys if self.columns[key].present[sample_id]]
+
+    def get(self, sample_id: int, key: str):
+        if not self.has(sample_id, key):
+            raise KeyError(key)
+        return self._value(self.columns[key], sample_id)
+
+    def _value(self, column: _Column, sample_id: int):
+        data = column.data
+        kind = column.kind
+        if kind == _STRING:
+            return self.strings[data['ids'][sample_id]]
+        elif kind == _INT:
+            return int(data['values'][sample_id])
+        elif kind == _STRING_LIST:
+            start, end = data['offsets'][sample_id], data['offsets'][sample_id + 1]
+            return [self.strings[e] for e in data['ids'][start: end].tolist()]
+        elif kind == _INT_LIST:
+            start, end = data['offsets'][sample_id], data['offsets'][sample_id + 1]
+            return data['values'][start: end].tolist()
+        elif kind == _INT_TO_INT_LIST:
+            key_start, key_end = data['key_offsets'][sample_id], data['key_offsets'][sample_id + 1]
+            value_offsets = data['value_offsets'][key_start: key_end + 1].tolist()
+            values = data['values']
+            return {k: values[value_offsets[i]: value_offsets[i + 1]].tolist()
+                    for i, k in enumerate(data['keys'][key_start: key_end].tolist())}
+        elif kind == _TABLE:
+            return data['table'].get_sample(sample_id)
+        elif kind == _TABLE_LIST:
+            start, end = data['offsets'][sample_id], data['offsets'][sample_id + 1]
+            return [data['table'].get_sample(i) for i in range(start, end)]
+        else:
+            return data['values'][sample_id]
+
+    def get_sample(self, sample_id: int) -> dict:
+        return {key: self._value(column, sample_id) for key, column in self.columns.items()
+                if column.present[sample_id]}
+
+
+class SampleRef(collections.abc.Mapping):
+    """
+    表里的一个sample，和sample的dict一样读取
+    """
+
+    __slots__ = ('table', 'sample_id', '_values')
+
+    def __init__(self, table: SampleTable, sample_id: int):
+        self.table = table
+        self.sample_id = sample_id
+        # key -> 解码后的值，每个key只解码一次
+        self._values = {}
+
+    def __getitem__(self, key: str):
+        values = self._values
+        if key not in values:
+            values[key] = self.table.get(self.sample_id, key)
+        return values[key]
+
+    def __contains__(self, key) -> bool:
+        return self.table.has(self.sample_id, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.table.sample_keys(self.sample_id))
+
+    def __len__(self) -> int:
+        return len(self.table.sample_keys(self.sample_id))
+
+    def _to_dict(self) -> dict:
+        # 不把没有读取过的key放进_values
+        values = self._values
+        return {key: values[key] if key in values else self.table.get(self.sample_id, key) for key in self}
+
+    def __repr__(self):
+        return 'SampleRef(%d, %s)' % (self.sample_id, repr(self._to_dict()))
+
+    def __reduce__(self):
+        return dict, (self._to_dict(),)
+
+
+def compact_samples(values: List[Any]) -> List[Any]:
+    """
+    把values里的sample dict放到一个SampleTable里，其它值(例如None、已经是SampleRef的sample)不变
+    :return: 新的列表
+    """
+    indices = [i for i, value in enumerate(values) if type(value) is dict]
+    if len(indices) == 0:
+        return list(values)
+    table = SampleTable([values[i] for i in indices])
+    result = list(values)
+    for sample_id, i in enumerate(indices):
+        result[i] = SampleRef(table, sample_id)
+    return result
+
+
+def compact_instances(instances: List[Instance], field_name: str = 'sample') -> List[Instance]:
+    """
+    把instances的field_name(MetadataField)里的sample dict放到一个SampleTable里，instance改为引用表里的sample。
+    已经是SampleRef的instance不变
+    :return: instances
+    """
+    indices = [i for i, instance in enumerate(instances) if field_name in instance.fields]
+    samples = compact_samples([instances[i].fields[field_name].metadata for i in indices])
+    for i, sample in zip(indices, samples):
+        if sample is not instances[i].fields[field_name].metadata:
+            instances[i].fields[field_name] = MetadataField(sample)
+    return instances
+
+
+class PackedSamples:
+    """
+    instance缓存里一个MetadataField的所有值: 引用同一个表的SampleRef只保存表和id
+    """
+
+    def __init__(self, table: SampleTable, sample_ids: np.ndarray, present: np.ndarray):
+        self.table = table
+        self.sample_ids = sample_ids
+        self.present = present
+
+
+def pack(values: List[Any]):
+    """
+    :param values: 一个MetadataField在每个instance里的值，没有这个field时为None
+    :return: 都是同一个表的SampleRef时返回PackedSamples，否则返回values
+    """
+    refs = [value for value in values if value is not None]
+    if len(refs) == 0 or not all(isinstance(value, SampleRef) and value.table is refs[0].table for value in refs):
+        return values
+    present = np.asarray([value is not None for value in values], dtype=np.bool_)
+    sample_ids = np.asarray([value.sample_id if value is not None else -1 for value in values], dtype=np.int64)
+    return PackedSamples(refs[0].table, sample_ids, present)
+
+
+def unpack(packed) -> List[Any]:
+    """
+    :param packed: pack的结果或者旧缓存里的list
+    """
+    if not isinstance(packed, PackedSamples):
+        return packed
+    return [SampleRef(packed.table, sample_id) if present else None
+            for sample_id, present in zip(packed.sample_ids.tolist(), packed.present.tolist())]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+TOWE中每个(句子, aspect term)是一个instance，一个句子有k个aspect term时，和aspect term无关的计算(词向量、
+IOG的rnn_global)在一个batch里会重复k次。这里按token id把batch里的instance分组，同一个句子只算一次，
+再按组的索引复制回每个instance。
+
+分组直接用batch里的token id计算，不需要dataset reader和instance缓存提供额外的field: token id完全一样的
+两行，和aspect term无关的计算结果也完全一样。
+"""
+
+
+from typing import *
+
+import torch
+
+
+def sentence_groups(token_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    :param token_ids: (batch_size, sequence_length)
+    :return: 每组的一个instance的索引(group_num,)，每个instance所属的组(batch_size,)
+    """
+    _, group_index = torch.unique(token_ids, sorted=True, return_inverse=True, dim=0)
+    group_num = int(group_index.max()) + 1
+    batch_index = torch.arange(token_ids.size(0), device=token_ids.device)
+    # 同一组的instance完全一样，取哪一个都可以
+    representative = group_index.new_zeros(group_num).scatter_(0, group_index, batch_index)
+    return representative, group_index
+
+
+def run_once_per_sentence(function: Callable[..., torch.Tensor], token_ids: torch.Tensor,
+                          *inputs: torch.Tensor, groups: Tuple[torch.Tensor, torch.Tensor] = None) -> torch.Tensor:
+    """
+    :param function: 输入和输出的第一维都是batch
+    :param token_ids: 用于分组，(batch_size, sequence_length)
+    :param inputs: function的输入，只和句子有关
+    :param groups: sentence_groups(token_ids)的结果，已经算过时传入
+    :return: 和function(*inputs)一样
+    """
+    if token_ids.size(0) <= 1:
+        return function(*inputs)
+    representative, group_index = groups if groups is not None else sentence_groups(token_ids)
+    if representative.size(0) == token_ids.size(0):
+        return function(*inputs)
+    output = function(*[e.index_select(0, representative) for e in inputs])
+    return output.index_select(0, group_index)
+
+
+def embed_once_per_sentence(word_embedder, tokens: Dict[str, torch.Tensor],
+                            groups: Tuple[torch.Tensor, torch.Tensor] = None) -> torch.Tensor:
+    """
+    :param word_embedder: TextFieldEmbedder
+    :param tokens: TextField的tensor，tokens['tokens']用于分组
+    :return: 和word_embedder(tokens)一样
+    """
+    if 'tokens' not in tokens:
+        return word_embedder(tokens)
+    keys = sorted(tokens.keys())
+    return run_once_per_sentence(lambda *tensors: word_embedder(dict(zip(keys, tensors))), tokens['tokens'],
+                                 *[tokens[key] for key in keys], groups=groups)
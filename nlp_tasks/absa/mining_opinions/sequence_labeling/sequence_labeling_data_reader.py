@@ -13,13 +13,12 @@ from allennlp.data import Instance
 from allennlp.data.token_indexers import TokenIndexer
 from allennlp.data.tokenizers import Token
 from allennlp.data.dataset_readers import DatasetReader
-import spacy
-from nltk.corpus import stopwords
-english_stop_words = stopwords.words('english')
-english_stop_words.extend([',', '.', '?', ';', '-', ':', '\'', '"', '(', ')', '!'])
 
 from nlp_tasks.utils import my_corenlp
+from nlp_tasks.utils import nlp_resources
 from nlp_tasks.utils.sentence_segmenter import BaseSentenceSegmenter, NltkSentenceSegmenter
+from nlp_tasks.absa.mining_opinions.sequence_labeling import word_piece_pooling
+from nlp_tasks.absa.mining_opinions.sequence_labeling import aspect_term_pooling
 
 
 class DatasetReaderForTCBiLSTM(DatasetReader):
@@ -27,15 +26,15 @@ class DatasetReaderForTCBiLSTM(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -84,15 +83,15 @@ class DatasetReaderForTermBiLSTM(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -166,15 +165,15 @@ class DatasetReaderForTermBiLSTMForMFGData(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -251,15 +250,15 @@ class DatasetReaderForAsoTermBiLSTM(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -347,7 +346,7 @@ class DatasetReaderForAsoTermBert(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -355,10 +354,10 @@ class DatasetReaderForAsoTermBert(DatasetReader):
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
@@ -386,6 +385,8 @@ class DatasetReaderForAsoTermBert(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -475,7 +476,7 @@ class DatasetReaderForAsoBertPair(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -483,10 +484,10 @@ class DatasetReaderForAsoBertPair(DatasetReader):
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
@@ -518,6 +519,8 @@ class DatasetReaderForAsoBertPair(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -604,7 +607,7 @@ class DatasetReaderForAsoBertPairWithPosition(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -612,10 +615,10 @@ class DatasetReaderForAsoBertPairWithPosition(DatasetReader):
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
@@ -653,6 +656,8 @@ class DatasetReaderForAsoBertPairWithPosition(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         bert_position_field = ArrayField(np.array(bert_position), padding_value=len(bert_words))
         fields['bert_position'] = bert_position_field
@@ -742,15 +747,15 @@ class DatasetReaderForMilAsoTermBiLSTM(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -818,6 +823,7 @@ class DatasetReaderForMilAsoTermBiLSTM(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [real_target_start_index + 1, real_target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             # polarity_index = self.polarities.index(sample['polarity'])
             # polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -849,7 +855,7 @@ class DatasetReaderForMilAsoTermBert(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -857,10 +863,10 @@ class DatasetReaderForMilAsoTermBert(DatasetReader):
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
@@ -880,6 +886,8 @@ class DatasetReaderForMilAsoTermBert(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -949,6 +957,7 @@ class DatasetReaderForMilAsoTermBert(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [real_target_start_index + 1, real_target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             # polarity_index = self.polarities.index(sample['polarity'])
             # polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -980,15 +989,15 @@ class DatasetReaderForAsteTermBiLSTM(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -1046,6 +1055,7 @@ class DatasetReaderForAsteTermBiLSTM(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [real_target_start_index + 1, real_target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             polarity_index = self.polarities.index(sample['polarity'])
             polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -1067,15 +1077,15 @@ class DatasetReaderForAsteTermBiLSTMWithoutSpecialToken(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -1124,6 +1134,7 @@ class DatasetReaderForAsteTermBiLSTMWithoutSpecialToken(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [target_start_index, target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             polarity_index = self.polarities.index(sample['polarity'])
             polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -1145,7 +1156,7 @@ class DatasetReaderForTermBert(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1155,10 +1166,10 @@ class DatasetReaderForTermBert(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -1226,6 +1237,8 @@ class DatasetReaderForTermBert(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1253,7 +1266,7 @@ class DatasetReaderForAsteTermBert(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1263,10 +1276,10 @@ class DatasetReaderForAsteTermBert(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -1330,6 +1343,8 @@ class DatasetReaderForAsteTermBert(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1341,6 +1356,7 @@ class DatasetReaderForAsteTermBert(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [real_target_start_index + 1, real_target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             polarity_index = self.polarities.index(sample['polarity'])
             polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -1362,7 +1378,7 @@ class DatasetReaderForAsteTermBertWithoutSpecialToken(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1372,10 +1388,10 @@ class DatasetReaderForAsteTermBertWithoutSpecialToken(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -1430,6 +1446,8 @@ class DatasetReaderForAsteTermBertWithoutSpecialToken(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1439,6 +1457,7 @@ class DatasetReaderForAsteTermBertWithoutSpecialToken(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [target_start_index, target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             polarity_index = self.polarities.index(sample['polarity'])
             polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -1460,7 +1479,7 @@ class DatasetReaderForTermBertWithSecondSentence(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1470,10 +1489,10 @@ class DatasetReaderForTermBertWithSecondSentence(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -1533,6 +1552,8 @@ class DatasetReaderForTermBertWithSecondSentence(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1568,7 +1589,7 @@ class DatasetReaderForTermBertWithSecondSentenceWithPosition(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1578,10 +1599,10 @@ class DatasetReaderForTermBertWithSecondSentenceWithPosition(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     def convert_to_relative_position(self, positions: List[int], aspect_positions: List[int]):
         """
@@ -1669,6 +1690,8 @@ class DatasetReaderForTermBertWithSecondSentenceWithPosition(DatasetReader):
         sample['bert_words'] = bert_words
         sample['bert_position'] = bert_position
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1694,7 +1717,7 @@ class DatasetReaderForTermBiLSTMWithSecondSentence(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1704,10 +1727,10 @@ class DatasetReaderForTermBiLSTMWithSecondSentence(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -1778,6 +1801,8 @@ class DatasetReaderForTermBiLSTMWithSecondSentence(DatasetReader):
         sample['bert_words'] = bert_words
         sample['bert_position'] = bert_position
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1803,7 +1828,7 @@ class DatasetReaderForAsteTermBertWithSecondSentence(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -1813,10 +1838,10 @@ class DatasetReaderForAsteTermBertWithSecondSentence(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.polarities: List[str] = self.configuration['polarities'].split(',')
 
     @overrides
@@ -1867,6 +1892,8 @@ class DatasetReaderForAsteTermBertWithSecondSentence(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
@@ -1876,6 +1903,7 @@ class DatasetReaderForAsteTermBertWithSecondSentence(DatasetReader):
             )
 
         sample['word_indices_of_aspect_terms'] = [target_start_index, target_end_index]
+        fields.update(aspect_term_pooling.aspect_term_span_fields(sample['word_indices_of_aspect_terms']))
         if 'polarity' in sample:
             polarity_index = self.polarities.index(sample['polarity'])
             polarity_label_field = LabelField(polarity_index, skip_indexing=True,
@@ -1897,15 +1925,15 @@ class DatasetReaderForNerLstm(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, samples: List) -> Instance:
@@ -1975,15 +2003,15 @@ class DatasetReaderForNerLstmOfRealASO(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -2042,15 +2070,15 @@ class DatasetReaderForNerLstmForOTEOfRealASO(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -2109,7 +2137,7 @@ class DatasetReaderForNerBertForOTEOfRealASO(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -2117,10 +2145,10 @@ class DatasetReaderForNerBertForOTEOfRealASO(DatasetReader):
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
 
@@ -2139,6 +2167,8 @@ class DatasetReaderForNerBertForOTEOfRealASO(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -2199,7 +2229,7 @@ class DatasetReaderForNerBert(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter(),
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None,
                  bert_tokenizer=None,
                  bert_token_indexers=None
                  ) -> None:
@@ -2209,10 +2239,10 @@ class DatasetReaderForNerBert(DatasetReader):
         self.bert_tokenizer = bert_tokenizer
         self.bert_token_indexers = bert_token_indexers or {"bert": SingleIdTokenIndexer(namespace="bert")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, samples: List) -> Instance:
@@ -2241,6 +2271,8 @@ class DatasetReaderForNerBert(DatasetReader):
         fields['bert'] = bert_text_field
         sample['bert_words'] = bert_words
         sample['word_index_and_bert_indices'] = word_index_and_bert_indices
+        fields.update(word_piece_pooling.word_piece_pooling_fields(word_index_and_bert_indices, len(bert_words),
+                                                                   self.configuration['max_len']))
 
         position = []
         for i in range(len(words)):
@@ -2303,32 +2335,15 @@ class DatasetReaderForIOG(DatasetReader):
                  token_indexers: Dict[str, TokenIndexer] = None,
                  position_indexers: Dict[str, TokenIndexer] = None,
                  core_nlp: my_corenlp.StanfordCoreNLP=None,
-                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=NltkSentenceSegmenter()) -> None:
+                 configuration=None, sentence_segmenter: BaseSentenceSegmenter=None) -> None:
         super().__init__(lazy=False)
         self.tokenizer = tokenizer
         self.token_indexers = token_indexers or {"tokens": SingleIdTokenIndexer(namespace="tokens")}
         self.position_indexers = position_indexers or {"position": SingleIdTokenIndexer(namespace='position')}
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm")
         self.core_nlp = core_nlp
         self.configuration = configuration
-        self.sentence_segmenter = sentence_segmenter
-
-    def _replace_words_with_padding_word(self, words_original: List[str], start_end_boundaries: List[List[int]],
-                                         padding_word: str='@@PADDING@@'):
-        """
-
-        :param words_original:
-        :param start_end_boundaries: the element in start_end_boundaries contains two elements, each is a index
-        :param padding_word:
-        :return:
-        """
-        # words = copy.deepcopy(words_original)
-        words = [word.lower() for word in words_original]
-        for start, end in start_end_boundaries:
-            for i in range(start, end):
-                words[i] = padding_word
-        tokens = [Token(word) for word in words]
-        return tokens
+        self.sentence_segmenter = sentence_segmenter or NltkSentenceSegmenter()
 
     @overrides
     def text_to_instance(self, sample: Dict) -> Instance:
@@ -2353,20 +2368,8 @@ class DatasetReaderForIOG(DatasetReader):
         tokens = [Token(word.lower()) for word in words]
         fields['tokens'] = TextField(tokens, self.token_indexers)
 
-        left_tokens = self._replace_words_with_padding_word(words, [[target_end_index, len(words)]])
-        fields['left_tokens'] = TextField(left_tokens, self.token_indexers)
-
-        right_tokens = self._replace_words_with_padding_word(words, [[0, target_start_index]])
-        fields['right_tokens'] = TextField(right_tokens, self.token_indexers)
-
-        target_tokens = self._replace_words_with_padding_word(words,
-                                                              [[0, target_start_index],
-                                                               [target_end_index, len(words)]])
-        fields['target_tokens'] = TextField(target_tokens, self.token_indexers)
-
-        position = [Token(str(i)) for i in range(len(words))]
-        position_field = TextField(position, self.position_indexers)
-        fields['position'] = position_field
+        # left、right和target的mask在模型里根据aspect term的边界生成
+        fields['target_span'] = ArrayField(np.array([target_start_index, target_end_index]), dtype=np.int64)
 
         if 'opinion_words_tags' in sample:
             tags: List = sample['opinion_words_tags']
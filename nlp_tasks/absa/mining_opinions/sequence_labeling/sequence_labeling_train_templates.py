@@ -5,11 +5,10 @@ import sys
 import pickle
 from typing import List
 import json
+import time
 
 import torch
 from allennlp.data.token_indexers import WordpieceIndexer
-from allennlp.data.iterators import BucketIterator
-from allennlp.data.iterators import BasicIterator
 from allennlp.modules.text_field_embedders import TextFieldEmbedder
 import torch.optim as optim
 # from allennlp.training.trainer import Trainer
@@ -18,13 +17,21 @@ from allennlp.data.vocabulary import Vocabulary
 from allennlp.data.token_indexers import SingleIdTokenIndexer
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from allennlp.data.dataset_readers import DatasetReader
+from allennlp.data.instance import Instance
 from allennlp.modules.token_embedders.bert_token_embedder import BertModel, PretrainedBertModel
 from allennlp.modules.token_embedders.bert_token_embedder import BertEmbedder, PretrainedBertEmbedder
+from allennlp.nn import util as allennlp_util
 
 from nlp_tasks.absa.mining_opinions.sequence_labeling import sequence_labeling_data_reader
+from nlp_tasks.absa.mining_opinions.sequence_labeling import bert_feature_cache
+from nlp_tasks.absa.mining_opinions.sequence_labeling import instance_cache
+from nlp_tasks.absa.mining_opinions.sequence_labeling import instance_store
+from nlp_tasks.absa.mining_opinions.sequence_labeling import my_allennlp_iterator
 from nlp_tasks.absa.mining_opinions.sequence_labeling import pytorch_models
+from nlp_tasks.absa.mining_opinions.sequence_labeling import quantization
+from nlp_tasks.absa.mining_opinions.sequence_labeling import sample_table
+from nlp_tasks.absa.mining_opinions.sequence_labeling import slim_checkpoint
 from allennlp.modules.token_embedders import Embedding
-from allennlp.modules.token_embedders import embedding
 from allennlp.modules.text_field_embedders import BasicTextFieldEmbedder
 from nlp_tasks.absa.aspect_category_detection_and_sentiment_classification import allennlp_callback
 from nlp_tasks.common import common_path
@@ -32,6 +39,7 @@ from nlp_tasks.utils import file_utils
 from nlp_tasks.absa.mining_opinions.data_adapter import data_object
 from nlp_tasks.utils import word_processor
 from nlp_tasks.utils import tokenizers
+from nlp_tasks.utils import embedding_store
 # from nlp_tasks.utils import tokenizer_wrappers
 
 task_dir = common_path.get_task_data_dir('absa')
@@ -97,22 +105,15 @@ class ModelTrainTemplate:
         file.setFormatter(formatter)
         self.logger.addHandler(file)
 
-        self.dataset = self._get_dataset()
+        self.dataset = None
+        if self.configuration.get('load_data', True):
+            self.dataset = self._get_dataset()
 
     def _get_dataset(self):
         return data_object.get_dataset_class_by_name(self.configuration['current_dataset'])(self.configuration)
 
     def _load_word_vec(self, path, word2idx=None):
-        fin = open(path, 'r', encoding='utf-8', newline='\n', errors='ignore')
-        word_vec = {}
-        for line in fin:
-            tokens = line.rstrip().split()
-            if word2idx is None or tokens[0] in word2idx.keys():
-                try:
-                    word_vec[tokens[0]] = np.asarray(tokens[1:], dtype='float32')
-                except:
-                    continue
-        return word_vec
+        return embedding_store.load_word_vec(path, words=None if word2idx is None else word2idx.keys())
 
     def _build_embedding_matrix(self, embedding_filepath, word2idx, embed_dim):
         if os.path.exists(self.embedding_matrix_file_path):
@@ -219,14 +220,21 @@ class SequenceLabeling(ModelTrainTemplate):
         self.train_data = None
         self.dev_data = None
         self.test_data = None
-        self._load_data()
-        if self.configuration['debug']:
-            self.train_data = self.train_data[: 128]
-            self.dev_data = self.dev_data[: 128]
-            self.test_data = self.test_data[: 128]
+        # load_data为False时只用于预测(例如towe_server.py)，不读取数据集
+        load_data = self.configuration.get('load_data', True)
+        if load_data:
+            self._load_data()
+            if self.configuration['debug']:
+                self.train_data = self.train_data[: 128]
+                self.dev_data = self.dev_data[: 128]
+                self.test_data = self.test_data[: 128]
+        else:
+            self.data_reader = self._get_data_reader()
 
         self.vocab = None
         self._build_vocab()
+        if load_data and not self.configuration['debug']:
+            self._save_instance_cache()
 
         self.iterator = None
         self.val_iterator = None
@@ -239,38 +247,157 @@ class SequenceLabeling(ModelTrainTemplate):
         reader = self._get_data_reader()
         self.data_reader = reader
 
-        data_filepath = self.base_data_dir + 'data'
-        if os.path.exists(data_filepath):
+        if self._load_instance_store():
+            return
+        if self._load_instance_cache():
+            self._save_instance_store()
+            return
+        # 旧版本的pickle缓存
+        data_filepath = self._get_legacy_data_filepath()
+        if data_filepath is not None and os.path.exists(data_filepath):
             self.train_data, self.dev_data, self.test_data, = super()._load_object(data_filepath)
+            for instances in [self.train_data, self.dev_data, self.test_data]:
+                self._compact_sample_metadata(instances)
+            self._save_instance_store()
         else:
-            train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-            train_dev_test_data_new = {}
-            for data_type, data in train_dev_test_data.items():
-                data_new = []
-                for sample in data:
-                    sample_new = {
-                        'words': sample.words,
-                        'target_tags': sample.target_tags,
-                        'opinion_words_tags': sample.opinion_words_tags,
-                        'polarity': sample.polarity,
-                        'metadata': sample.metadata,
-                        'data_type': data_type
-                    }
-                    data_new.append(sample_new)
-                train_dev_test_data_new[data_type] = data_new
-
-            self.train_data = reader.read(train_dev_test_data_new['train'])
-            self.dev_data = reader.read(train_dev_test_data_new['dev'])
-            self.test_data = reader.read(train_dev_test_data_new['test'])
-            data = [self.train_data, self.dev_data, self.test_data]
-            super()._save_object(data_filepath, data)
+            self.train_data = self._read_split('train')
+            self.dev_data = self._read_split('dev')
+            self.test_data = self._read_split('test')
 
-    def _build_vocab(self):
+    def _to_reader_samples(self, data: list, data_type: str):
+        """
+        :param data: 数据集里data_type的样本
+        :return: reader.read的输入
+        """
+        data_new = []
+        for sample in data:
+            sample_new = {
+                'words': sample.words,
+                'target_tags': sample.target_tags,
+                'opinion_words_tags': sample.opinion_words_tags,
+                'polarity': sample.polarity,
+                'metadata': sample.metadata,
+                'data_type': data_type
+            }
+            data_new.append(sample_new)
+        return data_new
+
+    def _get_instance_store_key(self, data_type: str, dataset_name: str = None):
+        if dataset_name is None:
+            dataset_name = self.configuration['current_dataset']
+        return instance_store.make_key(self.base_data_dir, dataset_name, data_type, self.data_reader,
+                                       self.configuration)
+
+    def _read_split(self, data_type: str, dataset_name: str = None) -> List[Instance]:
+        """
+        读取数据集的一个split，这个进程里已经读取过的话直接用instance_store里的instance
+        :param dataset_name: 为None时是当前数据集(current_dataset)，否则例如other_domain_dataset
+        """
+        def read():
+            if dataset_name is None:
+                dataset = self.dataset
+            else:
+                dataset = data_object.get_dataset_class_by_name(dataset_name)(self.configuration)
+            data = dataset.get_data_type_and_data_dict()[data_type]
+            return self._compact_sample_metadata(self.data_reader.read(self._to_reader_samples(data, data_type)))
+
+        return instance_store.get_or_read(self._get_instance_store_key(data_type, dataset_name=dataset_name), read)
+
+    def _load_instance_store(self):
+        """
+        这个进程里已经读取过train、dev和test时直接用instance_store里的instance
+        :return: 是否都在instance_store里
+        """
+        split_and_instances = {}
+        for data_type in ['train', 'dev', 'test']:
+            instances = instance_store.get(self._get_instance_store_key(data_type))
+            if instances is None:
+                return False
+            split_and_instances[data_type] = instances
+        self.train_data = split_and_instances['train']
+        self.dev_data = split_and_instances['dev']
+        self.test_data = split_and_instances['test']
+        return True
+
+    def _save_instance_store(self):
+        split_and_instances = {
+            'train': self.train_data,
+            'dev': self.dev_data,
+            'test': self.test_data
+        }
+        for data_type, instances in split_and_instances.items():
+            instance_store.put(self._get_instance_store_key(data_type), instances)
+
+    def _compact_sample_metadata(self, instances: List[Instance]) -> List[Instance]:
+        """
+        compact_sample_metadata为True时instance的sample放到列式的sample_table里，instance只引用sample的id
+        """
+        if self.configuration.get('compact_sample_metadata', False):
+            sample_table.compact_instances(instances)
+        return instances
+
+    def _get_instance_cache_fingerprint(self):
+        """
+        :return: 数据集、reader和影响数据的参数(例如max_len、entire_space、bert_vocab_file_path)的md5，参数变化后用新的缓存
+        """
+        return instance_store.configuration_fingerprint(self.configuration['current_dataset'], self.data_reader,
+                                                        self.configuration)
+
+    def _get_instance_cache_dir(self):
+        return self.base_data_dir + 'data_columnar_%s/' % self._get_instance_cache_fingerprint()
+
+    def _get_legacy_data_filepath(self):
+        return self.base_data_dir + 'data'
+
+    def _load_saved_vocab(self):
+        """
+        :return: 已经保存的vocab，没有的话返回None
+        """
         if self.configuration['train']:
             vocab_file_path = self.base_data_dir + 'vocab'
             if os.path.exists(vocab_file_path):
-                self.vocab = super()._load_object(vocab_file_path)
+                return super()._load_object(vocab_file_path)
+            else:
+                return None
+        else:
+            return self.model_meta_data['vocab']
+
+    def _load_instance_cache(self):
+        """
+        从列式缓存读取train、dev和test数据
+        :return: 缓存是否存在
+        """
+        instance_cache_dir = self._get_instance_cache_dir()
+        if not instance_cache.cache_exists(instance_cache_dir):
+            return False
+        split_and_instances = instance_cache.load_instances(
+            instance_cache_dir, vocab=self._load_saved_vocab(),
+            compact_sample_metadata=self.configuration.get('compact_sample_metadata', False))
+        self.train_data = split_and_instances['train']
+        self.dev_data = split_and_instances['dev']
+        self.test_data = split_and_instances['test']
+        return True
+
+    def _save_instance_cache(self):
+        """
+        用vocab索引所有数据后保存列式缓存，下次读取时不需要再索引
+        """
+        instance_cache_dir = self._get_instance_cache_dir()
+        if instance_cache.cache_exists(instance_cache_dir):
+            return
+        split_and_instances = {
+            'train': self.train_data,
+            'dev': self.dev_data,
+            'test': self.test_data
+        }
+        instance_cache.save_instances(split_and_instances, instance_cache_dir, vocab=self.vocab)
+
+    def _build_vocab(self):
+        if self.configuration['train']:
+            vocab_file_path = self.base_data_dir + 'vocab'
+            saved_vocab = self._load_saved_vocab()
+            if saved_vocab is not None:
+                self.vocab = saved_vocab
             else:
                 data = self.train_data + self.dev_data + self.test_data
                 self.vocab = Vocabulary.from_instances(data, max_vocab_size=sys.maxsize)
@@ -280,11 +407,19 @@ class SequenceLabeling(ModelTrainTemplate):
             self.vocab = self.model_meta_data['vocab']
 
     def _build_iterator(self):
-        self.iterator = BucketIterator(batch_size=self.configuration['batch_size'],
-                                       sorting_keys=[("tokens", "num_tokens")],
-                                       )
+        # batch里的句子从长到短排列，LSTM pack的时候不需要重新排序
+        self.iterator = my_allennlp_iterator.DescendingBucketIterator(batch_size=self.configuration['batch_size'],
+                                                                      sorting_keys=[("tokens", "num_tokens")])
         self.iterator.index_with(self.vocab)
-        self.val_iterator = BasicIterator(batch_size=self.configuration['batch_size'])
+        # 评估和预测时按长度排序分batch，batch大小和训练的batch_size分开设置
+        eval_batch_size = self.configuration.get('eval_batch_size', 0)
+        if eval_batch_size <= 0:
+            eval_batch_size = self.configuration['batch_size']
+        self.val_iterator = my_allennlp_iterator.LengthSortedIterator(
+            sorting_keys=[("tokens", "num_tokens")],
+            batch_size=eval_batch_size,
+            max_tokens=self.configuration.get('eval_max_tokens', 0)
+        )
         self.val_iterator.index_with(self.vocab)
 
     def _print_args(self, model):
@@ -303,6 +438,14 @@ class SequenceLabeling(ModelTrainTemplate):
     def _find_model_function_pure(self):
         raise NotImplementedError()
 
+    def _read_embedding_matrix(self, embedding_dim: int):
+        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
+        if os.path.exists(embedding_matrix_filepath):
+            # 旧版本按data_type保存的embedding matrix
+            return super()._load_object(embedding_matrix_filepath)
+        return embedding_store.read_embeddings(self.configuration['embedding_filepath'], embedding_dim, self.vocab,
+                                               namespace='tokens')
+
     def _get_position_embeddings_dim(self):
         return 300
 
@@ -311,14 +454,7 @@ class SequenceLabeling(ModelTrainTemplate):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         embedding_matrix = embedding_matrix.to(self.configuration['device'])
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
@@ -364,8 +500,18 @@ class SequenceLabeling(ModelTrainTemplate):
             'dev': self.dev_data,
             'test': self.test_data
         }
+        if 'estimate_data_types' in self.configuration:
+            estimate_data_types = self.configuration['estimate_data_types'].split(',')
+            data_type_and_data = {data_type: data for data_type, data in data_type_and_data.items()
+                                  if data_type in estimate_data_types}
         estimator = self._get_estimator(model)
-        estimate_callback = allennlp_callback.EstimateCallback(data_type_and_data, estimator, self.logger)
+        estimate_callback = allennlp_callback.EstimateCallback(
+            data_type_and_data, estimator, self.logger,
+            interval=self.configuration.get('estimate_interval', 1),
+            train_sample_size=self.configuration.get('estimate_train_sample_size', 0),
+            test_only_on_best=self.configuration.get('estimate_test_only_on_best', False),
+            seed=self.configuration.get('seed', 776)
+        )
         result.append(estimate_callback)
         return result
 
@@ -385,6 +531,33 @@ class SequenceLabeling(ModelTrainTemplate):
     def _get_bert_word_embedder(self):
         return None
 
+    def _get_bert_feature_cache_dir(self):
+        # 不同数据集、不同模型只要bert一样就共享缓存
+        bert_file_md5 = bert_feature_cache.bert_file_fingerprint(self.configuration['bert_file_path'])
+        return task_dir + 'bert_features/%s-%s/' % (bert_file_md5, self.configuration['bert_feature_dtype'])
+
+    def _cache_bert_features(self, bert_embedder: BertEmbedder):
+        """
+        fixed_bert并且bert_feature_cache为True时，bert的输出保存在磁盘上，每个word piece序列只计算一次
+        """
+        if not self.configuration['fixed_bert'] or not self.configuration.get('bert_feature_cache', False):
+            return bert_embedder
+        store = bert_feature_cache.BertFeatureStore(self._get_bert_feature_cache_dir(),
+                                                    bert_embedder.get_output_dim(),
+                                                    dtype=self.configuration['bert_feature_dtype'])
+        return bert_feature_cache.CachedBertEmbedder(bert_embedder, store)
+
+    def _precompute_bert_features(self, model):
+        if len(bert_feature_cache.cached_bert_embedders(model)) == 0:
+            return
+        self.logger.info('precomputing bert features')
+        USE_GPU = torch.cuda.is_available()
+        gpu_id = int(self.configuration['gpu_id']) if USE_GPU else -1
+        data = self.train_data + self.dev_data + self.test_data
+        batches = (allennlp_util.move_to_device(batch, gpu_id)
+                   for batch in self.val_iterator(data, num_epochs=1, shuffle=False))
+        bert_feature_cache.precompute(model, batches)
+
     def _inner_train(self):
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
@@ -393,6 +566,7 @@ class SequenceLabeling(ModelTrainTemplate):
             gpu_id = -1
 
         self.model = self._find_model_function()
+        self._precompute_bert_features(self.model)
         estimator = self._get_estimator(self.model)
         callbacks = self._get_estimate_callback(self.model)
         validation_metric = '+f1'
@@ -413,24 +587,137 @@ class SequenceLabeling(ModelTrainTemplate):
             serialization_dir=self.model_dir,
             patience=self.configuration['patience'],
             callbacks=callbacks,
-            num_serialized_models_to_keep=0,
+            **self._get_checkpointer_args(self.model, self.model_dir),
             early_stopping_by_batch=self.configuration['early_stopping_by_batch'],
             estimator=estimator,
-            grad_clipping=5
+            grad_clipping=5,
+            prefetch_batches=self.configuration.get('prefetch_batches', 0),
+            profile_epoch=self.configuration.get('profile_epoch', -1),
+            profile_batches=self._get_profile_batches(),
+            training_metrics_interval=self.configuration.get('training_metrics_interval', 1)
         )
         metrics = trainer.train()
         self.logger.info('metrics: %s' % str(metrics))
 
+    def _get_frozen_tensor_store(self):
+        store_dir = self.configuration.get('frozen_tensor_store_dir', '')
+        if not store_dir:
+            # 不同数据集、不同模型共享
+            store_dir = task_dir + 'frozen_tensors/'
+        return slim_checkpoint.FrozenTensorStore(store_dir)
+
+    def _get_checkpointer_args(self, model, serialization_dir):
+        """
+        :return: Trainer中和checkpoint有关的参数，slim_checkpoint为True时不需要梯度的参数只保存一次，在后台线程里写checkpoint
+        """
+        if not self.configuration.get('slim_checkpoint', False):
+            return {'num_serialized_models_to_keep': 0}
+        checkpointer = slim_checkpoint.SlimCheckpointer(model, self._get_frozen_tensor_store(),
+                                                        serialization_dir=serialization_dir,
+                                                        num_serialized_models_to_keep=0)
+        return {'checkpointer': checkpointer}
+
+    def _get_profile_batches(self):
+        """
+        :return: profile_batches(例如0:10)表示的第一个batch和最后一个batch之后的batch的索引
+        """
+        start, end = self.configuration.get('profile_batches', '0:10').split(':')
+        return int(start), int(end)
+
     def _save_model(self):
-        torch.save(self.model, self.best_model_filepath)
+        if self.configuration.get('slim_checkpoint', False):
+            slim_checkpoint.save_model(self.model, self.best_model_filepath, self._get_frozen_tensor_store())
+        else:
+            torch.save(self.model, self.best_model_filepath)
 
     def _load_model(self):
+        # 同时支持slim_checkpoint.save_model和torch.save保存的模型
         if torch.cuda.is_available():
-            self.model = torch.load(self.best_model_filepath)
+            self.model = slim_checkpoint.load_model(self.best_model_filepath)
         else:
-            self.model = torch.load(self.best_model_filepath, map_location=torch.device('cpu'))
+            self.model = slim_checkpoint.load_model(self.best_model_filepath, map_location=torch.device('cpu'))
         self.model.configuration = self.configuration
 
+    def _get_quantized_model_filepath(self):
+        return self.model_dir + self.configuration['model_name'] + '.quantized.hdf5'
+
+    def _get_quantization_result_filepath(self):
+        return self.model_dir + self.configuration['model_name'] + '.quantization.json'
+
+    def _estimate_dev(self, model):
+        """
+        :return: model在dev上的评估结果，评估用的秒数
+        """
+        # _get_estimator用的是self.model
+        original_model = self.model
+        self.model = model
+        try:
+            start = time.time()
+            result = self._get_estimator(model).estimate(self.dev_data)
+            return result, time.time() - start
+        finally:
+            self.model = original_model
+
+    def _use_cpu(self):
+        # 量化后的模型只能在CPU上运行，estimator和predictor根据gpu_id移动batch
+        self.configuration['gpu_id'] = -1
+        self.configuration['device'] = torch.device('cpu')
+
+    def quantize(self):
+        """
+        动态int8量化。量化后的模型在dev上的span f1比原来的模型下降不超过quantize_max_f1_drop时，之后的预测和评估
+        都用量化后的模型，并保存量化后的模型；否则继续用原来的模型。
+        不训练、已经有保存的量化后的模型并且它是由当前的模型文件生成的时候直接加载，不再比较(例如towe_server.py，不读取数据集)
+        :return: 是否使用量化后的模型
+        """
+        quantized_model_filepath = self._get_quantized_model_filepath()
+        quantization_result_filepath = self._get_quantization_result_filepath()
+        float_model_fingerprint = quantization.float_model_fingerprint(self.best_model_filepath)
+        if not self.configuration['train'] and os.path.exists(quantized_model_filepath) \
+                and os.path.exists(quantization_result_filepath):
+            with open(quantization_result_filepath, encoding='utf-8') as result_file:
+                saved_result = json.load(result_file)
+            if saved_result.get('float_model') == float_model_fingerprint:
+                self.model = quantization.load_quantized(self.model, quantized_model_filepath)
+                self.model.configuration = self.configuration
+                self._use_cpu()
+                self.logger.info('loaded quantized model: %s dev: %s' % (quantized_model_filepath, str(saved_result)))
+                return True
+            self.logger.info('quantized model: %s was not built from %s, quantizing again'
+                             % (quantized_model_filepath, str(float_model_fingerprint)))
+        if self.dev_data is None:
+            raise ValueError('comparing the quantized model with the float model needs the dev data')
+
+        float_result, float_seconds = self._estimate_dev(self.model)
+        quantized_model = quantization.quantize_dynamic(self.model)
+        quantized_model.configuration = self.configuration
+        gpu_id = self.configuration['gpu_id']
+        device = self.configuration['device']
+        self._use_cpu()
+        quantized_result, quantized_seconds = self._estimate_dev(quantized_model)
+
+        f1_drop = float_result['f1'] - quantized_result['f1']
+        result = {'float_f1': float_result['f1'],
+                  'quantized_f1': quantized_result['f1'],
+                  'f1_drop': f1_drop,
+                  'max_f1_drop': self.configuration['quantize_max_f1_drop'],
+                  'float_seconds': float_seconds,
+                  'float_device': str(device),
+                  'quantized_seconds': quantized_seconds,
+                  'float_model': float_model_fingerprint}
+        self.logger.info('quantization dev: %s' % str(result))
+        if f1_drop > self.configuration['quantize_max_f1_drop']:
+            self.logger.info('span f1 drops more than %f after quantization, using the float model'
+                             % self.configuration['quantize_max_f1_drop'])
+            self.configuration['gpu_id'] = gpu_id
+            self.configuration['device'] = device
+            return False
+        quantization.save_quantized(quantized_model, quantized_model_filepath)
+        with open(quantization_result_filepath, mode='w', encoding='utf-8') as result_file:
+            json.dump(result, result_file)
+        self.model = quantized_model
+        return True
+
     def evaluate(self):
         estimator = self._get_estimator(self.model)
 
@@ -608,28 +895,16 @@ class ToweModel(SequenceLabeling):
             # 'test': self.test_data
         }
 
-        reader = self.data_reader
-
-        train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-        for data_type in train_dev_test_data.keys():
-            data_new = []
-            for sample in train_dev_test_data[data_type]:
-                sample_new = {
-                    'words': sample.words,
-                    'target_tags': sample.target_tags,
-                    'opinion_words_tags': sample.opinion_words_tags,
-                    'polarity': sample.polarity,
-                    'metadata': sample.metadata,
-                    'data_type': data_type
-                }
-                data_new.append(sample_new)
-
-            instances = reader.read(data_new)
-            data_type_and_data[data_type] = instances
+        # 和训练时读取的instance是同一份(instance_store)，debug时也是完整的数据
+        for data_type in self.dataset.get_data_type_and_data_dict().keys():
+            data_type_and_data[data_type] = self._read_split(data_type)
 
+        data_type_and_result = {}
         for data_type, data in data_type_and_data.items():
             result = estimator.estimate(data)
             self.logger.info('data_type: %s result: %s' % (data_type, result))
+            data_type_and_result[data_type] = result
+        return data_type_and_result
 
     def evaluate_on_other_domain_data(self):
         estimator = self._get_estimator(self.model)
@@ -640,29 +915,8 @@ class ToweModel(SequenceLabeling):
             # 'test': self.test_data
         }
 
-        reader = self.data_reader
-
-        # train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-        dataset = data_object.get_dataset_class_by_name(self.configuration['other_domain_dataset'])(self.configuration)
-        train_dev_test_data = dataset.get_data_type_and_data_dict()
-
-        for data_type in train_dev_test_data.keys():
-            if data_type != 'test':
-                continue
-            data_new = []
-            for sample in train_dev_test_data[data_type]:
-                sample_new = {
-                    'words': sample.words,
-                    'target_tags': sample.target_tags,
-                    'opinion_words_tags': sample.opinion_words_tags,
-                    'polarity': sample.polarity,
-                    'metadata': sample.metadata,
-                    'data_type': data_type
-                }
-                data_new.append(sample_new)
-
-            instances = reader.read(data_new)
-            data_type_and_data[data_type] = instances
+        data_type_and_data['test'] = self._read_split('test',
+                                                      dataset_name=self.configuration['other_domain_dataset'])
 
         for data_type, data in data_type_and_data.items():
             result = estimator.estimate(data)
@@ -722,24 +976,16 @@ class ToweModel(SequenceLabeling):
         file_utils.write_lines(output_lines, output_filepath)
 
     def predict_test_v2(self, output_filepath):
-        reader = self.data_reader
-
-        train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-        data_new = []
-        for sample in train_dev_test_data['test']:
-            sample_new = {
-                'words': sample.words,
-                'target_tags': sample.target_tags,
-                'opinion_words_tags': sample.opinion_words_tags,
-                'polarity': sample.polarity,
-                'metadata': sample.metadata,
-                'data_type': 'test'
-            }
-            data_new.append(sample_new)
+        instances = self._read_split('test')
 
-        instances = reader.read(data_new)
+        result = self._predict_instances(instances)
+        output_lines = []
+        for i in range(len(instances)):
+            line = json.dumps(self._to_predict_test_v2_result(instances[i], result[i]), ensure_ascii=False)
+            output_lines.append(line)
+        file_utils.write_lines(output_lines, output_filepath)
 
+    def _predict_instances(self, instances: List[Instance]):
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
             gpu_id = self.configuration['gpu_id']
@@ -747,70 +993,85 @@ class ToweModel(SequenceLabeling):
             gpu_id = -1
         predictor = pytorch_models.SequenceLabelingModelPredictor(self.model, self.val_iterator,
                                                                   cuda_device=gpu_id, configuration=self.configuration)
+        return predictor.predict(instances)
 
-        result = predictor.predict(instances)
-        output_lines = []
-        for i in range(len(instances)):
-            instance = instances[i]
-            # text = instance.fields['sample'].metadata['metadata']['original_line'].split('####')[0]
-            text = instance.fields['sample'].metadata['metadata']['original_line_data']['sentence']
-            words_real = text.split(' ')
-            words = instance.fields['sample'].metadata['words']
-
-            target_tags = instance.fields['sample'].metadata['target_tags']
-            target = self.terms_from_tags(target_tags, words)[0]
-            target_parts = target.split('-')
-            target_parts[-2] = int(target_parts[-2])
-            target_parts[-1] = int(target_parts[-1])
-
-            pred = result[i][:len(words)]
-            term_with_texts_temp = self.terms_from_tags(pred, words)
-            term_with_texts = []
-            if len(words_real) < len(words):
-                for term_with_text in term_with_texts_temp:
-                    term_with_text_parts = term_with_text.split('-')
-                    if int(term_with_text_parts[-2]) < target_parts[-2]:
-                        term_with_texts.append(term_with_text)
-                    else:
-                        term_with_text_parts[-2] = str(int(term_with_text_parts[-2]) - 2)
-                        term_with_text_parts[-1] = str(int(term_with_text_parts[-1]) - 2)
-                        term_with_texts.append('-'.join(term_with_text_parts))
-
-                target_parts[-2] = str(target_parts[-2] - 1)
-                target_parts[-1] = str(target_parts[-1] - 1)
-            else:
-                term_with_texts = term_with_texts_temp
-                target_parts[-2] = str(target_parts[-2])
-                target_parts[-1] = str(target_parts[-1])
-
-            line = json.dumps({'text': text,
-                               'pred': term_with_texts,
-                               'aspect_terms': ['-'.join(target_parts)]},
-                              ensure_ascii=False)
-            output_lines.append(line)
-        file_utils.write_lines(output_lines, output_filepath)
+    def _to_predict_test_v2_result(self, instance: Instance, predicted_tags: List[str]):
+        """
+        :return: predict_test_v2输出的一行
+        """
+        # text = instance.fields['sample'].metadata['metadata']['original_line'].split('####')[0]
+        text = instance.fields['sample'].metadata['metadata']['original_line_data']['sentence']
+        words_real = text.split(' ')
+        words = instance.fields['sample'].metadata['words']
+
+        target_tags = instance.fields['sample'].metadata['target_tags']
+        target = self.terms_from_tags(target_tags, words)[0]
+        target_parts = target.split('-')
+        target_parts[-2] = int(target_parts[-2])
+        target_parts[-1] = int(target_parts[-1])
+
+        pred = predicted_tags[:len(words)]
+        term_with_texts_temp = self.terms_from_tags(pred, words)
+        term_with_texts = []
+        if len(words_real) < len(words):
+            for term_with_text in term_with_texts_temp:
+                term_with_text_parts = term_with_text.split('-')
+                if int(term_with_text_parts[-2]) < target_parts[-2]:
+                    term_with_texts.append(term_with_text)
+                else:
+                    term_with_text_parts[-2] = str(int(term_with_text_parts[-2]) - 2)
+                    term_with_text_parts[-1] = str(int(term_with_text_parts[-1]) - 2)
+                    term_with_texts.append('-'.join(term_with_text_parts))
 
-    def predict_test_v2_on_other_domain_data(self, output_filepath):
-        reader = self.data_reader
+            target_parts[-2] = str(target_parts[-2] - 1)
+            target_parts[-1] = str(target_parts[-1] - 1)
+        else:
+            term_with_texts = term_with_texts_temp
+            target_parts[-2] = str(target_parts[-2])
+            target_parts[-1] = str(target_parts[-1])
 
-        # train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-        dataset = data_object.get_dataset_class_by_name(self.configuration['other_domain_dataset'])(self.configuration)
-        train_dev_test_data = dataset.get_data_type_and_data_dict()
+        return {'text': text,
+                'pred': term_with_texts,
+                'aspect_terms': ['-'.join(target_parts)]}
 
-        data_new = []
-        for sample in train_dev_test_data['test']:
+    def predict_samples(self, samples: List[dict]):
+        """
+        不读取数据集，直接预测，towe_server.py使用
+        :param samples: 每个sample包含words(词的列表)和aspect_term({'start': 第一个词的索引,
+        'end': 最后一个词的索引 + 1})
+        :return: 每个sample一个dict，和predict_test_v2输出的每一行一样
+        """
+        instances = []
+        for sample in samples:
+            words = list(sample['words'])
+            aspect_term = sample['aspect_term']
+            start = aspect_term['start']
+            end = aspect_term['end']
+            if not 0 <= start < end <= len(words):
+                raise ValueError('invalid aspect term: %s' % str(aspect_term))
+            target_tags = ['O' for _ in words]
+            target_tags[start] = 'B'
+            for i in range(start + 1, end):
+                target_tags[i] = 'I'
+            original_line_data = {
+                'sentence': ' '.join(words),
+                'words': list(words),
+                'aspect_term': {'term': ' '.join(words[start: end]), 'start': start, 'end': end}
+            }
             sample_new = {
-                'words': sample.words,
-                'target_tags': sample.target_tags,
-                'opinion_words_tags': sample.opinion_words_tags,
-                'polarity': sample.polarity,
-                'metadata': sample.metadata,
+                'words': words,
+                'target_tags': target_tags,
+                # 有的reader需要opinion_words_tags，预测时不会用到
+                'opinion_words_tags': ['O' for _ in words],
+                'metadata': {'original_line_data': original_line_data},
                 'data_type': 'test'
-
             }
-            data_new.append(sample_new)
+            instances.append(self.data_reader.text_to_instance(sample_new))
+        result = self._predict_instances(instances)
+        return [self._to_predict_test_v2_result(instance, tags) for instance, tags in zip(instances, result)]
 
-        instances = reader.read(data_new)
+    def predict_test_v2_on_other_domain_data(self, output_filepath):
+        instances = self._read_split('test', dataset_name=self.configuration['other_domain_dataset'])
 
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
@@ -1032,23 +1293,7 @@ class AsoTermModel(SequenceLabeling):
         file_utils.write_lines(output_lines, output_filepath)
 
     def predict_test_V2(self, output_filepath):
-        reader = self.data_reader
-
-        train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-        data_new = []
-        for sample in train_dev_test_data['test']:
-            sample_new = {
-                'words': sample.words,
-                'target_tags': sample.target_tags,
-                'opinion_words_tags': sample.opinion_words_tags,
-                'polarity': sample.polarity,
-                'metadata': sample.metadata,
-                'data_type': 'test'
-            }
-            data_new.append(sample_new)
-
-        instances = reader.read(data_new)
+        instances = self._read_split('test')
 
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
@@ -1114,6 +1359,7 @@ class AsoTermModelBert(AsoTermModel):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -1123,14 +1369,7 @@ class AsoTermModelBert(AsoTermModel):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -1221,6 +1460,7 @@ class AsoBertPair(AsoTermModel):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -1230,14 +1470,7 @@ class AsoBertPair(AsoTermModel):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -1338,14 +1571,7 @@ class AsoBertPairWithPosition(AsoTermModel):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -1481,23 +1707,7 @@ class AsteTermModel(SequenceLabeling):
             file_utils.write_lines(sentiment_output_lines, output_filepath + '.sentiment')
 
     def predict_test_v2(self, output_filepath):
-        reader = self.data_reader
-
-        train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-        data_new = []
-        for sample in train_dev_test_data['test']:
-            sample_new = {
-                'words': sample.words,
-                'target_tags': sample.target_tags,
-                'opinion_words_tags': sample.opinion_words_tags,
-                'polarity': sample.polarity,
-                'metadata': sample.metadata,
-                'data_type': 'test'
-            }
-            data_new.append(sample_new)
-
-        instances = reader.read(data_new)
+        instances = self._read_split('test')
 
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
@@ -1597,6 +1807,7 @@ class WarmupAsteTermModel(AsteTermModel):
             gpu_id = -1
 
         self.model: pytorch_models.WarmupSequenceLabelingModel = self._find_model_function()
+        self._precompute_bert_features(self.model)
 
         estimator = self._get_estimator(self.model)
 
@@ -1628,10 +1839,14 @@ class WarmupAsteTermModel(AsteTermModel):
                 serialization_dir=towe_model_dir,
                 patience=self.configuration['patience'],
                 callbacks=callbacks,
-                num_serialized_models_to_keep=0,
+                **self._get_checkpointer_args(self.model, towe_model_dir),
                 early_stopping_by_batch=self.configuration['early_stopping_by_batch'],
                 estimator=estimator,
-                grad_clipping=5
+                grad_clipping=5,
+                prefetch_batches=self.configuration.get('prefetch_batches', 0),
+                profile_epoch=self.configuration.get('profile_epoch', -1),
+                profile_batches=self._get_profile_batches(),
+                training_metrics_interval=self.configuration.get('training_metrics_interval', 1)
             )
             metrics = trainer.train()
             self.logger.info('towe metrics: %s' % str(metrics))
@@ -1666,10 +1881,14 @@ class WarmupAsteTermModel(AsteTermModel):
             serialization_dir=self.model_dir,
             patience=self.configuration['patience'],
             callbacks=callbacks,
-            num_serialized_models_to_keep=0,
+            **self._get_checkpointer_args(self.model, self.model_dir),
             early_stopping_by_batch=self.configuration['early_stopping_by_batch'],
             estimator=estimator,
-            grad_clipping=5
+            grad_clipping=5,
+            prefetch_batches=self.configuration.get('prefetch_batches', 0),
+            profile_epoch=self.configuration.get('profile_epoch', -1),
+            profile_batches=self._get_profile_batches(),
+            training_metrics_interval=self.configuration.get('training_metrics_interval', 1)
         )
         metrics = trainer.train()
         self.logger.info('metrics: %s' % str(metrics))
@@ -1731,38 +1950,57 @@ class MILForAso(WarmupAsteTermModel):
         )
         return reader
 
+    def _get_training_split_store_key(self, data_type: str):
+        """
+        train_mil_with_conflict为False时训练用的train和dev不包括conflict的样本，和evaluate_v2读取的train、dev用不同的key
+        """
+        if not self.configuration['train_mil_with_conflict']:
+            data_type = data_type + '_without_conflict'
+        return self._get_instance_store_key(data_type)
+
+    def _read_training_split(self, data_type: str) -> List[Instance]:
+        """
+        训练用的train或dev，这个进程里已经读取过的话直接用instance_store里的instance
+        """
+        def read():
+            data = self.dataset.get_data_type_and_data_dict()[data_type]
+            if not self.configuration['train_mil_with_conflict']:
+                data = [sample for sample in data if sample.polarity != 'conflict']
+            return self._compact_sample_metadata(self.data_reader.read(self._to_reader_samples(data, data_type)))
+
+        return instance_store.get_or_read(self._get_training_split_store_key(data_type), read)
+
+    def _save_instance_store(self):
+        instance_store.put(self._get_training_split_store_key('train'), self.train_data)
+        instance_store.put(self._get_training_split_store_key('dev'), self.dev_data)
+        instance_store.put(self._get_instance_store_key('test'), self.test_data)
+
     def _load_data(self):
         reader = self._get_data_reader()
         self.data_reader = reader
 
-        data_filepath = self.base_data_dir + 'data'
-        if os.path.exists(data_filepath):
+        train_data = instance_store.get(self._get_training_split_store_key('train'))
+        dev_data = instance_store.get(self._get_training_split_store_key('dev'))
+        if train_data is not None and dev_data is not None:
+            self.train_data = train_data
+            self.dev_data = dev_data
+            self.test_data = self._read_split('test')
+            return
+        if self._load_instance_cache():
+            self._save_instance_store()
+            return
+        # 旧版本的pickle缓存
+        data_filepath = self._get_legacy_data_filepath()
+        if data_filepath is not None and os.path.exists(data_filepath):
             self.train_data, self.dev_data, self.test_data, = super()._load_object(data_filepath)
+            for instances in [self.train_data, self.dev_data, self.test_data]:
+                self._compact_sample_metadata(instances)
+            self._save_instance_store()
         else:
-            train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-            train_dev_test_data_new = {}
-            for data_type, data in train_dev_test_data.items():
-                data_new = []
-                for sample in data:
-                    if not self.configuration['train_mil_with_conflict'] and (data_type == 'train' or data_type == 'dev') and sample.polarity == 'conflict':
-                        continue
-                    sample_new = {
-                        'words': sample.words,
-                        'target_tags': sample.target_tags,
-                        'opinion_words_tags': sample.opinion_words_tags,
-                        'polarity': sample.polarity,
-                        'metadata': sample.metadata,
-                        'data_type': data_type
-                    }
-                    data_new.append(sample_new)
-                train_dev_test_data_new[data_type] = data_new
-
-            self.train_data = reader.read(train_dev_test_data_new['train'])
-            self.dev_data = reader.read(train_dev_test_data_new['dev'])
-            self.test_data = reader.read(train_dev_test_data_new['test'])
-            data = [self.train_data, self.dev_data, self.test_data]
-            super()._save_object(data_filepath, data)
+            self.train_data = self._read_training_split('train')
+            self.dev_data = self._read_training_split('dev')
+            # test不过滤conflict，和predict_test_V2共用instance_store里的instance
+            self.test_data = self._read_split('test')
 
     def _find_model_function_pure(self):
         return pytorch_models.MILForASO
@@ -1815,27 +2053,7 @@ class MILForAso(WarmupAsteTermModel):
             ["The", "service", "is", "a", "quite", "slow", ",", "but", "friendly", "."]
         ]
 
-        reader = self.data_reader
-
-        train_dev_test_data = self.dataset.get_data_type_and_data_dict()
-
-        data_new = []
-        for sample in train_dev_test_data['test']:
-
-            # if sample.words not in case_words:
-            #     continue
-
-            sample_new = {
-                'words': sample.words,
-                'target_tags': sample.target_tags,
-                'opinion_words_tags': sample.opinion_words_tags,
-                'polarity': sample.polarity,
-                'metadata': sample.metadata,
-                'data_type': 'test'
-            }
-            data_new.append(sample_new)
-
-        instances = reader.read(data_new)
+        instances = self._read_split('test')
 
         USE_GPU = torch.cuda.is_available()
         if USE_GPU:
@@ -1902,6 +2120,7 @@ class MILForAsoBert(MILForAso):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -1914,14 +2133,7 @@ class MILForAsoBert(MILForAso):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -2022,6 +2234,7 @@ class TermBert(ToweModel):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -2031,14 +2244,7 @@ class TermBert(ToweModel):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -2169,6 +2375,7 @@ class AsteTermBert(WarmupAsteTermModel):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -2178,14 +2385,7 @@ class AsteTermBert(WarmupAsteTermModel):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -2513,6 +2713,7 @@ class NerBertForOTE(NerLstmForOTE):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -2525,14 +2726,7 @@ class NerBertForOTE(NerLstmForOTE):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -2620,6 +2814,7 @@ class NerBert(SequenceLabeling):
         for param in bert_model.parameters():
             param.requires_grad = (not self.configuration['fixed_bert'])
         bert_embedder = BertEmbedder(bert_model=bert_model, top_layer_only=True)
+        bert_embedder = self._cache_bert_features(bert_embedder)
 
         bert_word_embedder: TextFieldEmbedder = BasicTextFieldEmbedder({"bert": bert_embedder},
                                                                        # we'll be ignoring masks so we'll need to set this to True
@@ -2632,14 +2827,7 @@ class NerBert(SequenceLabeling):
 
     def _find_model_function(self):
         embedding_dim = self.configuration['embed_size']
-        embedding_matrix_filepath = self.base_data_dir + 'embedding_matrix'
-        if os.path.exists(embedding_matrix_filepath):
-            embedding_matrix = super()._load_object(embedding_matrix_filepath)
-        else:
-            embedding_filepath = self.configuration['embedding_filepath']
-            embedding_matrix = embedding._read_embeddings_from_text_file(embedding_filepath, embedding_dim,
-                                                                         self.vocab, namespace='tokens')
-            super()._save_object(embedding_matrix_filepath, embedding_matrix)
+        embedding_matrix = self._read_embedding_matrix(embedding_dim)
         token_embedding = Embedding(num_embeddings=self.vocab.get_vocab_size(namespace='tokens'),
                                     embedding_dim=embedding_dim, padding_index=0, vocab_namespace='tokens',
                                     trainable=False, weight=embedding_matrix)
@@ -2698,6 +2886,13 @@ class IOG(ToweModel):
         )
         return reader
 
+    def _get_instance_cache_dir(self):
+        # DatasetReaderForIOG的instance只包含tokens和target_span，以前缓存的instance还有left_tokens等字段
+        return self.base_data_dir + 'data_columnar_target_span_%s/' % self._get_instance_cache_fingerprint()
+
+    def _get_legacy_data_filepath(self):
+        return None
+
     def _find_model_function_pure(self):
         return pytorch_models.IOG
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+对比逐句计算的crf(per_sentence_crf)和SimpleSequenceLabelingModel batch版本的crf(batch_crf)的速度和结果
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/simple_crf_benchmark.py --batch_sizes 1,8,32,128
+"""
+
+
+import argparse
+import time
+
+import torch
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.modules.token_embedders import Embedding
+from allennlp.modules.text_field_embedders import BasicTextFieldEmbedder
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import pytorch_models
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch_sizes', default='1,2,4,8,16,32,64,128', type=str)
+parser.add_argument('--min_len', default=3, type=int)
+parser.add_argument('--max_len', default=80, type=int)
+parser.add_argument('--repeat', default=5, type=int)
+parser.add_argument('--seed', default=776, type=int)
+
+
+def build_model(device):
+    tag_map = {'O': 0, 'B': 1, 'I': 2, pytorch_models.START_TAG: 3, pytorch_models.STOP_TAG: 4}
+    token_embedding = Embedding(num_embeddings=100, embedding_dim=300)
+    word_embedder = BasicTextFieldEmbedder({"tokens": token_embedding})
+    model = pytorch_models.SimpleSequenceLabelingModel(word_embedder, None, Vocabulary(),
+                                                       {'tag_map': tag_map})
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+def per_sentence_crf(model, logits, labels, lengths):
+    """
+    用SimpleSequenceLabelingModel逐句计算的real_path_score、total_score和__viterbi_decode，只用于和batch版本对比
+    """
+    scores = []
+    paths = []
+    for logit, leng in zip(logits, lengths):
+        logit = logit[:leng]
+        score, path = model._SimpleSequenceLabelingModel__viterbi_decode(logit)
+        scores.append(score)
+        paths.append(path)
+    output = {'scores': scores, 'paths': paths}
+
+    if labels is not None:
+        real_path_score = torch.zeros(1)
+        total_score = torch.zeros(1)
+        for logit, tag, leng in zip(logits, labels, lengths):
+            logit = logit[:leng]
+            tag = tag[:leng]
+            real_path_score += model.real_path_score(logit, tag)
+            total_score += model.total_score(logit, tag)
+        loss = total_score - real_path_score
+        output['loss'] = loss
+
+    return output
+
+
+def random_batch(batch_size, min_len, max_len, tag_size, device):
+    lengths = torch.randint(min_len, max_len + 1, (batch_size,))
+    max_length = int(lengths.max())
+    mask = (torch.arange(max_length).unsqueeze(0) < lengths.unsqueeze(1)).long()
+    logits = torch.randn(batch_size, max_length, tag_size)
+    # START和STOP不会出现在真实标签里
+    labels = torch.randint(0, tag_size - 2, (batch_size, max_length)) * mask
+    return logits.to(device), labels.to(device), mask.to(device), lengths.tolist()
+
+
+def timeit(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+    # 逐句计算的版本只支持cpu
+    device = torch.device('cpu')
+    model = build_model(device)
+
+    print('batch_size\tper_sentence(ms)\tbatch(ms)\tspeedup\tloss_diff\tsame_paths')
+    with torch.no_grad():
+        for batch_size in [int(e) for e in args.batch_sizes.split(',')]:
+            logits, labels, mask, lengths = random_batch(batch_size, args.min_len, args.max_len,
+                                                         model.tag_size, device)
+            per_sentence_time, per_sentence_output = timeit(
+                lambda: per_sentence_crf(model, logits, labels, lengths), args.repeat)
+            batch_time, batch_output = timeit(lambda: model.batch_crf(logits, labels, mask), args.repeat)
+            loss_diff = abs(float(per_sentence_output['loss']) - float(batch_output['loss']))
+            same_paths = [list(e) for e in per_sentence_output['paths']] == batch_output['paths']
+            print('%d\t%.3f\t%.3f\t%.1fx\t%.6f\t%s' % (batch_size, per_sentence_time * 1000, batch_time * 1000,
+                                                       per_sentence_time / batch_time, loss_diff, same_paths))
+
+
+if __name__ == '__main__':
+    main()
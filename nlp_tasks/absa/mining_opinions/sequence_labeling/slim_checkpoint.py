@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+精简的模型文件和checkpoint: 不需要梯度的参数(固定的词向量、fixed_bert时的bert)按内容的sha1保存在共享的
+FrozenTensorStore里，模型文件和checkpoint里只记录sha1。不同seed、不同数据集的模型用的词向量和bert一样时，
+这些参数只保存一次。
+
+SlimCheckpointer代替allennlp的Checkpointer，训练线程只复制需要梯度的参数和optimizer的状态，写文件在后台线程里进行。
+"""
+
+
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import weakref
+from typing import *
+
+import torch
+from allennlp.training.checkpointer import Checkpointer
+
+
+SLIM_FORMAT = 'slim_v1'
+
+# id(tensor) -> (tensor的弱引用, 版本, sha1)，不需要梯度的参数不会变，每个进程只计算一次。
+# 传入的应该是nn.Parameter本身(model.state_dict(keep_vars=True))，state_dict()每次返回新的tensor，缓存不会命中
+_tensor_hash_cache = {}
+
+
+def _remove_dead_entry(key: int, reference: weakref.ref):
+    # id可能已经被新的tensor使用，只删除这个弱引用对应的项
+    cached = _tensor_hash_cache.get(key)
+    if cached is not None and cached[0] is reference:
+        del _tensor_hash_cache[key]
+
+
+def tensor_hash(tensor: torch.Tensor) -> str:
+    version = (tensor.data_ptr(), tensor._version, tuple(tensor.size()), str(tensor.dtype))
+    key = id(tensor)
+    cached = _tensor_hash_cache.get(key)
+    if cached is not None and cached[0]() is tensor and cached[1] == version:
+        return cached[2]
+    sha1 = hashlib.sha1()
+    sha1.update(('%s%s' % (tensor.dtype, tuple(tensor.size()))).encode('utf-8'))
+    sha1.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    result = sha1.hexdigest()
+    # tensor被回收时删除这一项
+    reference = weakref.ref(tensor, lambda reference: _remove_dead_entry(key, reference))
+    _tensor_hash_cache[key] = (reference, version, result)
+    return result
+
+
+class FrozenTensorStore:
+    """
+    sha1 -> tensor，每个tensor一个文件，已经有的不再写
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+
+    def _path(self, key: str):
+        return os.path.join(self.store_dir, key + '.pt')
+
+    def put(self, tensor: torch.Tensor) -> str:
+        key = tensor_hash(tensor)
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(self.store_dir, exist_ok=True)
+        # 先写临时文件再改名，其它进程不会读到写了一半的文件
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.store_dir)
+        os.close(fd)
+        try:
+            torch.save(tensor.detach().cpu(), temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return key
+
+    def get(self, key: str, map_location=None) -> torch.Tensor:
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError('frozen tensor %s is not in %s' % (key, self.store_dir))
+        return torch.load(path, map_location=map_location)
+
+
+def is_slim(data) -> bool:
+    return isinstance(data, dict) and data.get('format') == SLIM_FORMAT
+
+
+def _copy_to_cpu(data):
+    if isinstance(data, torch.Tensor):
+        return data.detach().to('cpu', copy=True)
+    if isinstance(data, dict):
+        return data.__class__((key, _copy_to_cpu(value)) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return data.__class__(_copy_to_cpu(value) for value in data)
+    return data
+
+
+def split_state_dict(model: torch.nn.Module, model_state: Dict[str, torch.Tensor]):
+    """
+    :param model_state: model.state_dict()
+    :return: 复制到CPU的需要保存的tensor，不需要梯度的参数(nn.Parameter本身，没有复制，tensor_hash的缓存可以命中)
+    """
+    frozen = {key: value for key, value in model.state_dict(keep_vars=True).items()
+              if isinstance(value, torch.nn.Parameter) and not value.requires_grad and key in model_state}
+    kept = {key: _copy_to_cpu(value) for key, value in model_state.items() if key not in frozen}
+    return kept, frozen
+
+
+def to_slim(kept: Dict[str, torch.Tensor], frozen: Dict[str, torch.Tensor], store: FrozenTensorStore) -> dict:
+    return {'format': SLIM_FORMAT,
+            'store_dir': store.store_dir,
+            'state': kept,
+            'frozen': {key: store.put(value) for key, value in frozen.items()}}
+
+
+def from_slim(slim: dict, map_location=None) -> Dict[str, torch.Tensor]:
+    store = FrozenTensorStore(slim['store_dir'])
+    state = dict(slim['state'])
+    for key, tensor_key in slim['frozen'].items():
+        state[key] = store.get(tensor_key, map_location=map_location)
+    return state
+
+
+def save_model(model: torch.nn.Module, filepath: str, store: FrozenTensorStore):
+    """
+    和torch.save(model, filepath)一样保存整个模型，但不需要梯度的参数保存时临时替换成空的tensor，只记录sha1
+    """
+    frozen = {name: parameter for name, parameter in model.named_parameters() if not parameter.requires_grad}
+    frozen_keys = {name: store.put(parameter) for name, parameter in frozen.items()}
+    original_data = {name: parameter.data for name, parameter in frozen.items()}
+    try:
+        for parameter in frozen.values():
+            parameter.data = parameter.data.new_empty(0)
+        torch.save({'format': SLIM_FORMAT, 'store_dir': store.store_dir, 'model': model, 'frozen': frozen_keys},
+                   filepath)
+    finally:
+        for name, parameter in frozen.items():
+            parameter.data = original_data[name]
+
+
+def load_model(filepath: str, map_location=None) -> torch.nn.Module:
+    """
+    :return: save_model或者torch.save(model, filepath)保存的模型
+    """
+    data = torch.load(filepath, map_location=map_location)
+    if not is_slim(data):
+        return data
+    model = data['model']
+    store = FrozenTensorStore(data['store_dir'])
+    parameters = dict(model.named_parameters())
+    for name, tensor_key in data['frozen'].items():
+        parameter = parameters[name]
+        parameter.data = store.get(tensor_key, map_location='cpu').to(parameter.device)
+    return model
+
+
+class SlimCheckpointer(Checkpointer):
+    """
+    checkpoint里的模型参数用to_slim的格式保存，在后台线程里写文件。文件的名字和删除旧checkpoint的规则和Checkpointer一样
+    """
+
+    def __init__(self, model: torch.nn.Module, store: FrozenTensorStore, serialization_dir: str = None,
+                 keep_serialized_model_every_num_seconds: int = None,
+                 num_serialized_models_to_keep: int = 20) -> None:
+        super().__init__(serialization_dir, keep_serialized_model_every_num_seconds, num_serialized_models_to_keep)
+        self._model = model
+        self._store = store
+        # 只有一个线程，checkpoint按顺序写
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending: List[concurrent.futures.Future] = []
+
+    def _check_pending(self, wait: bool):
+        """
+        后台线程里的异常在这里抛出
+        """
+        pending = []
+        for future in self._pending:
+            if wait or future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self._pending = pending
+
+    def _save_checkpoint_in_background(self, epoch, kept, frozen, training_states, is_best_so_far):
+        super().save_checkpoint(epoch, to_slim(kept, frozen, self._store), training_states, is_best_so_far)
+
+    def save_checkpoint(self,
+                        epoch: Union[int, str],
+                        model_state: Dict[str, Any],
+                        training_states: Dict[str, Any],
+                        is_best_so_far: bool) -> None:
+        if self._serialization_dir is None:
+            return
+        self._check_pending(wait=False)
+        # 训练会继续修改参数和optimizer的状态，先复制一份
+        kept, frozen = split_state_dict(self._model, model_state)
+        training_states = _copy_to_cpu(training_states)
+        self._pending.append(self._executor.submit(self._save_checkpoint_in_background, epoch, kept, frozen,
+                                                   training_states, is_best_so_far))
+
+    def wait(self):
+        self._check_pending(wait=True)
+
+    def restore_checkpoint(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        self.wait()
+        model_state, training_state = super().restore_checkpoint()
+        if is_slim(model_state):
+            model_state = from_slim(model_state, map_location='cpu')
+        return model_state, training_state
+
+    def best_model_state(self) -> Dict[str, Any]:
+        self.wait()
+        model_state = super().best_model_state()
+        if is_slim(model_state):
+            model_state = from_slim(model_state)
+        return model_state
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+评估时按batch累积的指标: 每个batch更新一次，不保存整个数据集的sample和标签。term用(start, end)表示，
+end不包含在term里；aspect term和opinion term的pair、triplet用整数元组表示，句子用text_id表示。
+"""
+
+
+from typing import *
+
+
+def bio_spans(tags: List[str], length: int = None) -> List[Tuple[int, int]]:
+    """
+    B开始一个term，后面连续的I属于这个term，单独的I被忽略
+    :param tags: BIO标签，B和I之外的标签都当作O
+    :param length: 只看前length个标签
+    :return: 每个term的(start, end)
+    """
+    if length is not None:
+        tags = tags[: length]
+    result = []
+    start = -1
+    for i, tag in enumerate(tags):
+        if tag == 'I' and start != -1:
+            continue
+        if start != -1:
+            result.append((start, i))
+            start = -1
+        if tag == 'B':
+            start = i
+    if start != -1:
+        result.append((start, len(tags)))
+    return result
+
+
+def span_from_term(term: str) -> Tuple[int, int]:
+    """
+    :param term: terms_from_tags返回的格式, 例如food-3-4
+    """
+    parts = term.split('-')
+    return int(parts[-2]), int(parts[-1])
+
+
+def precision_recall_f1(pred: set, true: set):
+    """
+    和各个Estimator的precision_recall_f1一样，pred或true为空时抛出ZeroDivisionError
+    """
+    intersection = pred.intersection(true)
+    precision = len(intersection) / len(pred)
+    recall = len(intersection) / len(true)
+    if precision == 0 or recall == 0:
+        f1 = 0
+    else:
+        f1 = 2 * precision * recall / (precision + recall)
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+class SpanF1Accumulator:
+    """
+    代替score_BIO: 只累积预测的term数、标注的term数和预测正确的term数
+    """
+
+    def __init__(self):
+        self.predicted_num = 0
+        self.golden_num = 0
+        self.correct_num = 0
+
+    def update(self, predicted: List[List[str]], golden: List[List[str]]):
+        assert len(predicted) == len(golden)
+        for predicted_tags, golden_tags in zip(predicted, golden):
+            golden_spans = set(bio_spans(golden_tags))
+            predicted_spans = bio_spans(predicted_tags, length=len(golden_tags))
+            self.golden_num += len(golden_spans)
+            self.predicted_num += len(predicted_spans)
+            self.correct_num += sum(span in golden_spans for span in predicted_spans)
+
+    def get_metric(self):
+        precision = self.correct_num / self.predicted_num if self.predicted_num > 0 else 0
+        recall = self.correct_num / self.golden_num if self.golden_num > 0 else 0
+        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+        return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+class AspectOpinionAccumulator:
+    """
+    累积每个(句子, aspect term)的标注和预测，用于aspect term-opinion term pair、aspect term-sentiment pair、
+    opinion term-sentiment pair和triplet的评估。每个sample只有一个aspect term，没有opinion term时
+    opinion term为None，和原来的'-'一样也算作一个pair。
+    """
+
+    def __init__(self):
+        self.text_and_id = {}
+        self.golden_aspects = {}
+        self.golden_pairs = set()
+        self.golden_aspect_sentiments = set()
+        self.golden_triplets = set()
+        self.predicted_opinions = {}
+        self.predicted_sentiments = {}
+
+    def text_id(self, text: str):
+        if text not in self.text_and_id:
+            self.text_and_id[text] = len(self.text_and_id)
+        return self.text_and_id[text]
+
+    def update(self, samples: List[dict], predicted_tags: List[List[str]], predicted_sentiments: List[str] = None):
+        """
+        :param samples: batch['sample']
+        :param predicted_tags: 预测的opinion term标签
+        :param predicted_sentiments: 预测的aspect term的情感
+        """
+        for i, sample in enumerate(samples):
+            words = sample['words']
+            text_id = self.text_id(sample['metadata']['original_line_data']['sentence'])
+            aspect_terms = bio_spans(sample['target_tags'], length=len(words))
+            if len(aspect_terms) > 1:
+                raise Exception('size of aspect_terms > 1')
+            aspect_term = aspect_terms[0]
+            key = (text_id, aspect_term)
+            self.golden_aspects.setdefault(text_id, set()).add(aspect_term)
+
+            opinion_terms = bio_spans(sample['opinion_words_tags'], length=len(words)) or [None]
+            for opinion_term in opinion_terms:
+                self.golden_pairs.add((text_id, aspect_term, opinion_term))
+            self.predicted_opinions[key] = tuple(bio_spans(predicted_tags[i], length=len(words)) or [None])
+
+            if predicted_sentiments is not None:
+                sentiment = sample['polarity']
+                self.golden_aspect_sentiments.add((text_id, aspect_term, sentiment))
+                for opinion_term in opinion_terms:
+                    self.golden_triplets.add((text_id, aspect_term, opinion_term, sentiment))
+                self.predicted_sentiments[key] = predicted_sentiments[i]
+
+    def _keys(self, text_and_aspect_terms: Dict[str, List[Tuple[int, int]]]):
+        """
+        :param text_and_aspect_terms: 句子 -> aspect term抽取的结果，为None时用标注的aspect term
+        """
+        if text_and_aspect_terms is None:
+            for text_id, aspect_terms in self.golden_aspects.items():
+                for aspect_term in aspect_terms:
+                    yield text_id, aspect_term
+        else:
+            for text, aspect_terms in text_and_aspect_terms.items():
+                text_id = self.text_id(text)
+                for aspect_term in aspect_terms:
+                    yield text_id, aspect_term
+
+    def aspect_opinion_pair_metrics(self, text_and_aspect_terms: Dict[str, List[Tuple[int, int]]]):
+        pred = set()
+        for key in self._keys(text_and_aspect_terms):
+            for opinion_term in self.predicted_opinions.get(key, (None,)):
+                pred.add(key + (opinion_term,))
+        return precision_recall_f1(pred, self.golden_pairs)
+
+    def aspect_sentiment_pair_metrics(self, text_and_aspect_terms: Dict[str, List[Tuple[int, int]]]):
+        pred = set()
+        for key in self._keys(text_and_aspect_terms):
+            pred.add(key + (self.predicted_sentiments.get(key, '-'),))
+        return precision_recall_f1(pred, self.golden_aspect_sentiments)
+
+    def triplet_metrics(self, text_and_aspect_terms: Dict[str, List[Tuple[int, int]]]):
+        pred = set()
+        for key in self._keys(text_and_aspect_terms):
+            sentiment = self.predicted_sentiments.get(key, '-')
+            for opinion_term in self.predicted_opinions.get(key, (None,)):
+                pred.add(key + (opinion_term, sentiment))
+        # 参数顺序和原来的实现一样
+        return precision_recall_f1(self.golden_triplets, pred)
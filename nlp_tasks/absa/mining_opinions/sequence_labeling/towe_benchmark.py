@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+在CPU上测试towe_bootstrap.py里每个模型的速度和内存: 训练时每秒的instance数、不同batch_size下预测时每秒的instance数、
+单个请求(batch_size为1)的p50/p99延迟和进程的峰值内存(peak RSS)。一个instance是一个句子和其中的一个aspect term。
+
+数据可以是数据集(--data dataset，默认AGF-ASOTE-data里的current_dataset)的训练集和测试集，也可以是随机生成的句子
+(--data synthetic)，句子长度和每个句子的aspect term数量的分布可以设置，词从vocab里随机选。
+
+每个模型在一个新的进程(spawn)里测试，峰值内存互不影响。结果写到一个带版本号的json文件，--baseline指定之前的结果时
+打印每个指标的变化，变差超过tolerance的指标标记为REGRESSION。
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/towe_benchmark.py --model_names TermBiLSTM,IOG --data synthetic --result_filepath towe_benchmark.json --baseline towe_benchmark.baseline.json --current_dataset ASOTEDataRest14 --embedding_filepath glove.840B.300d.txt --data_type common --crf False --batch_size 32
+
+除了下面的参数，其它参数和towe_bootstrap.py一样，所有模型共用
+"""
+
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+
+import numpy
+import torch
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import my_allennlp_iterator
+from nlp_tasks.absa.mining_opinions.sequence_labeling import my_crf_tagger
+from nlp_tasks.absa.mining_opinions.sequence_labeling import pytorch_models
+from nlp_tasks.absa.mining_opinions.sequence_labeling import towe_bootstrap
+from nlp_tasks.utils import file_utils
+
+
+FORMAT_VERSION = 1
+
+MODEL_NAMES = ['SimpleSequenceLabeling', 'TCBiLSTMWithCrfTagger', 'TermBiLSTMForMFGData', 'TermBiLSTM', 'TermBert',
+               'TermBertWithSecondSentence', 'TermBertWithSecondSentenceWithPosition', 'TermBiLSTMWithSecondSentence',
+               'IOG']
+
+parser = argparse.ArgumentParser(allow_abbrev=False)
+parser.add_argument('--model_names', help='comma separated model names', default=','.join(MODEL_NAMES), type=str)
+parser.add_argument('--data', help='dataset or synthetic', default='dataset', type=str)
+parser.add_argument('--synthetic_sentence_num', default=512, type=int)
+parser.add_argument('--synthetic_length_mean', default=18.0, type=float)
+parser.add_argument('--synthetic_length_std', default=10.0, type=float)
+parser.add_argument('--synthetic_min_len', default=3, type=int)
+parser.add_argument('--synthetic_max_len', default=80, type=int)
+parser.add_argument('--synthetic_aspect_num_mean', help='mean aspect terms per sentence, at least 1', default=1.5,
+                    type=float)
+parser.add_argument('--train_batches', help='timed training batches', default=20, type=int)
+parser.add_argument('--warmup_batches', help='untimed batches before training and each inference run', default=2,
+                    type=int)
+parser.add_argument('--inference_batch_sizes', default='1,8,32,128', type=str)
+parser.add_argument('--inference_instance_num', help='instances predicted at each batch size', default=256, type=int)
+parser.add_argument('--latency_requests', help='single instance requests for p50/p99 latency', default=200, type=int)
+parser.add_argument('--repeat', help='inference runs at each batch size, the median is reported', default=3, type=int)
+parser.add_argument('--threads', help='torch threads of each model process', default=1, type=int)
+parser.add_argument('--random_embeddings', help='use random word embeddings instead of embedding_filepath',
+                    default=False, action='store_true')
+parser.add_argument('--result_filepath', default='towe_benchmark.json', type=str)
+parser.add_argument('--baseline', help='result_filepath of an earlier run to compare with', default='', type=str)
+parser.add_argument('--tolerance', help='relative change regarded as a regression', default=0.1, type=float)
+parser.add_argument('--fail_on_regression', help='exit with 1 when there is a regression', default=False,
+                    action='store_true')
+
+
+def get_configuration(benchmark_args: argparse.Namespace, bootstrap_argv: list, model_name: str):
+    """
+    :return: 在CPU上训练一个新模型的towe_bootstrap的configuration
+    """
+    args = towe_bootstrap.parser.parse_args(bootstrap_argv + ['--model_name', model_name, '--device', 'cpu',
+                                                              '--gpu_id', '-1', '--train', 'True'])
+    configuration = towe_bootstrap.get_configuration(args)
+    configuration['repeat'] = 'benchmark-0'
+    return configuration
+
+
+def peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux上的单位是KB，macOS上是byte
+    if sys.platform == 'darwin':
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+
+def synthetic_samples(template, benchmark_args: argparse.Namespace):
+    """
+    :return: 和SequenceLabeling._load_data里一样的sample，每个aspect term一个。词和标签都是随机的
+    """
+    random_state = numpy.random.RandomState(benchmark_args.synthetic_sentence_num)
+    index_to_token = template.vocab.get_index_to_token_vocabulary('tokens')
+    # 0和1是padding和OOV
+    words_in_vocab = [index_to_token[i] for i in range(2, len(index_to_token))]
+    samples = []
+    for _ in range(benchmark_args.synthetic_sentence_num):
+        length = int(round(random_state.normal(benchmark_args.synthetic_length_mean,
+                                               benchmark_args.synthetic_length_std)))
+        length = min(max(length, benchmark_args.synthetic_min_len), benchmark_args.synthetic_max_len)
+        words = [words_in_vocab[i] for i in random_state.randint(0, len(words_in_vocab), size=length)]
+        aspect_num = 1 + random_state.poisson(max(benchmark_args.synthetic_aspect_num_mean - 1, 0))
+        for _ in range(min(aspect_num, length)):
+            start = random_state.randint(0, length)
+            end = min(length, start + random_state.randint(1, 4))
+            target_tags = ['O'] * length
+            target_tags[start] = 'B'
+            target_tags[start + 1: end] = ['I'] * (end - start - 1)
+            opinion_words_tags = ['O'] * length
+            opinion_start = random_state.randint(0, length)
+            if target_tags[opinion_start] == 'O':
+                opinion_words_tags[opinion_start] = 'B'
+            original_line_data = {
+                'sentence': ' '.join(words),
+                'words': list(words),
+                'aspect_term': {'term': ' '.join(words[start: end]), 'start': start, 'end': end}
+            }
+            samples.append({
+                'words': list(words),
+                'target_tags': target_tags,
+                'opinion_words_tags': opinion_words_tags,
+                'polarity': 'positive',
+                'metadata': {'original_line_data': original_line_data},
+                'data_type': 'train'
+            })
+    return samples
+
+
+def benchmark_training(template, model, instances, benchmark_args: argparse.Namespace):
+    """
+    和Trainer一样计算loss、backward、clip gradients和更新参数(包括training_metrics_interval)，batch的生成也计入时间
+    :return: 每秒训练的instance数
+    """
+    training_metrics_interval = template.configuration.get('training_metrics_interval', 1)
+    optimizer = template._get_optimizer(model)
+    parameters = [parameter for parameter in model.parameters() if parameter.requires_grad]
+    model.train()
+    batches = template.iterator(instances, num_epochs=None, shuffle=True)
+    instance_num = 0
+    start = None
+    for i, batch in enumerate(itertools.islice(batches, benchmark_args.warmup_batches + benchmark_args.train_batches)):
+        if i == benchmark_args.warmup_batches:
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        if training_metrics_interval != 1:
+            my_crf_tagger.set_compute_training_metrics(
+                model, training_metrics_interval > 0 and (i + 1) % training_metrics_interval == 0)
+        loss = model(**batch)['loss']
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(parameters, 5)
+        optimizer.step()
+        if start is not None:
+            instance_num += next(iter(batch['tokens'].values())).size(0)
+    return instance_num / (time.perf_counter() - start)
+
+
+def get_predictor(template, model, batch_size: int):
+    iterator = my_allennlp_iterator.LengthSortedIterator(sorting_keys=[("tokens", "num_tokens")],
+                                                         batch_size=batch_size)
+    iterator.index_with(template.vocab)
+    return pytorch_models.SequenceLabelingModelPredictor(model, iterator, cuda_device=-1,
+                                                         configuration=template.configuration)
+
+
+def benchmark_inference(template, model, instances, batch_size: int, benchmark_args: argparse.Namespace):
+    """
+    :return: 每秒预测的instance数，repeat次的中位数
+    """
+    predictor = get_predictor(template, model, batch_size)
+    predictor.predict(instances[: benchmark_args.warmup_batches * batch_size])
+    instances_per_second = []
+    for _ in range(benchmark_args.repeat):
+        start = time.perf_counter()
+        predictor.predict(instances)
+        instances_per_second.append(len(instances) / (time.perf_counter() - start))
+    return float(numpy.median(instances_per_second))
+
+
+def benchmark_latency(template, model, instances, benchmark_args: argparse.Namespace):
+    """
+    :return: 每个请求只有一个instance时的p50和p99延迟(毫秒)
+    """
+    predictor = get_predictor(template, model, 1)
+    for instance in instances[: benchmark_args.warmup_batches]:
+        predictor.predict([instance])
+    latencies = []
+    for instance in itertools.islice(itertools.cycle(instances), benchmark_args.latency_requests):
+        start = time.perf_counter()
+        predictor.predict([instance])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(numpy.percentile(latencies, 50)), float(numpy.percentile(latencies, 99))
+
+
+def benchmark_model(configuration: dict, benchmark_args: argparse.Namespace):
+    """
+    在一个新的进程里运行
+    :return: 指标名 -> 值，失败时包含error
+    """
+    result = {}
+    template = None
+    try:
+        torch.set_num_threads(benchmark_args.threads)
+        towe_bootstrap.set_seed(configuration['seed'])
+        configuration_for_this_repeat = towe_bootstrap.get_configuration_for_this_repeat(configuration)
+        template = towe_bootstrap.get_template(configuration_for_this_repeat)
+        if benchmark_args.random_embeddings:
+            template._read_embedding_matrix = lambda embedding_dim: torch.randn(
+                template.vocab.get_vocab_size('tokens'), embedding_dim)
+        model = template._find_model_function()
+
+        if benchmark_args.data == 'synthetic':
+            train_instances = template.data_reader.read(synthetic_samples(template, benchmark_args))
+            test_instances = train_instances
+        else:
+            train_instances = template.train_data
+            test_instances = template.test_data
+        test_instances = list(itertools.islice(itertools.cycle(test_instances),
+                                               benchmark_args.inference_instance_num))
+        lengths = [len(instance.fields['tokens'].tokens) for instance in test_instances]
+        result['instance_num'] = len(test_instances)
+        result['mean_length'] = float(numpy.mean(lengths))
+        result['parameter_num'] = sum(parameter.numel() for parameter in model.parameters())
+
+        result['train_instances_per_second'] = benchmark_training(template, model, train_instances, benchmark_args)
+        for batch_size in benchmark_args.inference_batch_sizes.split(','):
+            result['inference_instances_per_second_bs%s' % batch_size] = benchmark_inference(
+                template, model, test_instances, int(batch_size), benchmark_args)
+        result['latency_p50_ms'], result['latency_p99_ms'] = benchmark_latency(template, model, test_instances,
+                                                                               benchmark_args)
+    except Exception:
+        result['error'] = traceback.format_exc().strip().split('\n')[-1]
+        traceback.print_exc()
+    result['peak_rss_mb'] = peak_rss_mb()
+    if template is not None:
+        for handler in template.logger.handlers[:]:
+            handler.close()
+            template.logger.removeHandler(handler)
+        file_utils.rm_r(template.base_model_dir)
+    return result
+
+
+def get_environment(benchmark_args: argparse.Namespace):
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'threads': benchmark_args.threads,
+    }
+
+
+def is_higher_better(metric_name: str):
+    return metric_name.endswith('_per_second')
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    :return: 打印的行，变差超过tolerance的指标数
+    """
+    if baseline.get('format_version') != FORMAT_VERSION:
+        raise ValueError('format_version of the baseline is %s, not %d' % (baseline.get('format_version'),
+                                                                           FORMAT_VERSION))
+    lines = []
+    if baseline['settings'] != results['settings']:
+        lines.append('WARNING: settings are different from the baseline')
+    if baseline['environment'] != results['environment']:
+        lines.append('WARNING: environment is different from the baseline')
+    lines.append('\t'.join(['model_name', 'metric', 'baseline', 'current', 'change', '']))
+    regression_num = 0
+    for model_name, metrics in results['results'].items():
+        baseline_metrics = baseline['results'].get(model_name)
+        if baseline_metrics is None:
+            lines.append('%s\tnot in the baseline' % model_name)
+            continue
+        for metric_name, value in metrics.items():
+            baseline_value = baseline_metrics.get(metric_name)
+            if metric_name in ['error', 'instance_num', 'mean_length', 'parameter_num'] or baseline_value is None:
+                continue
+            change = (value - baseline_value) / baseline_value if baseline_value != 0 else 0.0
+            worse = -change if is_higher_better(metric_name) else change
+            flag = ''
+            if worse > tolerance:
+                flag = 'REGRESSION'
+                regression_num += 1
+            lines.append('%s\t%s\t%.3f\t%.3f\t%+.1f%%\t%s' % (model_name, metric_name, baseline_value, value,
+                                                            change * 100, flag))
+    return lines, regression_num
+
+
+def main():
+    benchmark_args, bootstrap_argv = parser.parse_known_args()
+    if benchmark_args.data not in ['dataset', 'synthetic']:
+        raise ValueError('data should be dataset or synthetic, not %s' % benchmark_args.data)
+    # 只在CPU上测试
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    model_name_and_result = {}
+    context = multiprocessing.get_context('spawn')
+    for model_name in benchmark_args.model_names.split(','):
+        configuration = get_configuration(benchmark_args, bootstrap_argv, model_name)
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(benchmark_model, (configuration, benchmark_args))
+        print('benchmark result of %s: %s' % (model_name, json.dumps(result)))
+        sys.stdout.flush()
+        model_name_and_result[model_name] = result
+
+    settings = {key: value for key, value in benchmark_args.__dict__.items()
+                if key not in ['model_names', 'result_filepath', 'baseline', 'tolerance', 'fail_on_regression']}
+    settings['bootstrap_argv'] = bootstrap_argv
+    results = {
+        'format_version': FORMAT_VERSION,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': get_environment(benchmark_args),
+        'settings': settings,
+        'results': model_name_and_result
+    }
+    with open(benchmark_args.result_filepath, mode='w', encoding='utf-8') as result_file:
+        json.dump(results, result_file, indent=2)
+    print('benchmark results: %s' % benchmark_args.result_filepath)
+
+    if benchmark_args.baseline:
+        with open(benchmark_args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        lines, regression_num = compare(results, baseline, benchmark_args.tolerance)
+        print('\n'.join(lines))
+        print('%d regressions against %s' % (regression_num, benchmark_args.baseline))
+        if regression_num > 0 and benchmark_args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ import numpy
 
 from nlp_tasks.absa.utils import argument_utils
 from nlp_tasks.absa.mining_opinions.sequence_labeling import sequence_labeling_train_templates as templates
+from nlp_tasks.absa.mining_opinions.sequence_labeling import phase_timer
 
 
 parser = argparse.ArgumentParser()
@@ -25,6 +26,10 @@ parser.add_argument('--predict', help='predict text', default=False, type=argume
 parser.add_argument('--predict_test', help='predict test set', default=True, type=argument_utils.my_bool)
 parser.add_argument('--epochs', help='epochs', default=100, type=int)
 parser.add_argument('--batch_size', help='batch_size', default=32, type=int)
+parser.add_argument('--eval_batch_size', help='batch size of evaluation and prediction, 0 for batch_size',
+                    default=0, type=int)
+parser.add_argument('--eval_max_tokens', help='max tokens of a batch in evaluation and prediction, 0 for no limit',
+                    default=0, type=int)
 parser.add_argument('--patience', help='patience', default=10, type=int)
 parser.add_argument('--visualize_attention', help='visualize attention', default=False, type=argument_utils.my_bool)
 parser.add_argument('--embedding_filepath', help='embedding filepath',
@@ -38,6 +43,30 @@ parser.add_argument('--position', default=False, type=argument_utils.my_bool)
 parser.add_argument('--position_embeddings_dim', help='position embeddings dim', default=32, type=int)
 parser.add_argument('--debug', default=False, type=argument_utils.my_bool)
 parser.add_argument('--early_stopping_by_batch', default=False, type=argument_utils.my_bool)
+parser.add_argument('--estimate_data_types', help='data types evaluated by EstimateCallback',
+                    default='train,dev,test', type=str)
+parser.add_argument('--estimate_interval', help='evaluate every estimate_interval epochs', default=1, type=int)
+parser.add_argument('--estimate_train_sample_size', help='0 for evaluating the whole training set', default=0,
+                    type=int)
+parser.add_argument('--estimate_test_only_on_best', help='evaluate the test set only on new best epochs',
+                    default=False, type=argument_utils.my_bool)
+
+parser.add_argument('--prefetch_batches', help='batches built ahead in a background thread in training, 0 for none',
+                    default=0, type=int)
+
+parser.add_argument('--phase_timing', help='write the time of each training/evaluation phase to phase_trace.jsonl',
+                    default=False, type=argument_utils.my_bool)
+parser.add_argument('--phase_timing_synchronize', help='synchronize cuda in phase timing for accurate gpu times',
+                    default=False, type=argument_utils.my_bool)
+parser.add_argument('--profile_epoch', help='record batches of this epoch with torch.autograd.profiler, -1 for none',
+                    default=-1, type=int)
+parser.add_argument('--profile_batches', help='start:end of the profiled batches', default='0:10', type=str)
+parser.add_argument('--training_metrics_interval',
+                    help='compute training metrics (crf decoding, accuracy, span f1) every n batches, 0 for never',
+                    default=1, type=int)
+parser.add_argument('--compact_sample_metadata',
+                    help='keep the samples of instances in a columnar table and only an id in each instance',
+                    default=False, type=argument_utils.my_bool)
 
 parser.add_argument('--crf', help='True for crf tagger, False for simple tagger', default=True,
                     type=argument_utils.my_bool)
@@ -51,6 +80,19 @@ parser.add_argument('--bert_file_path', help='bert_file_path',
 parser.add_argument('--bert_vocab_file_path', help='bert_vocab_file_path',
                     default=r'D:\program\word-vector\uncased_L-12_H-768_A-12\vocab.txt', type=str)
 parser.add_argument('--max_len', help='max length', default=120, type=int)
+parser.add_argument('--bert_feature_cache', help='with fixed_bert, compute bert outputs once and read them from disk',
+                    default=False, type=argument_utils.my_bool)
+parser.add_argument('--bert_feature_dtype', help='float16 or float32', default='float16', type=str)
+
+parser.add_argument('--slim_checkpoint', help='save parameters without gradients once in a shared store',
+                    default=False, type=argument_utils.my_bool)
+parser.add_argument('--frozen_tensor_store_dir', help='store of slim_checkpoint, empty for the default',
+                    default='', type=str)
+
+parser.add_argument('--quantize', help='predict and evaluate with a dynamic int8 quantized model on cpu',
+                    default=False, type=argument_utils.my_bool)
+parser.add_argument('--quantize_max_f1_drop', help='max span f1 drop on dev allowed by quantization',
+                    default=0.01, type=float)
 
 parser.add_argument('--same_special_token', default=False, type=argument_utils.my_bool)
 
@@ -85,100 +127,140 @@ parser.add_argument('--other_domain_dataset', help='dataset name', default='trip
 parser.add_argument('--entire_space', default=False, type=argument_utils.my_bool)
 parser.add_argument('--test_entire_space', default=True, type=argument_utils.my_bool)
 parser.add_argument('--only_test_non_entire_space', default=False, type=argument_utils.my_bool)
-args = parser.parse_args()
-
-args.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if args.device is None else torch.device(args.device)
-gpu_ids = args.gpu_id.split(',')
-if len(gpu_ids) == 1:
-    args.gpu_id = -1 if int(gpu_ids[0]) == -1 else 0
-else:
-    args.gpu_id = list(range(len(gpu_ids)))
-
-
-configuration = args.__dict__
-
-if configuration['seed'] is not None:
-    random.seed(configuration['seed'])
-    numpy.random.seed(configuration['seed'])
-    torch.manual_seed(configuration['seed'])
-    torch.cuda.manual_seed(configuration['seed'])
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
-
-model_name_complete_prefix = 'model_name_{model_name}-include_conflict_{include_conflict}'.format_map(configuration)
-
-configuration_for_this_repeat = copy.deepcopy(configuration)
-configuration_for_this_repeat['model_name_complete'] = '%s.%s' % (model_name_complete_prefix, args.repeat)
-
-if configuration_for_this_repeat['add_predicted_aspect_term'] or configuration_for_this_repeat['data_augmentation']:
-    ate_result_filepath_serial_num = int(configuration_for_this_repeat['repeat'].split('-')[-1])
-    ate_result_filepath = configuration['ate_result_filepath_template'] % ate_result_filepath_serial_num
-    configuration_for_this_repeat['ate_result_filepath'] = ate_result_filepath
-
-model_name = configuration['model_name']
-if model_name in ['SimpleSequenceLabeling']:
-    template = templates.SimpleSequenceLabeling(configuration_for_this_repeat)
-elif model_name in ['TCBiLSTMWithCrfTagger']:
-    template = templates.TCBiLSTMWithCrfTagger(configuration_for_this_repeat)
-elif model_name in ['TermBiLSTMForMFGData']:
-    template = templates.TermBiLSTMForMFGData(configuration_for_this_repeat)
-elif model_name in ['TermBiLSTM']:
-    template = templates.TermBiLSTM(configuration_for_this_repeat)
-elif model_name in ['TermBert']:
-    template = templates.TermBert(configuration_for_this_repeat)
-elif model_name in ['TermBertWithSecondSentence']:
-    template = templates.TermBertWithSecondSentence(configuration_for_this_repeat)
-elif model_name in ['TermBertWithSecondSentenceWithPosition']:
-    template = templates.TermBertWithSecondSentenceWithPosition(configuration_for_this_repeat)
-elif model_name in ['TermBiLSTMWithSecondSentence']:
-    template = templates.TermBiLSTMWithSecondSentence(configuration_for_this_repeat)
-elif model_name in ['IOG']:
-    template = templates.IOG(configuration_for_this_repeat)
-else:
-    raise NotImplementedError(model_name)
-
-if configuration_for_this_repeat['train']:
-    template.train()
-
-if configuration_for_this_repeat['evaluate']:
-    template.evaluate_v2()
-
-if configuration_for_this_repeat['evaluate_on_other_domain_data']:
-    template.evaluate_on_other_domain_data()
-    output_filepath = template.model_dir + 'result_of_predicting_test.txt'
-    output_filepath = output_filepath + '.evaluate_on_other_domain_data'
-    print('result_of_predicting_test:%s ' % output_filepath)
-    template.predict_test_v2_on_other_domain_data(output_filepath)
-
-if configuration_for_this_repeat['predict_test']:
-    output_filepath = template.model_dir + 'result_of_predicting_test.txt'
-    if configuration_for_this_repeat['add_predicted_aspect_term']:
-        output_filepath = output_filepath + '.add_predicted_aspect_term'
-    print('result_of_predicting_test:%s ' % output_filepath)
-    template.predict_test_v2(output_filepath)
-
-if configuration_for_this_repeat['predict']:
-    texts = [
-        {
-            'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
-            'target_tags': 'I\O love\O the\O drinks\B ,\O esp\O lychee\O martini\O ,\O and\O the\O food\O is\O also\O VERY\O good\O .\O'
-        },
-        {
-            'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
-            'target_tags': 'I\O love\O the\O drinks\O ,\O esp\O lychee\B martini\I ,\O and\O the\O food\O is\O also\O VERY\O good\O .\O'
-        },
-        {
-            'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
-            'target_tags': 'I\O love\O the\O drinks\O ,\O esp\O lychee\O martini\O ,\O and\O the\O food\B is\O also\O VERY\O good\O .\O'
-        },
-    ]
-    texts_preprocessed = []
-    for text in texts:
-        text_preprocessed = {
-            'words': text['words'].split(' '),
-            'target_tags': [tag.split('\\')[1] for tag in text['target_tags'].split(' ')]
-        }
-        texts_preprocessed.append(text_preprocessed)
-    result = template.predict(texts_preprocessed)
-    print(result)
 
+
+def get_configuration(args: argparse.Namespace):
+    args.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if args.device is None \
+        else torch.device(args.device)
+    gpu_ids = args.gpu_id.split(',')
+    if len(gpu_ids) == 1:
+        args.gpu_id = -1 if int(gpu_ids[0]) == -1 else 0
+    else:
+        args.gpu_id = list(range(len(gpu_ids)))
+    return args.__dict__
+
+
+def set_seed(seed: int):
+    if seed is not None:
+        random.seed(seed)
+        numpy.random.seed(seed)
+        torch.manual_seed(seed)
+        torch.cuda.manual_seed(seed)
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+
+
+def get_configuration_for_this_repeat(configuration: dict):
+    model_name_complete_prefix = 'model_name_{model_name}-include_conflict_{include_conflict}'.format_map(configuration)
+
+    configuration_for_this_repeat = copy.deepcopy(configuration)
+    configuration_for_this_repeat['model_name_complete'] = '%s.%s' % (model_name_complete_prefix,
+                                                                      configuration['repeat'])
+
+    if configuration_for_this_repeat['add_predicted_aspect_term'] or configuration_for_this_repeat['data_augmentation']:
+        ate_result_filepath_serial_num = int(configuration_for_this_repeat['repeat'].split('-')[-1])
+        ate_result_filepath = configuration['ate_result_filepath_template'] % ate_result_filepath_serial_num
+        configuration_for_this_repeat['ate_result_filepath'] = ate_result_filepath
+    return configuration_for_this_repeat
+
+
+def get_template(configuration_for_this_repeat: dict):
+    model_name = configuration_for_this_repeat['model_name']
+    if model_name in ['SimpleSequenceLabeling']:
+        template = templates.SimpleSequenceLabeling(configuration_for_this_repeat)
+    elif model_name in ['TCBiLSTMWithCrfTagger']:
+        template = templates.TCBiLSTMWithCrfTagger(configuration_for_this_repeat)
+    elif model_name in ['TermBiLSTMForMFGData']:
+        template = templates.TermBiLSTMForMFGData(configuration_for_this_repeat)
+    elif model_name in ['TermBiLSTM']:
+        template = templates.TermBiLSTM(configuration_for_this_repeat)
+    elif model_name in ['TermBert']:
+        template = templates.TermBert(configuration_for_this_repeat)
+    elif model_name in ['TermBertWithSecondSentence']:
+        template = templates.TermBertWithSecondSentence(configuration_for_this_repeat)
+    elif model_name in ['TermBertWithSecondSentenceWithPosition']:
+        template = templates.TermBertWithSecondSentenceWithPosition(configuration_for_this_repeat)
+    elif model_name in ['TermBiLSTMWithSecondSentence']:
+        template = templates.TermBiLSTMWithSecondSentence(configuration_for_this_repeat)
+    elif model_name in ['IOG']:
+        template = templates.IOG(configuration_for_this_repeat)
+    else:
+        raise NotImplementedError(model_name)
+    return template
+
+
+def run(template, configuration_for_this_repeat: dict):
+    """
+    :return: evaluate为True时，evaluate_v2在train、dev和test上的结果
+    """
+    result = None
+    if configuration_for_this_repeat['phase_timing']:
+        phase_timer.start(template.base_model_dir + 'phase_trace.jsonl',
+                          synchronize=configuration_for_this_repeat['phase_timing_synchronize'])
+
+    if configuration_for_this_repeat['train']:
+        # 每个epoch的时间由Trainer写入
+        template.train()
+
+    if configuration_for_this_repeat['quantize']:
+        with phase_timer.phase('quantize'):
+            template.quantize()
+        phase_timer.flush('quantize')
+
+    if configuration_for_this_repeat['evaluate']:
+        with phase_timer.phase('evaluate_v2'):
+            result = template.evaluate_v2()
+        phase_timer.flush('evaluate_v2')
+
+    if configuration_for_this_repeat['evaluate_on_other_domain_data']:
+        template.evaluate_on_other_domain_data()
+        output_filepath = template.model_dir + 'result_of_predicting_test.txt'
+        output_filepath = output_filepath + '.evaluate_on_other_domain_data'
+        print('result_of_predicting_test:%s ' % output_filepath)
+        template.predict_test_v2_on_other_domain_data(output_filepath)
+
+    if configuration_for_this_repeat['predict_test']:
+        output_filepath = template.model_dir + 'result_of_predicting_test.txt'
+        if configuration_for_this_repeat['add_predicted_aspect_term']:
+            output_filepath = output_filepath + '.add_predicted_aspect_term'
+        print('result_of_predicting_test:%s ' % output_filepath)
+        with phase_timer.phase('predict_test_v2'):
+            template.predict_test_v2(output_filepath)
+        phase_timer.flush('predict_test_v2')
+
+    if configuration_for_this_repeat['predict']:
+        texts = [
+            {
+                'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
+                'target_tags': 'I\O love\O the\O drinks\B ,\O esp\O lychee\O martini\O ,\O and\O the\O food\O is\O also\O VERY\O good\O .\O'
+            },
+            {
+                'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
+                'target_tags': 'I\O love\O the\O drinks\O ,\O esp\O lychee\B martini\I ,\O and\O the\O food\O is\O also\O VERY\O good\O .\O'
+            },
+            {
+                'words': 'I love the drinks , esp lychee martini , and the food is also VERY good .',
+                'target_tags': 'I\O love\O the\O drinks\O ,\O esp\O lychee\O martini\O ,\O and\O the\O food\B is\O also\O VERY\O good\O .\O'
+            },
+        ]
+        texts_preprocessed = []
+        for text in texts:
+            text_preprocessed = {
+                'words': text['words'].split(' '),
+                'target_tags': [tag.split('\\')[1] for tag in text['target_tags'].split(' ')]
+            }
+            texts_preprocessed.append(text_preprocessed)
+        with phase_timer.phase('predict'):
+            predict_result = template.predict(texts_preprocessed)
+        phase_timer.flush('predict')
+        print(predict_result)
+    return result
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    configuration = get_configuration(args)
+    set_seed(configuration['seed'])
+    configuration_for_this_repeat = get_configuration_for_this_repeat(configuration)
+    template = get_template(configuration_for_this_repeat)
+    run(template, configuration_for_this_repeat)
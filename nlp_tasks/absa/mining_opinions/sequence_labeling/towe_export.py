@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+把训练好的TermBiLSTM、IOG、TermBert导出成TorchScript，用towe_runtime.py预测时不需要allennlp、spaCy和dgl。
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/towe_export.py --output_dir towe-rest14-termbilstm --current_dataset ASOTEDataRest14 --model_name TermBiLSTM --data_type common --timestamp 1571400646 --repeat 0
+
+output_dir下:
+    model.pt: TorchScript，输入是词(和word piece)的id，输出是每个词的标签id，CRF的viterbi解码也在里面
+    vocab.json: 词、位置和标签的vocab，以及预处理需要的配置
+    bert_vocab.txt: 只有TermBert有
+
+除了--output_dir，其它参数和towe_bootstrap.py一样
+"""
+
+
+import argparse
+import copy
+import json
+import os
+import shutil
+from typing import *
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import batch_viterbi
+
+
+FORMAT_VERSION = 1
+
+MODEL_FILENAME = 'model.pt'
+VOCAB_FILENAME = 'vocab.json'
+BERT_VOCAB_FILENAME = 'bert_vocab.txt'
+
+
+class PackedLSTM(nn.Module):
+    """
+    和masked_rnn.run_rnn一样，padding的位置不参与计算
+    """
+
+    def __init__(self, lstm: nn.LSTM):
+        super().__init__()
+        self.lstm = lstm
+
+    def forward(self, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        lengths = mask.sum(dim=1).clamp(min=1).cpu()
+        packed_inputs = pack_padded_sequence(inputs, lengths, batch_first=True, enforce_sorted=False)
+        packed_outputs, _ = self.lstm(packed_inputs)
+        outputs, _ = pad_packed_sequence(packed_outputs, batch_first=True, total_length=inputs.size(1))
+        return outputs
+
+
+class NoRNN(nn.Module):
+    """
+    TermBert的lstm_layer_num_in_bert为0时代替PackedLSTM
+    """
+
+    def forward(self, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        return inputs
+
+
+class TagDecoder(nn.Module):
+    """
+    tag_projection_layer加上解码: SimpleTagger取argmax，CrfTagger用batch_viterbi
+    """
+
+    def __init__(self, tagger):
+        super().__init__()
+        self.projection = tagger.tag_projection_layer._module
+        num_tags = self.projection.out_features
+        crf = getattr(tagger, 'crf', None)
+        self.use_crf = crf is not None
+        transitions = torch.zeros(num_tags, num_tags)
+        start_transitions = torch.zeros(num_tags)
+        end_transitions = torch.zeros(num_tags)
+        if crf is not None:
+            transitions, start_transitions, end_transitions = batch_viterbi.constrained_transitions(crf)
+        self.register_buffer('transitions', transitions)
+        self.register_buffer('start_transitions', start_transitions)
+        self.register_buffer('end_transitions', end_transitions)
+
+    def viterbi(self, logits: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        tags, _ = batch_viterbi.viterbi_decode(logits, mask, self.transitions, self.start_transitions,
+                                               self.end_transitions)
+        return tags
+
+    def forward(self, encoded_text: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        logits = self.projection(encoded_text)
+        if self.use_crf:
+            return self.viterbi(logits, mask)
+        return logits.argmax(dim=-1)
+
+
+def _embedding(text_field_embedder, key: str) -> nn.Embedding:
+    weight = text_field_embedder._token_embedders[key].weight.detach()
+    return nn.Embedding.from_pretrained(weight, freeze=True)
+
+
+class ExportedTermBiLSTM(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.use_position = bool(model.configuration['position'])
+        self.word_embedding = _embedding(model.word_embedder, 'tokens')
+        self.position_embedding = _embedding(model.position_embedder, 'position')
+        self.lstm = PackedLSTM(model.lstm)
+        self.feedforward = model.feedforward
+        self.decoder = TagDecoder(model._tagger_ner)
+
+    def forward(self, token_ids: torch.Tensor, position_ids: torch.Tensor) -> torch.Tensor:
+        """
+        :param token_ids: (batch_size, word_num)，加上了aspect term前后的特殊词
+        :param position_ids: (batch_size, word_num)
+        :return: (batch_size, word_num)的标签id
+        """
+        mask = (token_ids != 0).long()
+        lstm_input = self.word_embedding(token_ids)
+        if self.use_position:
+            lstm_input = torch.cat([lstm_input, self.position_embedding(position_ids)], dim=-1)
+        encoded_text = self.feedforward(self.lstm(lstm_input, mask))
+        return self.decoder(encoded_text, mask)
+
+
+class ExportedIOG(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.word_embedding = _embedding(model.word_embedder, 'tokens')
+        self.rnn_L = PackedLSTM(model.rnn_L)
+        self.rnn_R = PackedLSTM(model.rnn_R)
+        self.rnn_global = PackedLSTM(model.rnn_global)
+        self.decoder = TagDecoder(model._tagger_ner)
+
+    def forward(self, token_ids: torch.Tensor, target_span: torch.Tensor) -> torch.Tensor:
+        """
+        :param token_ids: (batch_size, word_num)
+        :param target_span: (batch_size, 2)，aspect term的[start, end)
+        :return: (batch_size, word_num)的标签id
+        """
+        mask = (token_ids != 0).long()
+        sentence = self.word_embedding(token_ids)
+
+        positions = torch.arange(mask.size(1), device=mask.device).unsqueeze(0)
+        target_start = target_span[:, 0: 1]
+        target_end = target_span[:, 1: 2]
+        left_mask = (positions < target_end).long() * mask
+        right_mask = (positions >= target_start).long() * mask
+        target_mask = (positions >= target_start).long() * (positions < target_end).long()
+
+        left_context = sentence * left_mask.unsqueeze(-1).float()
+        right_context = sentence * right_mask.unsqueeze(-1).float()
+
+        left_encoded = self.rnn_L(left_context, mask) * left_mask.unsqueeze(-1).float()
+        right_encoded = self.rnn_R(right_context, mask) * right_mask.unsqueeze(-1).float()
+        global_encoded = self.rnn_global(sentence, mask)
+
+        encoded = (left_encoded + right_encoded) * (1 - 0.5 * target_mask.unsqueeze(-1).float())
+        encoded_text = torch.cat([encoded, global_encoded], dim=-1)
+        return self.decoder(encoded_text, mask)
+
+
+class BertTopLayer(nn.Module):
+    """
+    和BertEmbedder(top_layer_only=True)一样，只返回最后一层，用于torch.jit.trace
+    """
+
+    def __init__(self, bert_model):
+        super().__init__()
+        self.bert_model = bert_model
+
+    def forward(self, input_ids: torch.Tensor, token_type_ids: torch.Tensor) -> torch.Tensor:
+        all_encoder_layers, _ = self.bert_model(input_ids=input_ids, token_type_ids=token_type_ids,
+                                                attention_mask=(input_ids != 0).long())
+        return all_encoder_layers[-1]
+
+
+def trace_bert(bert_model) -> torch.jit.ScriptModule:
+    # 只用于trace，word piece id的值不影响结果，第二行有padding
+    input_ids = torch.tensor([[1, 1, 1, 1], [1, 1, 1, 0]])
+    return torch.jit.trace(BertTopLayer(bert_model).eval(), (input_ids, torch.zeros_like(input_ids)))
+
+
+class ExportedTermBert(nn.Module):
+    def __init__(self, model, traced_bert: torch.jit.ScriptModule):
+        super().__init__()
+        self.use_position = bool(model.configuration['position'])
+        self.position_embedding = _embedding(model.position_embedder, 'position')
+        self.bert = traced_bert
+        if model.configuration['lstm_layer_num_in_bert'] != 0:
+            self.lstm = PackedLSTM(model.lstm)
+        else:
+            self.lstm = NoRNN()
+        self.feedforward = model.feedforward
+        self.decoder = TagDecoder(model._tagger_ner)
+
+    def forward(self, token_ids: torch.Tensor, position_ids: torch.Tensor, bert_ids: torch.Tensor,
+                bert_type_ids: torch.Tensor, bert_offsets: torch.Tensor, piece_word_index: torch.Tensor,
+                piece_weight: torch.Tensor) -> torch.Tensor:
+        """
+        :param token_ids: (batch_size, word_num)，只用于mask
+        :param bert_ids: WordpieceIndexer的结果
+        :param bert_offsets: 每个bert word的最后一个word piece的索引
+        :param piece_word_index: word_piece_pooling.piece_word_index_and_weight的结果
+        :return: (batch_size, word_num)的标签id
+        """
+        mask = (token_ids != 0).long()
+        batch_size = token_ids.size(0)
+        word_num = token_ids.size(1)
+        pieces = self.bert(bert_ids, bert_type_ids)
+        range_vector = torch.arange(batch_size, device=pieces.device).unsqueeze(1)
+        bert_word_embeddings = pieces[range_vector, bert_offsets]
+
+        # 和word_piece_pooling.average_word_pieces一样
+        embedding_dim = bert_word_embeddings.size(2)
+        piece_num = min(bert_word_embeddings.size(1), piece_word_index.size(1))
+        bert_word_embeddings = bert_word_embeddings[:, : piece_num]
+        piece_word_index = piece_word_index[:, : piece_num]
+        piece_weight = piece_weight[:, : piece_num].to(bert_word_embeddings.dtype)
+        flat_index = (piece_word_index + range_vector * word_num).view(-1)
+        weighted_embeddings = (bert_word_embeddings * piece_weight.unsqueeze(-1)).reshape(-1, embedding_dim)
+        word_embeddings = bert_word_embeddings.new_zeros((batch_size * word_num, embedding_dim))
+        word_embeddings = word_embeddings.index_add(0, flat_index, weighted_embeddings)
+        lstm_input = word_embeddings.view(batch_size, word_num, embedding_dim)
+
+        if self.use_position:
+            lstm_input = torch.cat([lstm_input, self.position_embedding(position_ids)], dim=-1)
+        encoded_text = self.feedforward(self.lstm(lstm_input, mask))
+        return self.decoder(encoded_text, mask)
+
+
+def _index_to_token(vocab, namespace: str) -> List[str]:
+    index_to_token = vocab.get_index_to_token_vocabulary(namespace)
+    return [index_to_token[i] for i in range(len(index_to_token))]
+
+
+def export(model, configuration: dict, output_dir: str):
+    """
+    :param model: TermBiLSTM、IOG或者TermBert
+    """
+    architecture = type(model).__name__
+    if architecture not in ('TermBiLSTM', 'IOG', 'TermBert'):
+        raise ValueError('exporting %s is not supported' % architecture)
+    if configuration.get('special_token_and_second_sentence', False):
+        raise ValueError('exporting models with special_token_and_second_sentence is not supported')
+    model = copy.deepcopy(model).cpu().eval()
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'architecture': architecture,
+        'model_name': configuration['model_name'],
+        'tokens': _index_to_token(model.vocab, 'tokens'),
+        'tags': _index_to_token(model.vocab, 'opinion_words_tags'),
+        'same_special_token': bool(configuration.get('same_special_token', False))
+    }
+    if architecture == 'IOG':
+        exported = ExportedIOG(model)
+    else:
+        meta['position'] = _index_to_token(model.vocab, 'position')
+        if architecture == 'TermBiLSTM':
+            exported = ExportedTermBiLSTM(model)
+        else:
+            bert_embedder = model.bert_word_embedder._token_embedders['bert']
+            # bert_feature_cache.CachedBertEmbedder
+            bert_embedder = getattr(bert_embedder, 'bert_embedder', bert_embedder)
+            exported = ExportedTermBert(model, trace_bert(bert_embedder.bert_model))
+            meta['max_len'] = configuration['max_len']
+
+    os.makedirs(output_dir, exist_ok=True)
+    torch.jit.save(torch.jit.script(exported.eval()), os.path.join(output_dir, MODEL_FILENAME))
+    if architecture == 'TermBert':
+        shutil.copyfile(configuration['bert_vocab_file_path'], os.path.join(output_dir, BERT_VOCAB_FILENAME))
+    with open(os.path.join(output_dir, VOCAB_FILENAME), mode='w', encoding='utf-8') as vocab_file:
+        json.dump(meta, vocab_file, ensure_ascii=False)
+
+
+parser = argparse.ArgumentParser(allow_abbrev=False)
+parser.add_argument('--output_dir', required=True, type=str)
+
+
+def main():
+    from nlp_tasks.absa.mining_opinions.sequence_labeling import towe_server
+
+    export_args, bootstrap_argv = parser.parse_known_args()
+    template = towe_server.get_template(bootstrap_argv)
+    export(template.model, template.configuration, export_args.output_dir)
+    print('exported to %s' % export_args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
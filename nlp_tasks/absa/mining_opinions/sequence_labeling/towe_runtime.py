@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+towe_export.py导出的模型的CPU预测，只依赖torch(TermBert还需要pytorch_pretrained_bert的BertTokenizer)，
+不需要allennlp、spaCy和dgl。
+
+echo '{"words": ["The", "food", "is", "good", "."], "aspect_term": {"start": 1, "end": 2}}' | python nlp_tasks/absa/mining_opinions/sequence_labeling/towe_runtime.py --model_dir towe-rest14-termbilstm
+
+输入的每一行和towe_server.py的请求一样，输出的每一行和predict_test_v2输出的每一行一样。
+"""
+
+
+import argparse
+import json
+import os
+import sys
+from typing import *
+
+import torch
+
+
+MODEL_FILENAME = 'model.pt'
+VOCAB_FILENAME = 'vocab.json'
+BERT_VOCAB_FILENAME = 'bert_vocab.txt'
+
+# 和allennlp的Vocabulary一样，0是padding，1是未登录词
+PADDING_INDEX = 0
+OOV_INDEX = 1
+
+# 和WordpieceIndexer一样，这些词不转小写
+NEVER_LOWERCASE = {'[UNK]', '[SEP]', '[PAD]', '[CLS]', '[MASK]'}
+
+
+def terms_from_tags(tags: List[str], length: int) -> List[Tuple[int, int]]:
+    """
+    和ToweModel.terms_from_tags一样: B开始一个term，后面连续的I属于这个term
+    """
+    tags = tags[: length]
+    terms = []
+    start = 0
+    while 'B' in tags[start:]:
+        start = tags.index('B', start)
+        end = start + 1
+        while end < len(tags) and tags[end] == 'I':
+            end += 1
+        terms.append((start, end))
+        start = end
+    return terms
+
+
+def pad(sequences: List[List[int]], padding_value: int = 0) -> torch.Tensor:
+    max_length = max(len(sequence) for sequence in sequences)
+    return torch.tensor([sequence + [padding_value] * (max_length - len(sequence)) for sequence in sequences],
+                        dtype=torch.long)
+
+
+class ToweRuntime:
+    def __init__(self, model_dir: str, num_threads: int = 0):
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        with open(os.path.join(model_dir, VOCAB_FILENAME), encoding='utf-8') as vocab_file:
+            self.meta = json.load(vocab_file)
+        self.architecture = self.meta['architecture']
+        self.token_to_index = {token: i for i, token in enumerate(self.meta['tokens'])}
+        self.position_to_index = {token: i for i, token in enumerate(self.meta.get('position', []))}
+        self.tags = self.meta['tags']
+        self.model = torch.jit.load(os.path.join(model_dir, MODEL_FILENAME), map_location='cpu')
+        self.model.eval()
+        self.bert_tokenizer = None
+        if self.architecture == 'TermBert':
+            from pytorch_pretrained_bert.tokenization import BertTokenizer
+            self.bert_tokenizer = BertTokenizer(os.path.join(model_dir, BERT_VOCAB_FILENAME), do_lower_case=True)
+
+    def _word_index(self, word: str):
+        return self.token_to_index.get(word, OOV_INDEX)
+
+    def _with_special_tokens(self, words: List[str], start: int, end: int):
+        """
+        和DatasetReaderForTermBiLSTM一样，在aspect term前后插入特殊词
+        :return: 插入后的词，每个词的相对位置
+        """
+        end_token = '#' if self.meta['same_special_token'] else '$'
+        words = words[: start] + ['#'] + words[start: end] + [end_token] + words[end:]
+        real_start = start
+        real_end = end + 1
+        positions = []
+        for i in range(len(words)):
+            if i < real_start:
+                positions.append(real_start - i)
+            elif i > real_end:
+                positions.append(i - real_end)
+            else:
+                positions.append(0)
+        return words, positions
+
+    def _bert_inputs(self, words: List[str]):
+        """
+        和DatasetReaderForTermBert、WordpieceIndexer(use_starting_offsets=False, truncate_long_sequences=True)一样
+        """
+        max_len = self.meta['max_len']
+        bert_words = ['[CLS]']
+        word_index_and_bert_indices = {}
+        for i, word in enumerate(words):
+            bert_ws = self.bert_tokenizer.tokenize(word.lower())
+            word_index_and_bert_indices[i] = list(range(len(bert_words), len(bert_words) + len(bert_ws)))
+            bert_words.extend(bert_ws)
+        bert_words.append('[SEP]')
+
+        vocab = self.bert_tokenizer.vocab
+        wordpiece_tokenizer = self.bert_tokenizer.wordpiece_tokenizer
+        token_wordpiece_ids = [[vocab[piece] for piece in wordpiece_tokenizer.tokenize(
+            bert_word if bert_word in NEVER_LOWERCASE else bert_word.lower())] for bert_word in bert_words]
+        separator_ids = [vocab[piece] for piece in wordpiece_tokenizer.tokenize('[SEP]')]
+        offsets = []
+        offset = -1
+        pieces_accumulated = 0
+        for token in token_wordpiece_ids:
+            if offset + len(token) - 1 >= max_len:
+                break
+            offset += len(token)
+            offsets.append(offset)
+            pieces_accumulated += len(token)
+        wordpiece_ids = [piece for token in token_wordpiece_ids for piece in token][: pieces_accumulated]
+        type_ids = []
+        type_id = 0
+        cursor = 0
+        while cursor < len(wordpiece_ids):
+            if wordpiece_ids[cursor: cursor + len(separator_ids)] == separator_ids:
+                type_ids.extend([type_id] * len(separator_ids))
+                type_id += 1
+                cursor += len(separator_ids)
+            else:
+                type_ids.append(type_id)
+                cursor += 1
+
+        piece_word_index = [0] * len(bert_words)
+        piece_weight = [0.0] * len(bert_words)
+        for word_index, bert_indices in word_index_and_bert_indices.items():
+            if len(bert_indices) == 0 or max(bert_indices) >= max_len:
+                continue
+            for bert_index in bert_indices:
+                piece_word_index[bert_index] = word_index
+                piece_weight[bert_index] = 1 / len(bert_indices)
+        return wordpiece_ids, type_ids, offsets, piece_word_index, piece_weight
+
+    def _predict_tag_ids(self, samples: List[dict]):
+        inputs = []
+        for sample in samples:
+            words = list(sample['words'])
+            start = sample['aspect_term']['start']
+            end = sample['aspect_term']['end']
+            if not 0 <= start < end <= len(words):
+                raise ValueError('invalid aspect term: %s' % str(sample['aspect_term']))
+            if self.architecture == 'IOG':
+                inputs.append(([self._word_index(word.lower()) for word in words], [start, end]))
+            else:
+                words, positions = self._with_special_tokens(words, start, end)
+                row = ([self._word_index(word) for word in words],
+                       [self.position_to_index.get(str(position), OOV_INDEX) for position in positions])
+                if self.architecture == 'TermBert':
+                    row = row + self._bert_inputs(words)
+                inputs.append(row)
+
+        columns = list(zip(*inputs))
+        with torch.no_grad():
+            if self.architecture == 'IOG':
+                tag_ids = self.model(pad(columns[0]), torch.tensor(columns[1], dtype=torch.long))
+            elif self.architecture == 'TermBiLSTM':
+                tag_ids = self.model(pad(columns[0]), pad(columns[1]))
+            else:
+                piece_weight = [torch.tensor(e, dtype=torch.float) for e in columns[6]]
+                tag_ids = self.model(pad(columns[0]), pad(columns[1]), pad(columns[2]), pad(columns[3]),
+                                     pad(columns[4]), pad(columns[5]),
+                                     torch.nn.utils.rnn.pad_sequence(piece_weight, batch_first=True))
+        tag_ids = tag_ids.tolist()
+        return [[self.tags[tag_id] for tag_id in tag_ids[i][: len(row[0])]] for i, row in enumerate(inputs)]
+
+    def predict(self, samples: List[dict]) -> List[dict]:
+        """
+        :param samples: 每个sample包含words(词的列表)和aspect_term({'start': 第一个词的索引,
+        'end': 最后一个词的索引 + 1})
+        :return: 和ToweModel.predict_samples一样
+        """
+        if len(samples) == 0:
+            return []
+        result = []
+        for sample, tags in zip(samples, self._predict_tag_ids(samples)):
+            words = list(sample['words'])
+            start = sample['aspect_term']['start']
+            end = sample['aspect_term']['end']
+            if self.architecture == 'IOG':
+                words_with_special_tokens = words
+            else:
+                words_with_special_tokens = self._with_special_tokens(words, start, end)[0]
+            pred = []
+            for term_start, term_end in terms_from_tags(tags, len(tags)):
+                term_text = ' '.join(words_with_special_tokens[term_start: term_end])
+                # 和ToweModel._to_predict_test_v2_result一样，aspect term之后的term的索引减去2个特殊词
+                if self.architecture != 'IOG' and term_start >= start + 1:
+                    term_start, term_end = term_start - 2, term_end - 2
+                pred.append('%s-%d-%d' % (term_text, term_start, term_end))
+            result.append({'text': ' '.join(words),
+                           'pred': pred,
+                           'aspect_terms': ['%s-%d-%d' % (' '.join(words[start: end]), start, end)]})
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', required=True, type=str)
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--num_threads', default=0, type=int)
+    args = parser.parse_args()
+
+    runtime = ToweRuntime(args.model_dir, num_threads=args.num_threads)
+    samples = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        sample = json.loads(line)
+        if isinstance(sample['words'], str):
+            sample['words'] = sample['words'].split(' ')
+        samples.append(sample)
+        if len(samples) == args.batch_size:
+            for result in runtime.predict(samples):
+                print(json.dumps(result, ensure_ascii=False))
+            samples = []
+    for result in runtime.predict(samples):
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+常驻的TOWE预测服务: 模型、vocab和reader只加载一次，不读取数据集。并发的请求在max_wait_ms内凑成一个batch
+(最多max_batch_size个sample)再预测。
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/towe_server.py --port 8000 --max_batch_size 32 --max_wait_ms 5 --current_dataset ASOTEDataRest14 --model_name TermBiLSTM --data_type common --timestamp 1571400646 --repeat 0
+
+curl -X POST http://127.0.0.1:8000/predict -d '{"words": ["The", "food", "is", "good", "."], "aspect_term": {"start": 1, "end": 2}}'
+
+请求是一个sample或者sample的列表，sample的words是词的列表(或者用空格分隔的句子)，aspect_term的start和end是词的索引，
+end不包含在aspect term里。返回的每个结果和predict_test_v2输出的每一行一样。
+
+除了下面的参数，其它参数和towe_bootstrap.py一样
+"""
+
+
+import argparse
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import *
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import towe_bootstrap
+
+
+parser = argparse.ArgumentParser(allow_abbrev=False)
+parser.add_argument('--host', default='127.0.0.1', type=str)
+parser.add_argument('--port', default=8000, type=int)
+parser.add_argument('--unix_socket', help='listen on this unix socket instead of host:port', default='', type=str)
+parser.add_argument('--max_batch_size', default=32, type=int)
+parser.add_argument('--max_wait_ms', help='max time waiting for more requests before predicting a batch',
+                    default=5, type=float)
+
+
+class _Request:
+    def __init__(self, samples: List[dict]):
+        self.samples = samples
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    把多个线程提交的sample合并成batch，在一个后台线程里调用predict_function，模型只在这个线程里使用
+    """
+
+    def __init__(self, predict_function: Callable[[List[dict]], list], max_batch_size: int = 32,
+                 max_wait_ms: float = 5):
+        self.predict_function = predict_function
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, samples: List[dict]):
+        """
+        :return: 每个sample的结果，predict_function抛出异常时抛出同样的异常
+        """
+        if len(samples) == 0:
+            return []
+        request = _Request(samples)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_requests(self):
+        requests = [self._queue.get()]
+        sample_num = len(requests[0].samples)
+        deadline = time.monotonic() + self.max_wait_seconds
+        while sample_num < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            sample_num += len(request.samples)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._next_requests()
+            samples = [sample for request in requests for sample in request.samples]
+            try:
+                results = self.predict_function(samples)
+                start = 0
+                for request in requests:
+                    request.result = results[start: start + len(request.samples)]
+                    start += len(request.samples)
+            except Exception as e:
+                if len(requests) > 1:
+                    # 一个请求出错不影响同一个batch里的其它请求
+                    for request in requests:
+                        self._predict_one(request)
+                else:
+                    requests[0].error = e
+            for request in requests:
+                request.done.set()
+
+    def _predict_one(self, request: _Request):
+        try:
+            request.result = self.predict_function(request.samples)
+        except Exception as e:
+            request.error = e
+
+
+def parse_samples(body: bytes):
+    data = json.loads(body.decode('utf-8'))
+    is_list = isinstance(data, list)
+    if not is_list:
+        data = [data]
+    samples = []
+    for sample in data:
+        if not isinstance(sample, dict) or 'words' not in sample or 'aspect_term' not in sample:
+            raise ValueError('each sample should contain words and aspect_term')
+        words = sample['words']
+        if isinstance(words, str):
+            words = words.split(' ')
+        aspect_term = sample['aspect_term']
+        samples.append({'words': words,
+                        'aspect_term': {'start': int(aspect_term['start']), 'end': int(aspect_term['end'])}})
+    return samples, is_list
+
+
+class PredictRequestHandler(BaseHTTPRequestHandler):
+    batcher: MicroBatcher = None
+
+    def _send_json(self, code: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            samples, is_list = parse_samples(body)
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            results = self.batcher.predict(samples)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, results if is_list else results[0])
+
+    def address_string(self):
+        # unix socket的client_address是空字符串
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'unix'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def get_template(bootstrap_argv: list):
+    args = towe_bootstrap.parser.parse_args(bootstrap_argv)
+    configuration = towe_bootstrap.get_configuration(args)
+    configuration['train'] = False
+    configuration['load_data'] = False
+    towe_bootstrap.set_seed(configuration['seed'])
+    configuration_for_this_repeat = towe_bootstrap.get_configuration_for_this_repeat(configuration)
+    return towe_bootstrap.get_template(configuration_for_this_repeat)
+
+
+def main():
+    server_args, bootstrap_argv = parser.parse_known_args()
+    template = get_template(bootstrap_argv)
+    if template.configuration['quantize']:
+        # 不读取数据集，只能加载towe_bootstrap.py --quantize由当前的模型文件生成并保存的量化后的模型
+        template.quantize()
+    template.model.eval()
+    PredictRequestHandler.batcher = MicroBatcher(template.predict_samples, max_batch_size=server_args.max_batch_size,
+                                                 max_wait_ms=server_args.max_wait_ms)
+
+    if server_args.unix_socket:
+        if os.path.exists(server_args.unix_socket):
+            os.remove(server_args.unix_socket)
+        server = ThreadingUnixHTTPServer(server_args.unix_socket, PredictRequestHandler)
+        print('listening on %s' % server_args.unix_socket)
+    else:
+        server = ThreadingHTTPServer((server_args.host, server_args.port), PredictRequestHandler)
+        print('listening on %s:%d' % (server_args.host, server_args.port))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
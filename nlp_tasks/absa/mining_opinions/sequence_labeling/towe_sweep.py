@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+代替repeat_non_bert.sh跑多个seed、数据集和模型: 只import一次，fork之前把instance缓存、vocab和词向量准备好，
+然后用进程池并行训练，每个进程用threads_per_process个线程，所有结果写到一个表里
+
+python nlp_tasks/absa/mining_opinions/sequence_labeling/towe_sweep.py --current_datasets ASOTEDataRest14,ASOTEDataLapt14,ASOTEDataRest15,ASOTEDataRest16 --model_names IOG --seed_num 5 --repeat_template iog-{current_dataset}-{index} --processes 20 --threads_per_process 3 --result_filepath towe_sweep.iog.tsv --embedding_filepath glove.840B.300d.txt --data_type iog --train True --evaluate True --predict False --crf False --epochs 10 --batch_size 1 --entire_space False
+
+除了下面的参数，其它参数和towe_bootstrap.py一样，所有组合共用
+"""
+
+
+import argparse
+import copy
+import multiprocessing
+import numbers
+import os
+import sys
+import traceback
+
+import numpy
+import torch
+
+from nlp_tasks.absa.mining_opinions.sequence_labeling import towe_bootstrap
+from nlp_tasks.utils import file_utils
+
+
+parser = argparse.ArgumentParser(allow_abbrev=False)
+parser.add_argument('--current_datasets', help='comma separated dataset names', default='ASOTEDataRest14', type=str)
+parser.add_argument('--model_names', help='comma separated model names', default='TermBiLSTM', type=str)
+parser.add_argument('--seeds', default='776,42,210,121,783,694,295,946,107,918', type=str)
+parser.add_argument('--seed_num', help='use the first seed_num seeds', default=5, type=int)
+parser.add_argument('--repeat_template', help='repeat of each run, formatted with the configuration and index',
+                    default='{model_name}-{current_dataset}-{index}', type=str)
+parser.add_argument('--processes', help='number of worker processes, 0 for cpu_count / threads_per_process',
+                    default=0, type=int)
+parser.add_argument('--threads_per_process', default=1, type=int)
+parser.add_argument('--result_filepath', default='towe_sweep.tsv', type=str)
+
+
+def get_configurations(sweep_args: argparse.Namespace, bootstrap_argv: list):
+    """
+    :return: 每个dataset/model/seed组合一个towe_bootstrap的configuration
+    """
+    seeds = [int(seed) for seed in sweep_args.seeds.split(',')][: sweep_args.seed_num]
+    result = []
+    for current_dataset in sweep_args.current_datasets.split(','):
+        for model_name in sweep_args.model_names.split(','):
+            for index, seed in enumerate(seeds):
+                args = towe_bootstrap.parser.parse_args(bootstrap_argv + ['--current_dataset', current_dataset,
+                                                                          '--model_name', model_name,
+                                                                          '--seed', str(seed)])
+                configuration = towe_bootstrap.get_configuration(args)
+                configuration['repeat'] = sweep_args.repeat_template.format(index=index, **configuration)
+                result.append(configuration)
+    return result
+
+
+def prepare(configuration: dict):
+    """
+    在fork之前生成instance缓存、vocab和词向量，避免多个进程同时生成
+    """
+    configuration = copy.deepcopy(configuration)
+    configuration['repeat'] = 'sweep_prepare-0'
+    configuration['train'] = True
+    configuration_for_this_repeat = towe_bootstrap.get_configuration_for_this_repeat(configuration)
+    template = towe_bootstrap.get_template(configuration_for_this_repeat)
+    if os.path.exists(configuration['embedding_filepath']):
+        template._read_embedding_matrix(configuration['embed_size'])
+    for handler in template.logger.handlers[:]:
+        handler.close()
+        template.logger.removeHandler(handler)
+    file_utils.rm_r(template.base_model_dir)
+
+
+def init_worker(threads_per_process: int):
+    torch.set_num_threads(threads_per_process)
+
+
+def run_one(configuration: dict):
+    result = {
+        'current_dataset': configuration['current_dataset'],
+        'model_name': configuration['model_name'],
+        'data_type': configuration['data_type'],
+        'repeat': configuration['repeat'],
+        'seed': configuration['seed'],
+    }
+    try:
+        towe_bootstrap.set_seed(configuration['seed'])
+        configuration_for_this_repeat = towe_bootstrap.get_configuration_for_this_repeat(configuration)
+        template = towe_bootstrap.get_template(configuration_for_this_repeat)
+        data_type_and_result = towe_bootstrap.run(template, configuration_for_this_repeat)
+        if data_type_and_result is not None:
+            for data_type, metrics in data_type_and_result.items():
+                for metric_name, value in metrics.items():
+                    if isinstance(value, numbers.Real):
+                        result['%s_%s' % (data_type, metric_name)] = value
+    except Exception:
+        result['error'] = traceback.format_exc().strip().split('\n')[-1]
+        traceback.print_exc()
+    return result
+
+
+def to_table(results: list):
+    """
+    :return: tsv的行，每个组合一行，每个dataset/model/data_type再加上均值和标准差
+    """
+    key_columns = ['current_dataset', 'model_name', 'data_type', 'repeat', 'seed']
+    metric_columns = sorted({key for result in results for key in result.keys()
+                             if key not in key_columns and key != 'error'})
+    columns = key_columns + metric_columns + ['error']
+    lines = ['\t'.join(columns)]
+    for result in results:
+        lines.append('\t'.join(str(result.get(column, '')) for column in columns))
+
+    group_and_results = {}
+    for result in results:
+        group = (result['current_dataset'], result['model_name'], result['data_type'])
+        group_and_results.setdefault(group, []).append(result)
+    for group, group_results in group_and_results.items():
+        for statistic_name, statistic in [('mean', numpy.mean), ('std', numpy.std)]:
+            values = list(group) + [statistic_name, '']
+            for column in metric_columns:
+                column_values = [result[column] for result in group_results if column in result]
+                values.append('%.4f' % statistic(column_values) if len(column_values) > 0 else '')
+            values.append('')
+            lines.append('\t'.join(values))
+    return lines
+
+
+def main():
+    sweep_args, bootstrap_argv = parser.parse_known_args()
+    configurations = get_configurations(sweep_args, bootstrap_argv)
+
+    prepared = set()
+    for configuration in configurations:
+        key = (configuration['current_dataset'], configuration['model_name'], configuration['data_type'])
+        if key not in prepared:
+            prepare(configuration)
+            prepared.add(key)
+
+    processes = sweep_args.processes
+    if processes <= 0:
+        processes = max(1, multiprocessing.cpu_count() // sweep_args.threads_per_process)
+    processes = min(processes, len(configurations))
+    # 每个组合一个新进程，ModelTrainTemplate每次都会给logger加handler
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes, initializer=init_worker, initargs=(sweep_args.threads_per_process,),
+                      maxtasksperchild=1) as pool:
+        results = []
+        for result in pool.imap(run_one, configurations):
+            print('sweep result: %s' % str(result))
+            sys.stdout.flush()
+            results.append(result)
+
+    file_utils.write_lines(to_table(results), sweep_args.result_filepath)
+    print('sweep results: %s' % sweep_args.result_filepath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+把bert word piece的表示平均回词的表示，整个batch只做一次index_add
+"""
+
+
+from typing import *
+
+import numpy as np
+import torch
+from allennlp.data.fields import ArrayField
+
+
+def piece_word_index_and_weight(word_index_and_bert_indices: Dict[int, List[int]], bert_word_num: int,
+                                max_len: int):
+    """
+    :param word_index_and_bert_indices: 词的索引 -> 这个词的word piece在bert_words中的索引
+    :param bert_word_num: len(bert_words)
+    :param max_len: 只要一个词有word piece的索引>=max_len，这个词的表示就是全0
+    :return: 每个word piece所属词的索引，每个word piece的权重(1/这个词word piece的个数，不参与平均的为0)
+    """
+    piece_word_index = np.zeros(bert_word_num, dtype=np.int64)
+    piece_weight = np.zeros(bert_word_num, dtype=np.float32)
+    for word_index, bert_indices in word_index_and_bert_indices.items():
+        if len(bert_indices) == 0 or max(bert_indices) >= max_len:
+            continue
+        for bert_index in bert_indices:
+            piece_word_index[bert_index] = word_index
+            piece_weight[bert_index] = 1 / len(bert_indices)
+    return piece_word_index, piece_weight
+
+
+def word_piece_pooling_fields(word_index_and_bert_indices: Dict[int, List[int]], bert_word_num: int,
+                              max_len: int):
+    """
+    dataset reader调用，生成模型forward中的bert_piece_word_index和bert_piece_weight
+    """
+    piece_word_index, piece_weight = piece_word_index_and_weight(word_index_and_bert_indices, bert_word_num,
+                                                                 max_len)
+    result = {
+        'bert_piece_word_index': ArrayField(piece_word_index, padding_value=0, dtype=np.int64),
+        'bert_piece_weight': ArrayField(piece_weight, padding_value=0)
+    }
+    return result
+
+
+def piece_word_index_and_weight_from_samples(samples: List[dict], piece_num: int, max_len: int,
+                                             device: torch.device):
+    """
+    兼容没有bert_piece_word_index和bert_piece_weight的旧数据
+    """
+    piece_word_indices = []
+    piece_weights = []
+    for sample in samples:
+        piece_word_index, piece_weight = piece_word_index_and_weight(sample['word_index_and_bert_indices'],
+                                                                     len(sample['bert_words']), max_len)
+        piece_word_index_padded = np.zeros(piece_num, dtype=np.int64)
+        piece_weight_padded = np.zeros(piece_num, dtype=np.float32)
+        length = min(piece_num, len(piece_word_index))
+        piece_word_index_padded[: length] = piece_word_index[: length]
+        piece_weight_padded[: length] = piece_weight[: length]
+        piece_word_indices.append(piece_word_index_padded)
+        piece_weights.append(piece_weight_padded)
+    piece_word_index = torch.from_numpy(np.stack(piece_word_indices)).to(device)
+    piece_weight = torch.from_numpy(np.stack(piece_weights)).to(device)
+    return piece_word_index, piece_weight
+
+
+def average_word_pieces(bert_word_embeddings: torch.Tensor, word_num: int, samples: List[dict], max_len: int,
+                        piece_word_index: torch.Tensor = None, piece_weight: torch.Tensor = None):
+    """
+    :param bert_word_embeddings: (batch_size, piece_num, embedding_dim)
+    :param word_num: 词的个数，结果的第二维
+    :param samples: piece_word_index和piece_weight为None时，从sample['word_index_and_bert_indices']生成
+    :param max_len: 同piece_word_index_and_weight
+    :param piece_word_index: (batch_size, piece_num)
+    :param piece_weight: (batch_size, piece_num)
+    :return: (batch_size, word_num, embedding_dim)
+    """
+    batch_size, piece_num, embedding_dim = bert_word_embeddings.size()
+    if piece_word_index is None or piece_weight is None:
+        piece_word_index, piece_weight = piece_word_index_and_weight_from_samples(samples, piece_num, max_len,
+                                                                                  bert_word_embeddings.device)
+    piece_num = min(piece_num, piece_word_index.size(1))
+    bert_word_embeddings = bert_word_embeddings[:, : piece_num]
+    piece_word_index = piece_word_index[:, : piece_num].long()
+    piece_weight = piece_weight[:, : piece_num].to(bert_word_embeddings.dtype)
+
+    batch_offsets = torch.arange(batch_size, device=piece_word_index.device).unsqueeze(1) * word_num
+    flat_index = (piece_word_index + batch_offsets).view(-1)
+    weighted_embeddings = (bert_word_embeddings * piece_weight.unsqueeze(-1)).reshape(-1, embedding_dim)
+    result = bert_word_embeddings.new_zeros((batch_size * word_num, embedding_dim))
+    result = result.index_add(0, flat_index, weighted_embeddings)
+    return result.view(batch_size, word_num, embedding_dim)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+把glove这类文本格式的词向量文件一次性转换成二进制格式: 排好序的词表 + 用np.memmap打开的float32矩阵。
+之后生成embedding matrix只需要对词表做一次向量化的查找，不需要再扫描整个文本文件。
+
+根据vocab生成的embedding matrix也按vocab的hash保存在store里，不同数据集、不同data_type的vocab一样时共享。
+
+store的目录按词向量文件的名字、大小和修改时间区分。所有文件先写到临时文件再用os.replace替换，并行的进程或者中断的
+转换不会留下不完整的文件。
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import *
+
+import numpy as np
+import torch
+from allennlp.data.vocabulary import Vocabulary
+
+from nlp_tasks.common import common_path
+
+
+logger = logging.getLogger(__name__)
+
+SPEC_FILENAME = 'spec.json'
+WORDS_FILENAME = 'words.txt'
+ROWS_FILENAME = 'rows.npy'
+MATRIX_FILENAME = 'matrix.float32'
+SUBSET_DIRNAME = 'subsets'
+
+
+def get_store_dir(embedding_filepath: str):
+    """
+    :return: 词向量文件对应的store目录，所有任务和数据集共享。名字一样但大小或修改时间不一样的文件用不同的目录
+    """
+    stat = os.stat(embedding_filepath)
+    basename = os.path.basename(embedding_filepath)
+    fingerprint = hashlib.md5(('%s\t%d\t%d' % (basename, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    return os.path.join(common_path.common_data_dir, 'embedding_store',
+                        '%s.%s' % (basename, fingerprint.hexdigest()[: 16])) + '/'
+
+
+def _write_atomically(filepath: str, write: Callable[[Any], None]):
+    """
+    :param write: 参数是以二进制模式打开的临时文件
+    """
+    file_descriptor, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath),
+                                                      prefix=os.path.basename(filepath) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, mode='wb') as temp_file:
+            write(temp_file)
+        os.replace(temp_filepath, filepath)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+
+def convert_text_file(embedding_filepath: str, store_dir: str, embedding_dim: int = None):
+    """
+    :param embedding_filepath: 每行是 [word] [dim 1] [dim 2] ...
+    :param store_dir:
+    :param embedding_dim: 为None时用第一行的维度，维度不一样的行会被跳过
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    word_and_row = {}
+    # 列表只是为了在write_matrix里修改
+    row_num_and_embedding_dim = [0, embedding_dim]
+
+    def write_matrix(matrix_file):
+        with open(embedding_filepath, encoding='utf-8', newline='\n', errors='ignore') as embedding_file:
+            for line in embedding_file:
+                fields = line.rstrip().split(' ')
+                if row_num_and_embedding_dim[1] is None:
+                    row_num_and_embedding_dim[1] = len(fields) - 1
+                if len(fields) - 1 != row_num_and_embedding_dim[1]:
+                    logger.warning('Found line with wrong number of dimensions (expected: %d; actual: %d): %s',
+                                   row_num_and_embedding_dim[1], len(fields) - 1, fields[0])
+                    continue
+                try:
+                    vector = np.asarray(fields[1:], dtype=np.float32)
+                except ValueError:
+                    continue
+                matrix_file.write(vector.tobytes())
+                # 和allennlp一样，一个词出现多次时用最后一次的词向量
+                word_and_row[fields[0]] = row_num_and_embedding_dim[0]
+                row_num_and_embedding_dim[0] += 1
+
+    _write_atomically(os.path.join(store_dir, MATRIX_FILENAME), write_matrix)
+    row_num, embedding_dim = row_num_and_embedding_dim
+    words = sorted(word_and_row.keys())
+    rows = np.asarray([word_and_row[word] for word in words], dtype=np.int64)
+    _write_atomically(os.path.join(store_dir, WORDS_FILENAME),
+                      lambda words_file: words_file.write(''.join(word + '\n' for word in words).encode('utf-8')))
+    _write_atomically(os.path.join(store_dir, ROWS_FILENAME), lambda rows_file: np.save(rows_file, rows))
+    # spec最后写，spec存在说明转换已经完成
+    spec = json.dumps({'row_num': row_num, 'embedding_dim': embedding_dim})
+    _write_atomically(os.path.join(store_dir, SPEC_FILENAME), lambda spec_file: spec_file.write(spec.encode('utf-8')))
+
+
+class EmbeddingStore:
+    """
+    words是排好序的词，rows[i]是words[i]的词向量在matrix中的行
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, SPEC_FILENAME), encoding='utf-8') as spec_file:
+            spec = json.load(spec_file)
+        self.embedding_dim = spec['embedding_dim']
+        with open(os.path.join(store_dir, WORDS_FILENAME), encoding='utf-8', newline='\n') as words_file:
+            self.words = np.asarray([line[: -1] for line in words_file], dtype=object)
+        self.rows = np.load(os.path.join(store_dir, ROWS_FILENAME))
+        self.matrix = np.memmap(os.path.join(store_dir, MATRIX_FILENAME), dtype=np.float32, mode='r',
+                                shape=(spec['row_num'], self.embedding_dim))
+
+    def lookup(self, words: List[str]):
+        """
+        :return: 每个词在matrix中的行(不存在的为-1)
+        """
+        if len(words) == 0 or len(self.words) == 0:
+            return np.full(len(words), -1, dtype=np.int64)
+        query = np.asarray(words, dtype=object)
+        positions = np.searchsorted(self.words, query)
+        positions_clipped = np.minimum(positions, len(self.words) - 1)
+        found = self.words[positions_clipped] == query
+        return np.where(found, self.rows[positions_clipped], -1)
+
+    def get_vectors(self, words: List[str]):
+        """
+        :return: (找到的词在words中的索引, 对应的词向量)
+        """
+        rows = self.lookup(words)
+        indices = np.nonzero(rows >= 0)[0]
+        # matrix按行号顺序读更快，读完再恢复成indices的顺序
+        order = np.argsort(rows[indices], kind='stable')
+        vectors = np.asarray(self.matrix[rows[indices][order]], dtype=np.float32)
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return indices, result
+
+
+def load_store(embedding_filepath: str, embedding_dim: int = None):
+    """
+    store不存在时先从文本文件转换
+    """
+    store_dir = get_store_dir(embedding_filepath)
+    if not os.path.exists(os.path.join(store_dir, SPEC_FILENAME)):
+        logger.info('converting %s to %s', embedding_filepath, store_dir)
+        convert_text_file(embedding_filepath, store_dir, embedding_dim=embedding_dim)
+    return EmbeddingStore(store_dir)
+
+
+def vocab_hash(vocab: Vocabulary, namespace: str = 'tokens'):
+    md5 = hashlib.md5()
+    index_to_token = vocab.get_index_to_token_vocabulary(namespace)
+    for i in range(vocab.get_vocab_size(namespace)):
+        md5.update((index_to_token[i] + '\n').encode('utf-8'))
+    return md5.hexdigest()
+
+
+def read_embeddings(embedding_filepath: str, embedding_dim: int, vocab: Vocabulary,
+                    namespace: str = 'tokens') -> torch.FloatTensor:
+    """
+    代替allennlp的embedding._read_embeddings_from_text_file，结果一样: 找不到的词用找到的词向量的均值和方差
+    随机初始化。结果按vocab的hash保存，vocab一样时直接读取。
+    """
+    store = load_store(embedding_filepath, embedding_dim=embedding_dim)
+    if store.embedding_dim != embedding_dim:
+        raise ValueError('embedding_dim of %s is %d, not %d' % (embedding_filepath, store.embedding_dim,
+                                                                embedding_dim))
+    subset_dir = os.path.join(store.store_dir, SUBSET_DIRNAME)
+    subset_filepath = os.path.join(subset_dir, '%s.npy' % vocab_hash(vocab, namespace=namespace))
+    if os.path.exists(subset_filepath):
+        return torch.from_numpy(np.load(subset_filepath))
+
+    vocab_size = vocab.get_vocab_size(namespace)
+    index_to_token = vocab.get_index_to_token_vocabulary(namespace)
+    tokens = [index_to_token[i] for i in range(vocab_size)]
+    indices, vectors = store.get_vectors(tokens)
+    if len(indices) == 0:
+        raise ValueError('No embeddings found in %s for namespace %s' % (embedding_filepath, namespace))
+    embedding_matrix = torch.FloatTensor(vocab_size, embedding_dim).normal_(float(np.mean(vectors)),
+                                                                            float(np.std(vectors)))
+    embedding_matrix[torch.from_numpy(indices)] = torch.from_numpy(vectors)
+    logger.info('Pretrained embeddings were found for %d out of %d tokens', len(indices), vocab_size)
+
+    os.makedirs(subset_dir, exist_ok=True)
+    _write_atomically(subset_filepath, lambda subset_file: np.save(subset_file, embedding_matrix.numpy()))
+    return embedding_matrix
+
+
+def load_word_vec(embedding_filepath: str, words: Iterable[str] = None):
+    """
+    :return: word -> 词向量，words为None时返回所有词
+    """
+    store = load_store(embedding_filepath)
+    if words is None:
+        words = store.words.tolist()
+    words = list(words)
+    indices, vectors = store.get_vectors(words)
+    return {words[index]: vector for index, vector in zip(indices.tolist(), vectors)}
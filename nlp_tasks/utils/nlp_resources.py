@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+spaCy和NLTK的资源在第一次使用时才加载，每个进程只加载一次。spaCy模型按(模型名, 不需要的pipeline组件)缓存，
+只需要分词时不加载tagger、parser和ner。
+"""
+
+
+import threading
+from typing import *
+
+from nlp_tasks.common import common_path
+
+
+_lock = threading.RLock()
+_spacy_models = {}
+_nltk = None
+_english_stop_words = None
+_snowball_stemmer = None
+
+
+def get_spacy(name: str = 'en_core_web_sm', disable: Iterable[str] = ()):
+    """
+    :param name: spaCy模型名
+    :param disable: 不加载的pipeline组件，例如('tagger', 'parser', 'ner')
+    :return: spacy.language.Language
+    """
+    key = (name, tuple(sorted(disable)))
+    if key not in _spacy_models:
+        with _lock:
+            if key not in _spacy_models:
+                import spacy
+                _spacy_models[key] = spacy.load(name, disable=list(key[1]))
+    return _spacy_models[key]
+
+
+class LazySpacy:
+    """
+    和spacy.load的结果用法一样，第一次调用或者访问属性时才通过get_spacy加载
+    """
+
+    def __init__(self, name: str = 'en_core_web_sm', disable: Iterable[str] = ()):
+        self.name = name
+        self.disable = tuple(disable)
+
+    def get(self):
+        return get_spacy(self.name, disable=self.disable)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __getattr__(self, item):
+        # 只有name和disable之外的属性才会到这里
+        if item in ('name', 'disable') or item.startswith('__'):
+            raise AttributeError(item)
+        return getattr(self.get(), item)
+
+
+def get_nltk():
+    """
+    :return: 加上了external_data_dir下的nltk_data的nltk模块
+    """
+    global _nltk
+    if _nltk is None:
+        with _lock:
+            if _nltk is None:
+                import nltk
+                nltk.data.path.append(common_path.external_data_dir + '/nltk_data')
+                _nltk = nltk
+    return _nltk
+
+
+def get_english_stop_words() -> FrozenSet[str]:
+    global _english_stop_words
+    if _english_stop_words is None:
+        get_nltk()
+        with _lock:
+            if _english_stop_words is None:
+                from nltk.corpus import stopwords
+                _english_stop_words = frozenset(stopwords.words('english'))
+    return _english_stop_words
+
+
+def get_snowball_stemmer():
+    global _snowball_stemmer
+    if _snowball_stemmer is None:
+        nltk = get_nltk()
+        with _lock:
+            if _snowball_stemmer is None:
+                _snowball_stemmer = nltk.stem.SnowballStemmer('english')
+    return _snowball_stemmer
@@ -1,7 +1,7 @@
 from typing import List
 import re
 
-import nltk
+from nlp_tasks.utils import nlp_resources
 
 
 class BaseSentenceSegmenter:
@@ -33,7 +33,7 @@ class NltkSentenceSegmenter(BaseSentenceSegmenter):
         super().__init__(configuration)
 
     def _inner_sent_tokenize(self, line: str) -> List[str]:
-        return nltk.sent_tokenize(line)
+        return nlp_resources.get_nltk().sent_tokenize(line)
 
 
 class ConstituencyParseSentenceSegmenter(BaseSentenceSegmenter):
@@ -45,7 +45,7 @@ class ConstituencyParseSentenceSegmenter(BaseSentenceSegmenter):
         super().__init__(configuration)
 
     def _inner_sent_tokenize(self, line: str) -> List[str]:
-        return nltk.sent_tokenize(line)
+        return nlp_resources.get_nltk().sent_tokenize(line)
 
 
 class SimpleChineseSentenceSegmenter(BaseSentenceSegmenter):
@@ -5,13 +5,12 @@ import re
 import sys
 
 import jieba
-import spacy
-from nltk import tokenize
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 
 from nlp_tasks.utils import word_processor
 from nlp_tasks.utils import corenlp_factory
 from nlp_tasks.utils import my_corenlp
+from nlp_tasks.utils import nlp_resources
 
 
 class BaseTokenizer:
@@ -108,7 +107,7 @@ class NltkTokenizer(BaseTokenizer):
     def _inner_segment(self, text):
         if not self.is_valid_text(text):
             return []
-        return tokenize.word_tokenize(text)
+        return nlp_resources.get_nltk().word_tokenize(text)
 
 
 class StanfordTokenizer(BaseTokenizer):
@@ -137,12 +136,13 @@ class SpacyTokenizer(BaseTokenizer):
 
     def __init__(self, word_processor=word_processor.BaseWordProcessor()):
         super().__init__(word_processor)
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        # 只用到分词
+        self.spacy_nlp = nlp_resources.LazySpacy("en_core_web_sm", disable=("tagger", "parser", "ner"))
 
     def _inner_segment(self, text):
         if not self.is_valid_text(text):
             return []
-        doc = self.spacy_nlp(text, disable=["parser"])
+        doc = self.spacy_nlp(text)
         words = [token.text for token in doc]
         return words
 
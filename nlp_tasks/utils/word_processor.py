@@ -1,13 +1,6 @@
 import abc
 
-import nltk
-from nltk.corpus import stopwords
-
-from nlp_tasks.common import common_path
-
-nltk.data.path.append(common_path.external_data_dir + '/nltk_data')
-stemmer = nltk.stem.SnowballStemmer('english')
-english_stop_words = stopwords.words('english')
+from nlp_tasks.utils import nlp_resources
 
 class WordProcessorInterface:
     """
@@ -93,7 +86,7 @@ class StemProcessor(BaseWordProcessor):
         :param word:
         :return:
         """
-        return stemmer.stem(word)
+        return nlp_resources.get_snowball_stemmer().stem(word)
 
 
 class StopWordProcessor(BaseWordProcessor):
@@ -110,7 +103,7 @@ class StopWordProcessor(BaseWordProcessor):
         :param word:
         :return:
         """
-        if word in english_stop_words:
+        if word in nlp_resources.get_english_stop_words():
             return None
         else:
             return word